@@ -0,0 +1,217 @@
+#####################################################################
+#  Copyright (c) 2024 by Zheqiao Geng
+#  All rights reserved.
+#####################################################################
+#################################################################
+# Closed-loop auto-tuner of the notch loop phases and the NCO
+# calibrations: minimizes the beam harmonic sidebands of the
+# simulated cavity voltage
+#################################################################
+import os
+import multiprocessing
+import numpy as np
+from scipy import optimize
+
+from Sim_Engine import *
+from Param_Set import *
+
+# =================================================
+# define the class
+# =================================================
+class Auto_Tuner():
+    # -------------------------------------------
+    # construction
+    # Input: cfg     - dict of the beam and cavity parameters (see
+    #                  Sim_Engine.DEFAULT_CFG), None for default
+    #        nworker - number of processes evaluating a batch of candidates
+    #                  (None for the number of CPUs, 1 for no child process)
+    #        cache   - object of Result_Cache for the evaluations (None for
+    #                  no cache)
+    # -------------------------------------------
+    def __init__(self, cfg = None, nworker = None, cache = None):
+        # init variables
+        self.cfg     = dict(Sim_Engine.DEFAULT_CFG, **(cfg or {}))
+        self.nworker = os.cpu_count() if nworker is None else max(1, int(nworker))
+        self.cache   = cache
+        self.nfev    = 0                # number of evaluations (simulations)
+
+    # -------------------------------------------
+    # set parameters
+    # Input: ctl_param - dict of scalar parameters of the controller (see
+    #                    Param_Set)
+    #        tables    - dict of per-harmonic notch/NCO arrays, the enabled
+    #                    entries are tuned
+    #        mode      - 'notch' to tune the notch loop phases, 'nco' to tune
+    #                    the NCO phases and amplitudes
+    #        ngrid     - number of phases of the coarse grid search
+    #        maxfev    - max number of evaluations of the refinement
+    #        nsettle   - samples simulated before measuring the sidebands
+    #        nper      - measuring window in periods of the bunch rep freq
+    #        seed      - seed of the noise, the same for all candidates (common
+    #                    random numbers, so that the costs differ only by
+    #                    the tables)
+    #        scenario  - object of Scenario (None for no scenario)
+    # -------------------------------------------
+    def set_param(self, ctl_param, tables,
+                        mode     = 'notch',
+                        ngrid    = 12,
+                        maxfev   = 30,
+                        nsettle  = 2**14,
+                        nper     = 2,
+                        seed     = 0,
+                        scenario = None):
+        # check the input
+        if mode not in ('notch', 'nco'):
+            raise ValueError('Unknown tuning mode: ' + mode)
+
+        # store the results
+        self.ctl_param = dict(ctl_param)
+        self.tables    = {k: np.array(v, dtype = float) for k, v in tables.items()}
+        self.mode      = mode
+        self.ngrid     = ngrid
+        self.maxfev    = maxfev
+        self.nsettle   = nsettle
+        self.nper      = nper
+        self.seed      = seed
+        self.scenario  = scenario
+
+        # harmonics to tune (1 for the first harmonic)
+        ena      = self.tables['notch_ena' if mode == 'notch' else 'nco_ena']
+        self.hsel = np.where(ena == 1)[0] + 1
+
+    # -------------------------------------------
+    # run the tuning
+    # Output: tables - the tuned tables
+    #         cost   - sum of the sideband amplitudes of the tuned harmonics, V
+    # Note: the coarse grid sets the phases of all tuned harmonics to the same
+    #       value per candidate and picks the best one of each sideband
+    #       separately (the harmonics are nearly decoupled). The candidates
+    #       are simulated as a batch in parallel. The result is refined by
+    #       the Powell method on the total cost
+    # -------------------------------------------
+    def run(self):
+        self.nfev = 0
+        if len(self.hsel) == 0:
+            return self.tables, 0.0
+
+        # coarse grid of the phases, evaluated in parallel
+        grid  = np.linspace(-180.0, 180.0, self.ngrid, endpoint = False)
+        cands = []
+        for g in grid:
+            x = self._get_x()
+            x[:self._nphase()] = g
+            cands.append(self._set_x(x))
+        amps  = self.evaluate(cands)
+
+        # best phase of each sideband (+k for the notch/NCO +f, -k for NCO -f)
+        nh = Controller.MAX_NCH
+        x  = self._get_x()
+        for i, h in enumerate(self.hsel):
+            if self.mode == 'notch':
+                x[i] = grid[np.argmin(amps[:, nh+h] + amps[:, nh-h])]
+            else:
+                x[i]                  = grid[np.argmin(amps[:, nh+h])]
+                x[i + len(self.hsel)] = grid[np.argmin(amps[:, nh-h])]
+
+        # refine all parameters together (scaled to similar step sizes)
+        scale = self._scale(x)
+        res   = optimize.minimize(lambda xs: self._cost(xs * scale), x / scale,
+                                  method  = 'Powell',
+                                  options = {'maxfev': self.maxfev, 'xtol': 1e-2})
+
+        self.tables = self._set_x(res.x * scale)
+        return self.tables, float(res.fun)
+
+    # -------------------------------------------
+    # evaluate a batch of candidates
+    # Input:  cands - list of tables
+    # Output: amps  - sideband amplitudes (one row per candidate, harmonics
+    #                 -MAX_NCH ... MAX_NCH), V
+    # -------------------------------------------
+    def evaluate(self, cands):
+        args = [(self.cache, (self.cfg, self.ctl_param, c, self.nsettle, self.nper, self.seed, self.scenario)) \
+                for c in cands]
+        self.nfev += len(args)
+
+        if (self.nworker == 1) or (len(args) == 1):
+            return np.array([_evaluate_tables(a) for a in args])
+
+        ctx = multiprocessing.get_context('spawn')
+        with ctx.Pool(min(self.nworker, len(args))) as pool:
+            return np.array(pool.map(_evaluate_tables, args))
+
+    # -------------------------------------------
+    # private functions
+    # -------------------------------------------
+    def _nphase(self):
+        # number of phase variables
+        return len(self.hsel) * (1 if self.mode == 'notch' else 2)
+
+    def _get_x(self):
+        # variables: notch loop phases, or NCO +/- phases and amplitudes
+        i = self.hsel - 1
+        if self.mode == 'notch':
+            return self.tables['notch_lp'][i].copy()
+        return np.hstack((self.tables['nco_phap'][i],
+                          self.tables['nco_phan'][i],
+                          self.tables['nco_amp'][i]))
+
+    def _set_x(self, x):
+        # tables with the variables applied
+        i, n   = self.hsel - 1, len(self.hsel)
+        tables = {k: v.copy() for k, v in self.tables.items()}
+        if self.mode == 'notch':
+            tables['notch_lp'][i] = x
+        else:
+            tables['nco_phap'][i] = x[:n]
+            tables['nco_phan'][i] = x[n:2*n]
+            tables['nco_amp'][i]  = x[2*n:]
+        return tables
+
+    def _scale(self, x):
+        # step sizes: 30 deg for the phases, 20% for the amplitudes
+        scale = np.full(len(x), 30.0)
+        amp   = x[self._nphase():]
+        scale[self._nphase():] = np.maximum(0.2 * np.abs(amp), 1.0)
+        return scale
+
+    def _cost(self, x):
+        # sum of the sideband amplitudes of the tuned harmonics
+        amps = self.evaluate([self._set_x(x)])[0]
+        nh   = Controller.MAX_NCH
+        return np.sum(amps[nh + self.hsel]) + np.sum(amps[nh - self.hsel])
+
+# =================================================
+# simulate the closed loop with a set of tables and measure the
+# beam harmonic sidebands (module level to run in a child process)
+# Input:  cfg       - dict of the beam and cavity parameters
+#         ctl_param - dict of scalar parameters of the controller
+#         tables    - dict of per-harmonic notch/NCO arrays
+#         nsettle   - samples simulated before measuring
+#         nper      - measuring window in periods of the bunch rep freq
+#         seed      - seed of the noise
+#         scenario  - object of Scenario (None for no scenario)
+# Output: dict of amps - sideband amplitudes (harmonics -MAX_NCH ... MAX_NCH), V
+# =================================================
+def evaluate_tables(cfg, ctl_param, tables, nsettle, nper, seed, scenario = None):
+    np.random.seed(seed)
+    eng = Sim_Engine(cfg)
+    eng.harm.set_param(fs = eng.fs, fb = eng.fb, fif = eng.fif, nh = Controller.MAX_NCH, nper = nper)
+    eng.set_param(Param_Set(ctl_param, tables))
+    if scenario is not None:
+        eng.set_scenario(scenario)
+        scenario.reset()
+
+    while eng.sim_cnt < nsettle + eng.harm.N:
+        eng.run_block()
+
+    _, amps, _ = eng.harm.get()
+    return {'amps': amps}
+
+def _evaluate_tables(args):
+    # evaluate a candidate (with the cache if any)
+    cache, args = args
+    if cache is None:
+        return evaluate_tables(*args)['amps']
+    return cache.call(evaluate_tables, *args)['amps']
+
@@ -0,0 +1,139 @@
+#####################################################################
+#  Copyright (c) 2024 by Zheqiao Geng
+#  All rights reserved.
+#####################################################################
+#################################################################
+# Beam fill pattern, compiled into a sparse kick schedule
+#################################################################
+import numpy as np
+
+# =================================================
+# define the class
+# =================================================
+class Beam_Pattern():
+    # -------------------------------------------
+    # construction
+    # -------------------------------------------
+    def __init__(self):
+        # init variables
+        self.initialized = False    # indicate if initialized or not
+
+    # -------------------------------------------
+    # set parameters
+    # Input: fs    - sampling frequency, Hz
+    #        fb    - bunch rep freq (bucket spacing), Hz
+    #        fill  - relative bunch charge of each bucket over one revolution
+    #                (1.0 for the nominal bunch charge, 0.0 for empty bucket).
+    #                None for uniform filling
+    # Note: the pattern repeats every revolution (len(fill) buckets). Only the
+    #       filled buckets are kept in the schedule: kick_pos are the sample
+    #       offsets of the kicks within a revolution and kick_q are the
+    #       relative charges
+    # -------------------------------------------
+    def set_param(self, fs   = 10.0e6,
+                        fb   = 1.0e6,
+                        fill = None):
+        # check the input (to be done ...)
+        if fill is None:
+            fill = np.ones(1)
+
+        # store the results
+        self.fs   = fs
+        self.fb   = fb
+        self.fill = np.asarray(fill, dtype = float)
+
+        # derived parameters
+        self.Tb_clk   = int(fs / fb)                        # samples per bucket
+        self.nbucket  = len(self.fill)                      # buckets per revolution
+        self.Trev_clk = self.nbucket * self.Tb_clk          # samples per revolution
+
+        # compile the sparse kick schedule
+        sel           = np.nonzero(self.fill)[0]
+        self.kick_pos = sel.astype(np.int64) * self.Tb_clk  # kick offsets in a revolution
+        self.kick_q   = self.fill[sel]                      # relative charges of kicks
+        self.nkick    = len(sel)                            # number of kicks per revolution
+
+        # declare initialized
+        self.initialized = True
+
+    # -------------------------------------------
+    # locate the first kick at or after a sample
+    # Input:  cnt - sample index
+    # Output: k   - index of the kick in the schedule (-1 if no kick)
+    #         pos - sample index of the kick (-1 if no kick)
+    # -------------------------------------------
+    def locate(self, cnt):
+        if self.nkick == 0:
+            return -1, -1
+
+        rev, off = divmod(int(cnt), self.Trev_clk)
+        k = int(np.searchsorted(self.kick_pos, off))
+        if k == self.nkick:
+            rev += 1
+            k    = 0
+
+        return k, rev * self.Trev_clk + int(self.kick_pos[k])
+
+    # -------------------------------------------
+    # get the kick following a kick (O(1), for per-sample simulation)
+    # Input:  k   - index of the current kick in the schedule
+    #         pos - sample index of the current kick
+    # Output: same as locate
+    # -------------------------------------------
+    def next(self, k, pos):
+        if self.nkick == 0:
+            return -1, -1
+
+        kn = k + 1
+        if kn == self.nkick:
+            return 0,  pos - int(self.kick_pos[k]) + self.Trev_clk + int(self.kick_pos[0])
+        else:
+            return kn, pos - int(self.kick_pos[k]) + int(self.kick_pos[kn])
+
+    # -------------------------------------------
+    # get all kicks in a block (for block simulation)
+    # Input:  cnt - sample index of the block start
+    #         n   - number of samples of the block
+    # Output: off - sample offsets of the kicks relative to cnt
+    #         q   - relative charges of the kicks
+    # -------------------------------------------
+    def kicks_in_block(self, cnt, n):
+        if (self.nkick == 0) or (n <= 0):
+            return np.zeros(0, dtype = np.int64), np.zeros(0)
+
+        # candidates from all revolutions touched by the block
+        r0  = int(cnt) // self.Trev_clk
+        r1  = (int(cnt) + n - 1) // self.Trev_clk
+        pos = np.add.outer(np.arange(r0, r1 + 1, dtype = np.int64) * self.Trev_clk,
+                           self.kick_pos).ravel() - int(cnt)
+        q   = np.tile(self.kick_q, r1 - r0 + 1)
+
+        # keep the ones inside the block
+        sel = (pos >= 0) & (pos < n)
+        return pos[sel], q[sel]
+
+# =================================================
+# generate a fill pattern with bunch trains
+# Input: nbucket - number of buckets per revolution
+#        ntrain  - number of trains (evenly distributed)
+#        nbunch  - number of bunches per train
+#        spacing - bunch spacing in a train, buckets
+#        q_rms   - relative rms bunch-to-bunch charge variation
+#        seed    - seed of the random charge variation
+# Output: fill   - relative bunch charge of each bucket
+# =================================================
+def gen_fill_pattern(nbucket = 20000,
+                     ntrain  = 10,
+                     nbunch  = 100,
+                     spacing = 1,
+                     q_rms   = 0.0,
+                     seed    = None):
+    fill  = np.zeros(nbucket)
+    start = np.arange(ntrain) * (nbucket // ntrain)
+    idx   = np.add.outer(start, np.arange(nbunch) * spacing).ravel()
+    idx   = idx[idx < nbucket]
+
+    rng       = np.random.default_rng(seed)
+    fill[idx] = 1.0 + q_rms * rng.standard_normal(len(idx))
+    return fill
+
@@ -5,11 +5,28 @@
 #################################################################
 # Cavity model for beam loading study
 #################################################################
+import cmath
 import numpy as np
 from scipy import signal
 
 from llrflibs.rf_noise import *
 
+from Beam_Pattern import *
+from Detuning import *
+from Precision import *
+
+# =================================================
+# coefficients of the cavity equation compiled by set_param
+# =================================================
+class Cavity_Coef():
+    __slots__ = ('a', 'b', 'kick')
+    def __init__(self, a, b, kick):
+        # scalars are kept as Python numbers (faster per-sample arithmetic)
+        a, b, kick = [x.item() if np.ndim(x) == 0 else x for x in (a, b, kick)]
+        self.a    = a           # state transition
+        self.b    = b           # drive input gain
+        self.kick = kick        # beam kick of a nominal bunch
+
 # =================================================
 # define the class
 # =================================================
@@ -22,6 +39,12 @@ class Cavity():
         self.vc_last     = 0.0              # temp var for solving cavity equ, V
         self.cnt         = 131              # counter of sim steps (with arbitrary init time)
         self.noise       = np.zeros(2048)   # noise series
+        self.kick_k      = -1               # index of the next beam kick in the pattern
+        self.kick_next   = -1               # sample index of the next beam kick
+        self.seg_i       = 0                # position in the detuning segment
+        self.seg_n       = 0                # length of the detuning segment
+        self.vc2_acc     = 0.0              # accumulated |vc|^2 in the detuning segment
+        self.rtype, self.ctype = get_types('double')    # types of the states and signals
         self.initialized = False            # indicate if initialized or not
 
     # -------------------------------------------
@@ -36,6 +59,11 @@ class Cavity():
     #        fs        - sampling frequency, Hz
     #        fif       - IF frequency, Hz
     #        npsd      - noise PSD, dB/Hz
+    #        pattern   - object of Beam_Pattern (None for uniform filling)
+    #        dyn_det   - object of Detuning for time-varying detuning, which 
+    #                    adds to the fixed detuning (None for fixed detuning)
+    #        precision - 'double' or 'single' precision of the states and 
+    #                    signals (see Precision)
     # -------------------------------------------        
     def set_param(self, frf       = 650.0e6, 
                         RoQ       = 106.5, 
@@ -46,7 +74,10 @@ class Cavity():
                         phib      = 0.0,
                         fs        = 10.0e6,
                         fif       = 1.0e6,
-                        npsd      = -135.0):
+                        npsd      = -135.0,
+                        pattern   = None,
+                        dyn_det   = None,
+                        precision = 'double'):
         # check the input (to be done ...)
         
         # store the results
@@ -59,6 +90,8 @@ class Cavity():
         self.fs     = fs
         self.fif    = fif
         self.npsd   = npsd
+        self.rtype, self.ctype = get_types(precision)
+        self.noise  = self.noise.astype(self.rtype)
         
         # derived cavity parameters
         self.wrf    = 2.0 * np.pi * frf                     # RF angular freq, rad/s
@@ -68,6 +101,7 @@ class Cavity():
         self.wh     = self.w0 / (2.0 * QL)                  # half bandwidth, rad/s
         self.RL     = RoQ * QL                              # loaded resistance (circular machine), Ohm
         self.Ts     = 1.0 / fs                              # sampling time, s
+        self.w_if   = 2.0 * np.pi * fif                     # IF angular freq, rad/s
         self.Tb_clk = int(fs / fb)                          # determine when to add beam loading of a bunch
        
         # parameters for beam induced signal calculation
@@ -75,6 +109,23 @@ class Cavity():
         self.gl     = 1.0 + 1j * self.wh / self.w0p
         self.dwl    = self.w0p - self.wc        
 
+        # coefficients of the cavity equation
+        self.coef   = Cavity_Coef(*self._coef(self.dw))
+
+        # beam fill pattern (uniform filling by default)
+        if pattern is None:
+            pattern = Beam_Pattern()
+            pattern.set_param(fs = fs, fb = fb)
+
+        self.pattern = pattern
+        self.kick_k, self.kick_next = self.pattern.locate(self.cnt)
+
+        # time-varying detuning (coefficients refreshed at next step)
+        self.dyn_det = dyn_det
+        self.seg_i   = 0
+        self.seg_n   = 0
+        self.vc2_acc = 0.0
+
         # declare initialized
         self.initialized = True
 
@@ -85,6 +136,29 @@ class Cavity():
         self.vc_last = 0.0
         self.cnt     = 131
 
+        if self.initialized:
+            self.kick_k, self.kick_next = self.pattern.locate(self.cnt)
+            self.seg_i   = 0
+            self.seg_n   = 0
+            self.vc2_acc = 0.0
+            if self.dyn_det is not None:
+                self.dyn_det.reset()
+
+    # -------------------------------------------
+    # change the bunch charge during simulation
+    # Input: charge - bunch charge, C
+    # -------------------------------------------
+    def set_charge(self, charge):
+        # check if initialized
+        if not self.initialized:
+            return
+
+        # update the beam kicks
+        self.Qb   = charge
+        self.coef = Cavity_Coef(*self._coef(self.dw))
+        if self.seg_n > 0:
+            _, _, self.seg_kick = self._coef(self.seg_dw)
+
     # -------------------------------------------
     # simulate a step
     # Input: vf_if  - IF signal of the cavity drive
@@ -95,49 +169,173 @@ class Cavity():
             return (0.0,)*4
         
         # update noise series if needed
-        if self.cnt % 2048 == 0:
+        cnt = self.cnt
+        if cnt % 2048 == 0:
             self._gen_noise()
         
-        # get the cavity drive phasor
+        # get the cavity drive phasor (demodulated with the conjugate of the
+        # carrier phasor of the sample)
         # Note: 1. here we do not make the filtering, because the 2*fif term will
         #       be filtered by the cavity dyanmic automatically (i.e., the cavity 
         #       bandwidth is much smaller than fif)
         #       2. the factor 2.0 is needed to keep the amplitude of the response        
-        vf = 2.0 * vf_if * np.exp(-1j * 2.0 * np.pi * self.fif * \
-                                  self.cnt * self.Ts)
+        lo = cmath.exp(1j * (self.w_if * cnt * self.Ts))
+        vf = 2.0 * vf_if * lo.conjugate()
+        
+        # do a step of cavity simulation (fixed or time-varying detuning)
+        if self.dyn_det is None:
+            c = self.coef
+            a, b, kick = c.a, c.b, c.kick
+        else:
+            if self.seg_i == self.seg_n:
+                self._next_segment()
+            a, b, kick = self.seg_a[self.seg_i], self.seg_b[self.seg_i], self.seg_kick[self.seg_i]
         
-        # do a step of cavity simulation
-        vc = (1.0 - self.Ts * (self.wh - 1j*self.dwl)) * self.vc_last + \
-             self.wh * self.Ts * vf
+        vc = a * self.vc_last + b * vf
         
         # add the beam loading
-        if self.cnt % self.Tb_clk == 0:
-            vc += 2.0 * self.wh * self.RL * self.Qb * self.gl * \
-                  np.exp(1j * (np.pi - self.phib))
+        if cnt == self.kick_next:
+            vc += kick * self.pattern.kick_q[self.kick_k]
+            self.kick_k, self.kick_next = self.pattern.next(self.kick_k, self.kick_next)
+
+        # accumulate the cavity voltage for Lorentz force detuning
+        if self.dyn_det is not None:
+            self.vc2_acc += vc.real**2 + vc.imag**2
+            self.seg_i   += 1
         
         # get the IF signal with noise
-        vc_if = np.real(vc * np.exp(1j * 2.0 * np.pi * self.fif * \
-                                    self.cnt * self.Ts)) * \
-                     (1.0 + self.noise[self.cnt % 2048])
+        vc_if = (vc * lo).real * (1.0 + self.noise[cnt % 2048])
         
         # get the reflection 
         vr_if = vc_if - vf_if
         
         # update the variable for next step
-        self.vc_last = vc
-        self.cnt += 1
+        self.vc_last = vc if self.ctype is np.complex128 else self.ctype(vc)
+        self.cnt     = cnt + 1
             
+        # return the result
+        return self.vc_last, vc_if, vf_if, vr_if
+
+    # -------------------------------------------
+    # simulate a block of steps (open loop, vectorized)
+    # Input: vf_if  - IF signal array of the cavity drive
+    # Note: the results are the same as calling sim_step sample by sample
+    # -------------------------------------------
+    def sim_block(self, vf_if):
+        # check if initialized
+        vf_if = np.asarray(vf_if, dtype = float)
+        n     = len(vf_if)
+        if not self.initialized:
+            return (np.zeros(n),)*4
+
+        idx = self.cnt + np.arange(n)
+        lo  = np.exp(1j * (self.w_if * idx * self.Ts))
+
+        # input of the cavity equation: drive and beam loading kicks (the 
+        # carrier phasors are calculated in double precision)
+        vf     = (2.0 * vf_if * np.conj(lo)).astype(self.ctype)
+        off, q = self.pattern.kicks_in_block(self.cnt, n)
+
+        # fixed detuning: cavity equation as a 1st-order IIR filter
+        if self.dyn_det is None:
+            c       = self.coef
+            u       = c.b * vf
+            u[off] += c.kick * q.astype(self.rtype)
+            vc, _   = signal.lfilter(np.ones(1, dtype = self.rtype), 
+                                     np.array([1.0, -c.a], dtype = self.ctype), u, 
+                                     zi = np.array([c.a * self.vc_last], dtype = self.ctype))
+
+        # time-varying detuning: segment by segment with coefficient arrays
+        else:
+            vc  = np.zeros(n, dtype = self.ctype)
+            qb  = np.zeros(n, dtype = self.rtype)
+            qb[off] = q
+            i   = 0
+            while i < n:
+                if self.seg_i == self.seg_n:
+                    self._next_segment()
+                m  = min(self.seg_n - self.seg_i, n - i)
+                sl = slice(self.seg_i, self.seg_i + m)
+                u  = self.seg_b[sl] * vf[i:i+m] + self.seg_kick[sl] * qb[i:i+m]
+                vc[i:i+m] = self._ltv_filter(self.seg_a[sl], u, 
+                                             vc[i-1] if i > 0 else self.vc_last)
+                self.vc2_acc += np.sum(vc[i:i+m].real**2 + vc[i:i+m].imag**2)
+                self.seg_i   += m
+                i += m
+
+        # get the IF signal with noise and the reflection
+        vc_if = np.real(vc * lo.astype(self.ctype)) * (1.0 + self._noise_block(n))
+        vr_if = vc_if - vf_if.astype(self.rtype)
+
+        # update the variables for next step
+        if n > 0:
+            self.vc_last = vc[-1]
+        self.cnt += n
+        self.kick_k, self.kick_next = self.pattern.locate(self.cnt)
+
         # return the result
         return vc, vc_if, vf_if, vr_if
 
     # -------------------------------------------
     # private functions    
     # -------------------------------------------
+    def _coef(self, dw):
+        # coefficients of the cavity equation for the detuning dw (rad/s, 
+        # scalar or array): a - state transition, b - drive input, 
+        # kick - beam kick of a nominal bunch
+        w0   = self.wc + dw
+        wh   = w0 / (2.0 * self.QL)
+        w0p  = np.sqrt(w0**2 - wh**2)
+        gl   = 1.0 + 1j * wh / w0p
+        dwl  = w0p - self.wc
+        a    = 1.0 - self.Ts * (wh - 1j*dwl)
+        b    = wh * self.Ts
+        kick = 2.0 * wh * self.RL * self.Qb * gl * np.exp(1j * (np.pi - self.phib))
+        return self.ctype(a), self.rtype(b), self.ctype(kick)
+
+    def _next_segment(self):
+        # update the mechanical modes with the last segment and get the 
+        # coefficient arrays of the next segment
+        if self.seg_n > 0:
+            self.dyn_det.update_lfd(self.vc2_acc / self.seg_n)
+
+        det = self.dyn_det.get_block(self.dyn_det.nseg)
+        self.seg_dw  = self.dw + 2.0 * np.pi * det
+        self.seg_a, self.seg_b, self.seg_kick = self._coef(self.seg_dw)
+        self.seg_i   = 0
+        self.seg_n   = len(det)
+        self.vc2_acc = 0.0
+
+    def _ltv_filter(self, a, u, y0):
+        # solve y[k] = a[k] * y[k-1] + u[k] with the cumulative products of a
+        # (in chunks to keep the products well conditioned), along axis 0
+        y = np.zeros(u.shape, dtype = self.ctype)
+        for i in range(0, len(u), 4096):
+            p  = np.cumprod(a[i:i+4096], axis = 0)
+            y[i:i+4096] = p * (y0 + np.cumsum(u[i:i+4096] / p, axis = 0))
+            y0 = y[min(i + 4096, len(u)) - 1]
+        return y
+
+    def _noise_block(self, n):
+        # collect the noise series of n samples starting from cnt, the noise 
+        # series is regenerated at the same samples as in sim_step
+        nz = np.zeros((n,) + self.noise.shape[:-1], dtype = self.rtype)
+        i  = 0
+        while i < n:
+            k = (self.cnt + i) % 2048
+            if k == 0:
+                self._gen_noise()
+            m = min(2048 - k, n - i)
+            nz[i:i+m] = self.noise[..., k:k+m].T
+            i += m
+        return nz
+
     def _gen_noise(self):
-        _, self.noise, _, _ = gen_noise_from_psd(np.array([10.0, 100.0]), 
-                                                 np.array([self.npsd, self.npsd]), 
-                                                 self.fs, 
-                                                 2048)        
+        _, noise, _, _ = gen_noise_from_psd(np.array([10.0, 100.0]), 
+                                            np.array([self.npsd, self.npsd]), 
+                                            self.fs, 
+                                            2048)
+        self.noise = noise.astype(self.rtype)        
 
        
 
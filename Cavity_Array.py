@@ -0,0 +1,190 @@
+#####################################################################
+#  Copyright (c) 2024 by Zheqiao Geng
+#  All rights reserved.
+#####################################################################
+#################################################################
+# Multi-cavity model of an RF station (several cavities driven by
+# one klystron), vectorized over the cavities
+#################################################################
+import cmath
+import numpy as np
+from scipy import signal
+
+from llrflibs.rf_noise import *
+
+from Cavity import *
+
+# =================================================
+# define the class
+# =================================================
+class Cavity_Array(Cavity):
+    # -------------------------------------------
+    # construction
+    # -------------------------------------------
+    def __init__(self):
+        # init variables
+        Cavity.__init__(self)
+        self.ncav = 0                       # number of cavities
+
+    # -------------------------------------------
+    # set parameters
+    # Input: the same as Cavity.set_param, but RoQ, QL and detuning can be
+    #        arrays with one element per cavity, and
+    #        cal_gain  - calibration gains of the cavity probes
+    #        cal_pha   - calibration phases of the cavity probes, deg
+    #        precision - 'double' or 'single' precision (see Precision)
+    # Note: the beam (charge, fill pattern, phase) is the same for all
+    #       cavities, time-varying detuning is not supported
+    # -------------------------------------------
+    def set_param(self, frf       = 650.0e6,
+                        RoQ       = 106.5,
+                        QL        = 1.5e5,
+                        detuning  = 0.0,
+                        charge    = 2.234e-8,
+                        fb        = 1.0e6,
+                        phib      = 0.0,
+                        fs        = 10.0e6,
+                        fif       = 1.0e6,
+                        npsd      = -135.0,
+                        pattern   = None,
+                        cal_gain  = 1.0,
+                        cal_pha   = 0.0,
+                        precision = 'double'):
+        # per-cavity parameters as arrays of the same length
+        RoQ, QL, detuning, cal_gain, cal_pha = np.broadcast_arrays(
+                np.atleast_1d(np.asarray(RoQ,      dtype = float)),
+                np.atleast_1d(np.asarray(QL,       dtype = float)),
+                np.atleast_1d(np.asarray(detuning, dtype = float)),
+                np.atleast_1d(np.asarray(cal_gain, dtype = float)),
+                np.atleast_1d(np.asarray(cal_pha,  dtype = float)))
+        self.ncav = len(QL)
+
+        # the derived parameters are computed vectorized by the base class
+        Cavity.set_param(self, frf       = frf,
+                               RoQ       = RoQ,
+                               QL        = QL,
+                               detuning  = detuning,
+                               charge    = charge,
+                               fb        = fb,
+                               phib      = phib,
+                               fs        = fs,
+                               fif       = fif,
+                               npsd      = npsd,
+                               pattern   = pattern,
+                               precision = precision)
+
+        # calibration of the cavity probes for the vector sum
+        self.cal = cal_gain * np.exp(1j * cal_pha * np.pi / 180.0)
+
+        # states per cavity
+        self.vc_last = np.zeros(self.ncav, dtype = self.ctype)
+        self.noise   = np.zeros((self.ncav, 2048), dtype = self.rtype)
+
+    # -------------------------------------------
+    # reset
+    # -------------------------------------------
+    def reset(self):
+        Cavity.reset(self)
+        self.vc_last = np.zeros(self.ncav, dtype = self.ctype)
+
+    # -------------------------------------------
+    # calibrated vector sum of the cavity voltages
+    # Input: vc - cavity voltage phasors (last axis for the cavities)
+    # -------------------------------------------
+    def vsum(self, vc):
+        return np.dot(vc, self.cal)
+
+    # -------------------------------------------
+    # simulate a step
+    # Input: vf_if  - IF signal of the cavity drive (common to all cavities)
+    # Output: vc, vc_if, vr_if are arrays with one element per cavity
+    # -------------------------------------------
+    def sim_step(self, vf_if):
+        # check if initialized
+        if not self.initialized:
+            return (0.0,)*4
+
+        # update noise series if needed
+        cnt = self.cnt
+        if cnt % 2048 == 0:
+            self._gen_noise()
+
+        # get the cavity drive phasor (see Cavity.sim_step)
+        lo = cmath.exp(1j * (self.w_if * cnt * self.Ts))
+        vf = 2.0 * vf_if * lo.conjugate()
+
+        # do a step of cavity simulation for all cavities
+        c  = self.coef
+        vc = c.a * self.vc_last + c.b * vf
+
+        # add the beam loading
+        if cnt == self.kick_next:
+            vc += c.kick * self.pattern.kick_q[self.kick_k]
+            self.kick_k, self.kick_next = self.pattern.next(self.kick_k, self.kick_next)
+
+        # get the IF signal with noise
+        vc_if = np.real(vc * lo) * (1.0 + self.noise[:, cnt % 2048])
+
+        # get the reflection
+        vr_if = vc_if - vf_if
+
+        # update the variable for next step
+        self.vc_last = vc.astype(self.ctype)
+        self.cnt     = cnt + 1
+
+        # return the result
+        return self.vc_last, vc_if, vf_if, vr_if
+
+    # -------------------------------------------
+    # simulate a block of steps (open loop, vectorized)
+    # Input: vf_if  - IF signal array of the cavity drive
+    # Output: vc, vc_if, vr_if are arrays of shape (n, ncav)
+    # -------------------------------------------
+    def sim_block(self, vf_if):
+        # check if initialized
+        vf_if = np.asarray(vf_if, dtype = float)
+        n     = len(vf_if)
+        if not self.initialized:
+            return (np.zeros(n),)*4
+
+        idx = self.cnt + np.arange(n)
+        lo  = np.exp(1j * (self.w_if * idx * self.Ts))
+
+        # input of the cavity equations: drive and beam loading kicks
+        c      = self.coef
+        vf     = (2.0 * vf_if * np.conj(lo)).astype(self.ctype)
+        off, q = self.pattern.kicks_in_block(self.cnt, n)
+        u      = np.outer(vf, c.b).astype(self.ctype)
+        u[off] += np.outer(q.astype(self.rtype), c.kick)
+
+        # cavity equation of each cavity as a 1st-order IIR filter (constant 
+        # pole, see Cavity.sim_block)
+        vc = np.zeros(u.shape, dtype = self.ctype)
+        for k in range(self.ncav):
+            vc[:, k], _ = signal.lfilter(np.ones(1, dtype = self.rtype),
+                                         np.array([1.0, -c.a[k]], dtype = self.ctype), u[:, k],
+                                         zi = np.array([c.a[k] * self.vc_last[k]], dtype = self.ctype))
+
+        # get the IF signal with noise and the reflection
+        vc_if = np.real(vc * lo.astype(self.ctype)[:, None]) * (1.0 + self._noise_block(n))
+        vr_if = vc_if - vf_if.astype(self.rtype)[:, None]
+
+        # update the variables for next step
+        if n > 0:
+            self.vc_last = vc[-1]
+        self.cnt += n
+        self.kick_k, self.kick_next = self.pattern.locate(self.cnt)
+
+        # return the result
+        return vc, vc_if, vf_if, vr_if
+
+    # -------------------------------------------
+    # private functions
+    # -------------------------------------------
+    def _gen_noise(self):
+        for i in range(self.ncav):
+            _, self.noise[i], _, _ = gen_noise_from_psd(np.array([10.0, 100.0]),
+                                                        np.array([self.npsd, self.npsd]),
+                                                        self.fs,
+                                                        2048)
+
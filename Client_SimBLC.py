@@ -0,0 +1,264 @@
+#####################################################################
+#  Copyright (c) 2024 by Zheqiao Geng
+#  All rights reserved.
+#####################################################################
+#################################################################
+# Channel Access client of the SimBLC soft IOC: concurrent
+# parameter puts with completion callbacks, DAQ waveforms received
+# by monitors and assembled per block with the sequence number PV,
+# and a live plot redrawn at a bounded frame rate
+#
+# Note: the waveforms have DAQ_SIZE elements, EPICS_CA_MAX_ARRAY_BYTES
+#       must be at least 8*DAQ_SIZE (set before importing epics)
+#################################################################
+import os
+import time
+import threading
+import matplotlib.pyplot as plt
+
+os.environ.setdefault('EPICS_CA_MAX_ARRAY_BYTES', str(2**20))
+import epics
+
+from DAQ_Channels import *
+
+# =================================================
+# define the class
+# =================================================
+class Client_SimBLC():
+    # -------------------------------------------
+    # class variables
+    # -------------------------------------------
+    DAQ_PVS = {'vc_if':  'MON-VC-IF',       # VC IF, V
+               'vc_a':   'MON-VC-A',        # VC amplitude, V
+               'vc_p':   'MON-VC-P',        # VC phase, deg
+               'time_x': 'MON-TIME-X',      # time x axis, us
+               'spec_f': 'MON-SPEC-F',      # VC IF spec freq, Hz
+               'spec_a': 'MON-SPEC-A'}      # VC IF spec amplitude, dB
+    SEQ_PV  = 'MON-DAQ-SEQ'                 # DAQ block sequence number
+
+    # -------------------------------------------
+    # construction
+    # Input: prefix  - PV name prefix of the job
+    #        timeout - timeout of the connections and the puts, s
+    # -------------------------------------------
+    def __init__(self, prefix = 'SGE-BLC-JOBSIM:', timeout = 2.0):
+        # init variables
+        self.prefix   = prefix
+        self.timeout  = timeout
+        self.pvs      = {}                  # connected PVs by name
+        self.callback = None                # function called with a DAQ block
+        self.mon_pvs  = []                  # PVs of the monitors
+        self.mon_keys = {}                  # waveforms of a block (key -> PV name)
+        self.daq      = {}                  # latest waveforms received
+        self.fresh    = set()               # waveforms updated since the last block
+        self.seq      = 0                   # sequence number of the latest block
+        self.block    = {}                  # waveforms of the latest block
+        self.dropped  = 0                   # incomplete blocks (waveforms missed by the monitors)
+        self.lock     = threading.Lock()
+        self.cond     = threading.Condition(self.lock)
+
+    # -------------------------------------------
+    # put parameters concurrently
+    # Input:  values   - dict of PV name (without prefix) -> value
+    #         callback - function called with the PV name when a put is
+    #                    complete (None for no callback)
+    # Output: True if all puts completed within the timeout
+    # Note: all puts are issued before waiting, so they are processed in
+    #       parallel by the IOC instead of one round trip per PV
+    # -------------------------------------------
+    def put_params(self, values, callback = None):
+        done = threading.Semaphore(0)
+        def on_done(pvname = None, **kws):
+            if callback is not None:
+                callback(pvname[len(self.prefix):])
+            done.release()
+
+        # issue the puts (the connections are made concurrently as well)
+        pvs = [self._pv(name) for name in values]
+        for pv, val in zip(pvs, values.values()):
+            if not pv.wait_for_connection(self.timeout):
+                print('ERROR: PV ' + pv.pvname + ' not connected!')
+                return False
+            pv.put(val, wait = False, callback = on_done)
+
+        # wait for the completions
+        for pv in pvs:
+            if not done.acquire(timeout = self.timeout):
+                print('ERROR: Put of PV ' + pv.pvname + ' not completed!')
+                return False
+        return True
+
+    # -------------------------------------------
+    # execute a command of the job
+    # Input:  name - command name (e.g. 'SET-PARAM-ARRAY', 'RESET')
+    #         hold - time the command PV is held at 1, s (for the command
+    #                handler of the IOC to see it)
+    # Output: True if the command is completed
+    # -------------------------------------------
+    def command(self, name, hold = 0.5):
+        pv = self._pv('CMD-' + name)
+        if not pv.wait_for_connection(self.timeout):
+            print('ERROR: PV ' + pv.pvname + ' not connected!')
+            return False
+        ok = pv.put(1, wait = True, timeout = self.timeout) == 1
+        time.sleep(hold)
+        return ok and (pv.put(0, wait = True, timeout = self.timeout) == 1)
+
+    # -------------------------------------------
+    # enable the optional DAQ channels of the IOC
+    # Input:  names - list of the channel names (see DAQ_Channels)
+    # Output: True if the command is completed
+    # -------------------------------------------
+    def set_channels(self, names):
+        return self.put_params({'SET-DAQ-CHAN': channel_mask(names)}) and \
+               self.command('SET-DAQ-CHAN')
+
+    # -------------------------------------------
+    # receive the DAQ blocks by monitors
+    # Input: callback - function called with (seq, daq) for each complete
+    #                   block, daq is a dict of the waveforms (see DAQ_PVS),
+    #                   it runs in the CA thread and should return quickly
+    #                   (None for get_daq only)
+    #        channels - list of the optional channels to receive as well
+    #                   (see DAQ_Channels, they must be enabled in the IOC,
+    #                   otherwise the blocks are incomplete)
+    # Note: the IOC writes the waveforms of a block before its sequence
+    #       number, and the monitors of a circuit are delivered in order,
+    #       so the waveforms received when the sequence number changes form
+    #       one block. A block with a waveform missing (dropped by the CA
+    #       flow control) is skipped
+    # -------------------------------------------
+    def subscribe(self, callback = None, channels = None):
+        self.unsubscribe()
+        self.callback = callback
+        self.mon_keys = dict(Client_SimBLC.DAQ_PVS)
+        for key, _, _ in channel_keys(channels or []):
+            self.mon_keys[key] = channel_pv(key)
+
+        with self.lock:
+            self.fresh.clear()
+        for key, name in self.mon_keys.items():
+            pv = self._pv(name)
+            pv.add_callback(self._on_waveform, key = key)
+            self.mon_pvs.append(pv)
+
+        pv = self._pv(Client_SimBLC.SEQ_PV)
+        pv.add_callback(self._on_seq)
+        self.mon_pvs.append(pv)
+
+    def unsubscribe(self):
+        for pv in self.mon_pvs:
+            pv.clear_callbacks()
+        self.mon_pvs  = []
+        self.callback = None
+
+    # -------------------------------------------
+    # wait for the next DAQ block (after subscribe)
+    # Input:  timeout - max waiting time, s
+    # Output: seq     - sequence number of the block (None if timeout)
+    #         daq     - dict of the waveforms
+    # -------------------------------------------
+    def get_daq(self, timeout = 10.0):
+        with self.cond:
+            seq = self.seq
+            if not self.cond.wait_for(lambda: self.seq != seq, timeout):
+                return None, {}
+            return self.seq, dict(self.block)
+
+    # -------------------------------------------
+    # private functions
+    # -------------------------------------------
+    def _pv(self, name):
+        # get a PV (connected once and kept, monitored with its native type)
+        if name not in self.pvs:
+            self.pvs[name] = epics.PV(self.prefix + name, auto_monitor = True)
+        return self.pvs[name]
+
+    def _on_waveform(self, value = None, key = None, **kws):
+        with self.lock:
+            self.daq[key] = value
+            self.fresh.add(key)
+
+    def _on_seq(self, value = None, **kws):
+        with self.cond:
+            complete = len(self.fresh) == len(self.mon_keys)
+            self.fresh.clear()
+            if not complete:
+                self.dropped += 1
+                return
+            self.seq   = int(value)
+            self.block = dict(self.daq)
+            self.cond.notify_all()
+            block      = self.block
+
+        if self.callback is not None:
+            self.callback(self.seq, block)
+
+# =================================================
+# live plot of the DAQ blocks
+# =================================================
+class Live_Plot():
+    # -------------------------------------------
+    # construction
+    # Input: client - object of Client_SimBLC
+    #        fps    - max frame rate, Hz (the blocks arriving between two
+    #                 frames are skipped, only the latest one is drawn)
+    # -------------------------------------------
+    def __init__(self, client, fps = 5.0):
+        # init variables
+        self.client = client
+        self.fps    = fps
+        self.latest = None                  # latest block (seq, daq), swapped by the CA thread
+        self.drawn  = None                  # sequence number of the drawn block
+
+        # create the figure (as Script_01_read_wfs)
+        self.fig, axs = plt.subplots(2, 2)
+        self.ax_a, self.ax_p, self.ax_if, self.ax_s = axs.ravel()
+        self.ln_a,  = self.ax_a.plot([], [])
+        self.ln_p,  = self.ax_p.plot([], [])
+        self.ln_if, = self.ax_if.plot([], [])
+        self.ln_s,  = self.ax_s.plot([], [])
+        for ax, xl, yl in ((self.ax_a,  'Time ($\\mu$s)', 'Amplitude (V)'),
+                           (self.ax_p,  'Time ($\\mu$s)', 'Phase (deg)'),
+                           (self.ax_if, 'Time ($\\mu$s)', 'VC IF (V)'),
+                           (self.ax_s,  'Frequency (Hz)', 'Spectrum (dB)')):
+            ax.grid()
+            ax.set_xlabel(xl)
+            ax.set_ylabel(yl)
+
+    # -------------------------------------------
+    # show the plot (blocks until the window is closed)
+    # -------------------------------------------
+    def show(self):
+        self.client.subscribe(self._on_daq)
+        timer = self.fig.canvas.new_timer(interval = int(1000.0 / self.fps))
+        timer.add_callback(self._redraw)
+        timer.start()
+        plt.show()
+        timer.stop()
+        self.client.unsubscribe()
+
+    # -------------------------------------------
+    # private functions
+    # -------------------------------------------
+    def _on_daq(self, seq, daq):
+        # keep the latest block only (CA thread)
+        self.latest = (seq, daq)
+
+    def _redraw(self):
+        # draw the latest block if it is new (GUI thread)
+        latest = self.latest
+        if (latest is None) or (latest[0] == self.drawn):
+            return
+
+        seq, daq = latest
+        self.ln_a.set_data (daq['time_x'], daq['vc_a'])
+        self.ln_p.set_data (daq['time_x'], daq['vc_p'])
+        self.ln_if.set_data(daq['time_x'], daq['vc_if'])
+        self.ln_s.set_data (daq['spec_f'], daq['spec_a'])
+        for ax in (self.ax_a, self.ax_p, self.ax_if, self.ax_s):
+            ax.relim()
+            ax.autoscale_view()
+        self.fig.suptitle('DAQ block ' + str(seq))
+        self.fig.canvas.draw_idle()
+        self.drawn = seq
@@ -0,0 +1,311 @@
+#####################################################################
+#  Copyright (c) 2024 by Zheqiao Geng
+#  All rights reserved.
+#####################################################################
+#################################################################
+# Co-simulation of the cavity model with an external controller
+# (firmware model or a separate process) in place of Controller:
+# the cavity is simulated frame by frame (vectorized), the vc_if
+# frames are sent over a local socket and the vf_if frames come
+# back, so the IPC cost is paid once per frame
+#
+# Protocol (both directions, little endian):
+#   header  - seq (uint64, frame number from 0), n (uint32, samples)
+#   payload - n samples (float64): vc_if to the controller, vf_if
+#             back (the same seq and n)
+#   a frame with n = 0 closes the connection
+#
+# Loop latency: the drive of frame k is the reply to frame k - latency
+# (latency >= 1 frames), so up to latency frames are in flight and the
+# controller works on a frame while the cavity simulates the next one.
+# With frame = 1 and latency = 1 the loop is the same as the per-sample
+# loop of Sim_Engine (one sample delay). The delay of frame * latency
+# samples is in the loop, the gains must be stable with it (e.g. Kp up
+# to about 0.5 for frames of 16384 samples at the default station)
+#
+# Usage: python CoSim_Port.py serve <address>   (stand-in controller)
+#        python CoSim_Port.py [nsample]         (frame size benchmark)
+#################################################################
+import sys
+import time
+import queue
+import struct
+import socket
+import threading
+import numpy as np
+
+from Sim_Engine import *
+from Param_Set import *
+
+HDR = struct.Struct('<QI')      # header of a frame: seq, n
+
+# =================================================
+# port of the cavity side (client of the controller)
+# =================================================
+class CoSim_Port():
+    # -------------------------------------------
+    # construction
+    # Input: addr    - address of the controller: path of a Unix socket or
+    #                  (host, port) of TCP (None if sock is given)
+    #        sock    - connected socket (e.g. of socket.socketpair)
+    #        frame   - samples per frame
+    #        latency - loop latency in frames (>= 1)
+    #        timeout - timeout of a reply, s
+    # -------------------------------------------
+    def __init__(self, addr = None, sock = None, frame = 4096, latency = 1, timeout = 10.0):
+        # check the input
+        if (frame < 1) or (latency < 1):
+            raise ValueError('Invalid frame size or latency: ' + str((frame, latency)))
+
+        # init variables
+        self.frame   = int(frame)
+        self.latency = int(latency)
+        self.timeout = timeout
+        self.seq_tx  = 0                # sequence number of the next frame sent
+        self.seq_rx  = 0                # sequence number of the next reply expected
+        self.rx_q    = queue.Queue()    # replies received by the receiving thread
+
+        # connect to the controller
+        if sock is None:
+            family = socket.AF_UNIX if isinstance(addr, str) else socket.AF_INET
+            sock   = socket.socket(family, socket.SOCK_STREAM)
+            sock.settimeout(timeout)
+            sock.connect(addr)
+            if family == socket.AF_INET:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock = sock
+
+        # receive the replies in a thread, so that the replies in flight never
+        # block the controller (frames larger than the socket buffers)
+        self.sock.settimeout(None)
+        threading.Thread(target = self._receive,
+                         daemon = True,
+                         name   = "TRD-COSIM-RX").start()
+
+    # -------------------------------------------
+    # send a frame of vc_if
+    # -------------------------------------------
+    def send(self, vc_if):
+        send_frame(self.sock, self.seq_tx, vc_if)
+        self.seq_tx += 1
+
+    # -------------------------------------------
+    # receive the next vf_if frame
+    # -------------------------------------------
+    def recv(self):
+        try:
+            seq, vf_if = self.rx_q.get(timeout = self.timeout)
+        except queue.Empty:
+            raise RuntimeError('Co-simulation frame ' + str(self.seq_rx) + ' not received')
+        if vf_if is None:
+            raise RuntimeError('Co-simulation connection closed')
+        if seq != self.seq_rx:
+            raise RuntimeError('Co-simulation frame ' + str(seq) + ' received, ' + \
+                               str(self.seq_rx) + ' expected')
+        self.seq_rx += 1
+        return vf_if
+
+    # -------------------------------------------
+    # close the connection (the controller gets a frame with n = 0)
+    # -------------------------------------------
+    def close(self):
+        try:
+            send_frame(self.sock, self.seq_tx, np.zeros(0))
+        except OSError:
+            pass
+        self.sock.close()
+
+    # -------------------------------------------
+    # private functions
+    # -------------------------------------------
+    def _receive(self):
+        # receive the replies until the connection is closed (None)
+        try:
+            while True:
+                self.rx_q.put(recv_frame(self.sock))
+        except (OSError, EOFError):
+            self.rx_q.put((None, None))
+
+# =================================================
+# cavity model driven by an external controller through a port
+# =================================================
+class CoSim_Engine():
+    # -------------------------------------------
+    # construction
+    # Input: cfg - dict of the beam and cavity parameters (see
+    #              Sim_Engine.DEFAULT_CFG), None for default
+    # -------------------------------------------
+    def __init__(self, cfg = None):
+        # the cavity of the station (as in Sim_Engine)
+        eng      = Sim_Engine(cfg)
+        self.cfg = eng.cfg
+        self.cav = eng.cav
+        self.fb, self.fs, self.fif = eng.fb, eng.fs, eng.fif
+
+    # -------------------------------------------
+    # simulate the closed loop
+    # Input:  port    - object of CoSim_Port
+    #         nsample - samples to simulate (rounded up to full frames)
+    # Output: dict of arrays of the samples: vc (cavity voltage phasor),
+    #         vc_if, vf_if (drive), vr_if, and time - wall time of the loop, s
+    # Note: the first latency frames are driven by 0. The cavity states are
+    #       continued, so consecutive calls are seamless if the port is kept
+    # -------------------------------------------
+    def run(self, port, nsample):
+        F, L   = port.frame, port.latency
+        nframe = -(-nsample // F)
+        out    = {'vc':    np.zeros(nframe * F, dtype = self.cav.ctype),
+                  'vc_if': np.zeros(nframe * F),
+                  'vf_if': np.zeros(nframe * F),
+                  'vr_if': np.zeros(nframe * F)}
+
+        # drives of the next frames (replies in flight are received later)
+        drives = [np.zeros(F)] * (L - port.seq_tx + port.seq_rx)
+
+        t0 = time.perf_counter()
+        for k in range(nframe):
+            # simulate the frame and send its probe signal
+            i = k * F
+            out['vc'][i:i+F], out['vc_if'][i:i+F], out['vf_if'][i:i+F], out['vr_if'][i:i+F] = \
+                self.cav.sim_block(drives.pop(0) if drives else port.recv())
+            port.send(out['vc_if'][i:i+F])
+
+        out['time'] = time.perf_counter() - t0
+        return out
+
+# =================================================
+# controllers serving a port
+#   handler(vc_if) -> vf_if of the same length, called per frame
+# =================================================
+class Echo_Controller():
+    # -------------------------------------------
+    # echo of the probe signal scaled by gain (0 for the open loop), to test
+    # the port and the latency
+    # -------------------------------------------
+    def __init__(self, gain = 0.0):
+        self.gain = gain
+
+    def __call__(self, vc_if):
+        return self.gain * vc_if
+
+class Standin_Controller():
+    # -------------------------------------------
+    # stand-in of an external controller: Controller.process_block with a
+    # parameter set, the reference of the co-simulation
+    # Input: ps        - object of Param_Set
+    #        cfg       - dict of the beam and cavity parameters (setpoint
+    #                    and precision), None for default
+    #        fb_enable - True for enabling feedback
+    #        ff_enable - True for enabling feedforward
+    # -------------------------------------------
+    def __init__(self, ps, cfg = None, fb_enable = True, ff_enable = True):
+        cfg            = dict(Sim_Engine.DEFAULT_CFG, **(cfg or {}))
+        self.vc_sp     = cfg['vc_sp'] * np.exp(1j * cfg['vc_sp_pha'] * np.pi / 180.0)
+        self.fb_enable = fb_enable
+        self.ff_enable = ff_enable
+        self.ctl       = Controller()
+        self.ctl.set_param(notches   = ps.notches,
+                           ffncos    = ps.ffncos,
+                           precision = cfg['precision'],
+                           **ps.ctl_param)
+
+    def __call__(self, vc_if):
+        _, vf_if = self.ctl.process_block(vc_if, self.vc_sp,
+                                          fb_enable = self.fb_enable,
+                                          ff_enable = self.ff_enable)
+        return vf_if
+
+# =================================================
+# serve a controller on a connected socket until closed
+# Input: sock    - connected socket
+#        handler - controller (see above)
+# =================================================
+def serve_port(sock, handler):
+    try:
+        while True:
+            seq, vc_if = recv_frame(sock)
+            if len(vc_if) == 0:
+                break
+            send_frame(sock, seq, handler(vc_if))
+    except (OSError, EOFError):
+        pass
+    finally:
+        sock.close()
+
+# =================================================
+# serve a controller at an address (one connection after another)
+# Input: addr    - path of a Unix socket or (host, port) of TCP
+#        handler - function creating the controller of a connection
+# =================================================
+def serve_address(addr, handler):
+    family = socket.AF_UNIX if isinstance(addr, str) else socket.AF_INET
+    srv    = socket.socket(family, socket.SOCK_STREAM)
+    if family == socket.AF_INET:
+        srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    srv.bind(addr)
+    srv.listen(1)
+    while True:
+        sock, _ = srv.accept()
+        if family == socket.AF_INET:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        serve_port(sock, handler())
+
+# =================================================
+# port to a controller served by a thread of this process
+# Input:  handler - controller (see above)
+#         frame, latency, timeout - see CoSim_Port
+# Output: object of CoSim_Port
+# =================================================
+def local_port(handler, frame = 4096, latency = 1, timeout = 10.0):
+    sock_a, sock_b = socket.socketpair()
+    threading.Thread(target = serve_port,
+                     args   = (sock_b, handler),
+                     daemon = True,
+                     name   = "TRD-COSIM").start()
+    return CoSim_Port(sock = sock_a, frame = frame, latency = latency, timeout = timeout)
+
+# =================================================
+# send/receive a frame
+# =================================================
+def send_frame(sock, seq, x):
+    x = np.ascontiguousarray(x, dtype = '<f8')
+    sock.sendall(HDR.pack(seq, len(x)) + x.tobytes())
+
+def recv_frame(sock):
+    seq, n = HDR.unpack(_recv_exact(sock, HDR.size))
+    return seq, np.frombuffer(_recv_exact(sock, 8 * n), dtype = '<f8')
+
+def _recv_exact(sock, nbytes):
+    # receive exactly nbytes (EOFError if the connection is closed)
+    buf  = bytearray(nbytes)
+    view = memoryview(buf)
+    i    = 0
+    while i < nbytes:
+        m = sock.recv_into(view[i:])
+        if m == 0:
+            raise EOFError('Co-simulation connection closed')
+        i += m
+    return buf
+
+# =================================================
+# main: serve the stand-in controller (parameters of Engine_Bench
+# with a gain stable with the frame latency), or compare the frame
+# sizes with a local port
+# =================================================
+if __name__ == '__main__':
+    from Engine_Bench import _ctl_setup
+    cfg = dict(Sim_Engine.DEFAULT_CFG)
+    ctl_param, tables = _ctl_setup(cfg, 0, 0)
+    ps  = Param_Set(dict(ctl_param, Kp = 0.5), tables)
+
+    if (len(sys.argv) > 2) and (sys.argv[1] == 'serve'):
+        serve_address(sys.argv[2], lambda: Standin_Controller(ps, cfg))
+    else:
+        nsample = int(sys.argv[1]) if len(sys.argv) > 1 else 2**18
+        for frame in (256, 1024, 4096, 16384):
+            for latency in (1, 2):
+                port = local_port(Standin_Controller(ps, cfg), frame = frame, latency = latency)
+                res  = CoSim_Engine(cfg).run(port, nsample)
+                port.close()
+                print('frame %6d latency %d: %10.0f samples/s, vc %.6e V' % \
+                      (frame, latency, len(res['vc']) / res['time'], np.abs(res['vc'][-1])))
@@ -5,12 +5,14 @@
 #################################################################
 # Assembly of the cavity controller
 #################################################################
-import gc
+import copy
+import cmath
 import numpy as np
 from Controller_PI import * 
 from Controller_Notch import * 
 from Controller_Notch_SS import * 
 from Controller_FF import *
+from Precision import *
 
 # =================================================
 # define the class
@@ -21,6 +23,8 @@ class Controller():
     # -------------------------------------------
     MAX_NCH = 10        # max notch filter (beam harmonics)
     MAX_NCO = 10        # max NCO (beam harmonics)
+    INTERPS = ('hold', 'linear')    # output interpolation of the multi-rate mode
+    BLK_SIZE = 2**16    # chunk size for block processing (bounds memory usage)
 
     # -------------------------------------------
     # construction
@@ -29,6 +33,14 @@ class Controller():
         # init variables
         self.cnt = 0                    # counter of sim steps
         self.buf_demod = None           # demodulation buffer
+        self.idx_demod = 0              # write position of the demodulation buffer
+        self.sum_demod = 0.0            # running sum of the demodulation buffer
+        self.nctl      = 1              # controller update period, samples
+        self.interp    = 'hold'         # output interpolation between the updates
+        self.v_hold    = 0.0            # actuation of the latest update
+        self.v_prev    = 0.0            # actuation of the update before
+        self.probe_last = {}            # internal signals of the latest update (see probe_block)
+        self.rtype, self.ctype = get_types('double')    # types of the signals
         self.initialized = False        # indicate if initialized or not
 
         # create the object of controllers
@@ -43,6 +55,11 @@ class Controller():
         self.num_fb = 0                 # actual number of feedback controller
         self.num_ff = 0                 # actual number of feedforward controller
 
+        self.act_fb = []                # feedback controllers in use
+        self.act_ff = []                # feedforward controllers in use
+        self.par_fb = [None] * len(self.control_fb)     # applied parameters of the controllers
+        self.par_ff = [None] * len(self.control_ff)
+
     # -------------------------------------------
     # set parameters
     # Input: fb      - bunch rep freq, Hz
@@ -54,6 +71,28 @@ class Controller():
     #        Ki      - integral feedback gain
     #        notches - data structure for notch controller
     #        ffncos  - data structure for NCO based feedforward
+    #        state_policy - 'keep' to keep the states of the filters whose 
+    #                  parameters are changed, 'clear' to clear them
+    #        vsum_cal - calibration phasors of the cavity probes for the 
+    #                  vector-sum mode (None for a single cavity). In this mode
+    #                  vc_if contains one IF sample per cavity and the 
+    #                  calibrated vector sum is regulated
+    #        precision - 'double' or 'single' precision of the demodulation 
+    #                  buffer and the signals (see Precision), the states of 
+    #                  the PI/notch/NCO controllers stay in double precision
+    #        nctl    - controller update period in samples (multi-rate mode if
+    #                  > 1): the demodulation runs at fs, the PI, notches and
+    #                  NCOs run at fs/nctl (discretized for the slower clock,
+    #                  the notches with matched poles) on the demodulated 
+    #                  voltage of every nctl-th sample
+    #        interp  - output between the updates: 'hold' to hold the latest
+    #                  update, 'linear' to ramp from the previous update to
+    #                  the latest one over the period (one more period delay)
+    # Note: the parameters are applied incrementally so that it can be called
+    #       during simulation: only changed gains/phases/notch/NCO entries are
+    #       applied. Notches and NCOs are matched by their frequency offsets,
+    #       newly added ones start with cleared states, removed ones are 
+    #       cleared. The demodulation buffer is resized in place
     # -------------------------------------------        
     def set_param(self, fb      = 1.0e6,
                         fs      = 10.0e6,
@@ -63,8 +102,17 @@ class Controller():
                         Kp      = 10.0,
                         Ki      = 0.0,
                         notches = None,
-                        ffncos  = None):
-        # check the input (to be done ...)
+                        ffncos  = None,
+                        state_policy = 'keep',
+                        vsum_cal = None,
+                        precision = 'double',
+                        nctl    = 1,
+                        interp  = 'hold'):
+        # check the input
+        if (int(nctl) != nctl) or (nctl < 1):
+            raise ValueError('Invalid controller update period: ' + str(nctl))
+        if interp not in Controller.INTERPS:
+            raise ValueError('Unknown interpolation: ' + str(interp))
         
         # store the results
         self.fb      = fb
@@ -76,49 +124,54 @@ class Controller():
         self.Ki      = Ki
         self.notches = notches
         self.ffncos  = ffncos
+        self.vsum_cal = None if vsum_cal is None else np.asarray(vsum_cal, dtype = 'complex')
+        self.rtype, self.ctype = get_types(precision)
+        self.nctl    = int(nctl)
+        self.interp  = interp
 
         # derived variables
-        if self.buf_demod is not None:
-            del self.buf_demod
-            gc.collect()
-
-        self.buf_demod = np.zeros(ndemod, dtype = 'complex')
-        self.Ts = 1.0 / fs                  # sampling time, s
+        self.Ts     = 1.0 / fs              # sampling time, s
+        self.fs_ctl = fs / self.nctl        # sampling freq of the controllers, Hz
+        self.w_if   = 2.0 * np.pi * fif     # IF angular freq, rad/s
+        self.lp_rot = np.exp(1j * self.lp_pha)  # loop phase correction phasor
+        self._resize_demod(ndemod, state_policy)
+        self.sum_demod = np.sum(self.buf_demod)
 
         # set the feedback controller
-        self.control_fb[0].set_param(fs = fs, Kp = Kp, Ki = Ki)
-        self.num_fb = 1
+        self._apply(self.control_fb, self.par_fb, 0, 
+                    {'fs': self.fs_ctl, 'Kp': Kp, 'Ki': Ki}, state_policy)
+
+        nt_par = []
         if notches is not None:
             # get the notch parameters
             nt_fn = notches['freq_offs']     # notch frequency offset to carrier, Hz
             nt_fh = notches['half_bw']       # half BW of notch filter, Hz
             nt_g  = notches['gain']          # gain
-            self.num_fb += len(nt_fn)            
-
-            # construct the notch controller
-            for i in range(len(nt_fn)):
-                nctrl = self.control_fb[i + 1]
-                nctrl.set_param(fs   = fs, 
-                                fh   = nt_fh[i], 
-                                fn   = nt_fn[i], 
-                                gain = nt_g[i])
+            nt_par = [{'fs': self.fs_ctl, 'fh': nt_fh[i], 'fn': nt_fn[i], 'gain': nt_g[i]} \
+                      for i in range(len(nt_fn))]
+
+            # matched poles at the decimated clock (see Controller_Notch)
+            if self.nctl > 1:
+                for par in nt_par:
+                    par['matched'] = True
+
+        # construct the notch controller
+        self.act_fb = [self.control_fb[0]] + \
+                      self._assign(self.control_fb, self.par_fb, 1, 'fn', nt_par, state_policy)
+        self.num_fb = len(self.act_fb)
         
         # construct the feedforward controller
-        self.num_ff = 0
+        nco_par = []
         if ffncos is not None:
             # get the nco parameters
             nco_f = ffncos['freq_offs']     # NCO frequency offset to carrier, Hz
             nco_A = ffncos['amp_cal']       # NCO calibration amplitude
             nco_P = ffncos['pha_cal']       # NCO calibration phase, deg
-            self.num_ff += len(nco_f)        
-
-            # construct the FF controller
-            for i in range(len(nco_f)):
-                ffctrl = self.control_ff[i]
-                ffctrl.set_param(fs   = fs,
-                                 fnco = nco_f[i],
-                                 A    = nco_A[i],
-                                 P    = nco_P[i])
+            nco_par = [{'fs': self.fs_ctl, 'fnco': nco_f[i], 'A': nco_A[i], 'P': nco_P[i]} \
+                       for i in range(len(nco_f))]
+
+        self.act_ff = self._assign(self.control_ff, self.par_ff, 0, 'fnco', nco_par, state_policy)
+        self.num_ff = len(self.act_ff)
         
         # declare initialized
         self.initialized = True
@@ -133,7 +186,12 @@ class Controller():
         
         # clear the buffer and vars
         self.buf_demod[:] = 0.0
+        self.idx_demod = 0
+        self.sum_demod = 0.0
         self.cnt = 0
+        self.v_hold = 0.0
+        self.v_prev = 0.0
+        self.probe_last = {}
         
         # reset feedback controllers
         for ctl in self.control_fb:
@@ -145,7 +203,8 @@ class Controller():
             
     # -------------------------------------------
     # simulate a step
-    # Input: vc_if      - IF signal of the cavity voltage, V
+    # Input: vc_if      - IF signal of the cavity voltage (array of the 
+    #                     cavities in vector-sum mode), V
     #        vc_sp      - setpoint phasor of cavity voltage, V
     #        fb_enable  - True for enabling feedback
     #        ff_enable  - True for enabling feedforward
@@ -157,47 +216,315 @@ class Controller():
         if not self.initialized:
             return 0.0
         
-        # demodulation/corr loop phase/calc error
-        vc = self._demod(vc_if) * np.exp(1j * self.lp_pha)
-        vc_err = vc_sp - vc
-        
-        # feedback for a step
-        vfb = 0.0
-        for i in range(self.num_fb):
-            vfb += self.control_fb[i].sim_step(vc_err)
+        # carrier phasor of the sample
+        cnt = self.cnt
+        lo  = cmath.exp(1j * (self.w_if * cnt * self.Ts))
 
-        if not fb_enable:
+        # demodulation/corr loop phase
+        vc = self.ctype(self._demod(vc_if, lo) * self.lp_rot)
+
+        # update the controllers (every nctl samples in multi-rate mode)
+        k = cnt % self.nctl
+        if k == 0:
+            vc_err = vc_sp - vc
+
+            # feedback for a step
             vfb = 0.0
+            for ctl in self.act_fb:
+                vfb += ctl.sim_step(vc_err)
+
+            if not fb_enable:
+                vfb = 0.0
         
-        # feedforward for a step        
-        vff = 0.0
-        for i in range(self.num_ff):
-            vff += self.control_ff[i].sim_step()
-        
-        if not ff_enable:
+            # feedforward for a step        
             vff = 0.0
+            for ctl in self.act_ff:
+                vff += ctl.sim_step()
+        
+            if not ff_enable:
+                vff = 0.0
+
+            self.v_prev, self.v_hold = self.v_hold, vfb + vff
+
+        # actuation held or interpolated between the updates
+        v = self.v_hold
+        if (self.interp == 'linear') and (self.nctl > 1):
+            v = self.v_prev + (v - self.v_prev) * ((k + 1) / self.nctl)
         
         # get the IF signal of the actuation signal
-        vf_if = np.real((vfb + vff) * np.exp(1j * 2.0 * np.pi * self.fif * \
-                                             self.cnt * self.Ts))
+        vf_if = self.rtype((v * lo).real)
             
         # update the variable for next step
-        self.cnt += 1
+        self.cnt = cnt + 1
             
         # return the result
         return vc, vf_if
 
+    # -------------------------------------------
+    # process a block of recorded IF samples (open loop, vectorized)
+    # Input: vc_if      - IF signal array of the cavity voltage, V. Can be an
+    #                     array, a np.memmap or the file name of a .npy file 
+    #                     (opened memory-mapped). Shape (n, ncav) in 
+    #                     vector-sum mode
+    #        vc_sp      - setpoint phasor (scalar or array as long as vc_if), V
+    #        fb_enable  - True for enabling feedback
+    #        ff_enable  - True for enabling feedforward
+    #        out        - optional (vc, vf_if) arrays to write the results, or 
+    #                     a file name prefix to create the .npy files 
+    #                     <out>_vc.npy and <out>_vf_if.npy memory-mapped
+    # Output: vc        - demodulated cavity voltage phasor, V
+    #         vf_if     - IF signal of the actuation signal
+    # Note: the results are identical to calling sim_step sample by sample, 
+    #       the states are continued so that consecutive calls are seamless.
+    #       The input is processed in chunks of BLK_SIZE, so the memory usage
+    #       is bounded if the input and output are memory-mapped
+    # -------------------------------------------
+    def process_block(self, vc_if, vc_sp,
+                            fb_enable = False,
+                            ff_enable = False,
+                            out       = None):
+        # open the input file if needed
+        if isinstance(vc_if, str):
+            vc_if = np.load(vc_if, mmap_mode = 'r')
+        
+        n = len(vc_if)
+
+        # prepare the output
+        if out is None:
+            vc_out = np.zeros(n, dtype = self.ctype)
+            vf_out = np.zeros(n, dtype = self.rtype)
+        elif isinstance(out, str):
+            vc_out = np.lib.format.open_memmap(out + '_vc.npy',    mode = 'w+', 
+                                               dtype = self.ctype, shape = (n,))
+            vf_out = np.lib.format.open_memmap(out + '_vf_if.npy', mode = 'w+', 
+                                               dtype = self.rtype, shape = (n,))
+        else:
+            vc_out, vf_out = out
+
+        # check if initialized
+        if not self.initialized:
+            return vc_out, vf_out
+
+        # process chunk by chunk
+        for i in range(0, n, Controller.BLK_SIZE):
+            j   = min(i + Controller.BLK_SIZE, n)
+            sp  = vc_sp if np.isscalar(vc_sp) else np.asarray(vc_sp[i:j])
+            vc_out[i:j], vf_out[i:j] = self._process_chunk(np.asarray(vc_if[i:j]), 
+                                                           sp, 
+                                                           fb_enable, 
+                                                           ff_enable)
+
+        # flush the memory-mapped output
+        if isinstance(vc_out, np.memmap):
+            vc_out.flush()
+            vf_out.flush()
+
+        return vc_out, vf_out
+
+    # -------------------------------------------
+    # snapshot of the states of the controllers in use (to replay the next
+    # block with probe_block)
+    # Note: shallow copies, the states are replaced (not modified in place)
+    #       by the steps and the coefficients are shared. The NCOs of the
+    #       feedforward controllers are copied as well
+    # -------------------------------------------
+    def snapshot(self):
+        act_fb = [copy.copy(ctl) for ctl in self.act_fb]
+        act_ff = [copy.copy(ctl) for ctl in self.act_ff]
+        for ctl in act_ff:
+            ctl.nco = copy.copy(ctl.nco)
+        return (self.cnt, self.v_prev, self.v_hold, act_fb, act_ff)
+
+    # -------------------------------------------
+    # replay a block from a snapshot to observe the internal signals
+    # Input:  snap      - snapshot taken before the block
+    #         vc        - demodulated cavity voltages of the block (outputs of
+    #                     sim_step), V
+    #         vc_sp     - setpoint phasor of cavity voltage, V
+    #         fb_enable - True for enabling feedback
+    #         ff_enable - True for enabling feedforward
+    # Output: dict of the signals of the block (held between the updates in
+    #         multi-rate mode):
+    #           ctl_err   - error (setpoint - demodulated voltage), V
+    #           ctl_pi    - PI output
+    #           ctl_notch - outputs of the notches in use, shape (num_fb-1, n)
+    #           ctl_fb    - feedback actuation (0 if disabled)
+    #           ctl_ff    - feedforward actuation (0 if disabled)
+    #           vf_if     - IF signal of the actuation signal
+    # Note: the states of the controllers are not changed. The results are 
+    #       the same as those of sim_step up to rounding (block filters)
+    # -------------------------------------------
+    def probe_block(self, snap, vc, vc_sp, fb_enable = False, ff_enable = False):
+        cnt, v_prev, v_hold, act_fb, act_ff = snap
+        probe   = {}
+        v, _, _ = self._control_block(np.asarray(vc), vc_sp, fb_enable, ff_enable, cnt, 
+                                      act_fb, act_ff, v_prev, v_hold, probe)
+        lo      = np.exp(1j * (self.w_if * (cnt + np.arange(len(v))) * self.Ts))
+        probe['vf_if'] = np.real(v * lo)
+        return probe
+
     # -------------------------------------------
     # private functions       
     # -------------------------------------------
-    def _demod(self, vin_if):  
-        self.buf_demod = np.roll(self.buf_demod, -1)
-        self.buf_demod[-1] = 2.0 * vin_if * np.exp(-1j * 2.0 * np.pi * \
-                                                   self.fif * self.cnt * self.Ts)
-        return np.mean(self.buf_demod)
+    def _process_chunk(self, vc_if, vc_sp, fb_enable, ff_enable):
+        n   = len(vc_if)
+        lo  = np.exp(1j * (self.w_if * (self.cnt + np.arange(n)) * self.Ts))
+
+        # vector sum (the demodulation is linear, so the calibration can be
+        # applied to the IF samples before it)
+        if self.vsum_cal is not None:
+            vc_if = np.dot(vc_if, self.vsum_cal)
+
+        # demodulation (moving average continued from the demod buffer)
+        vd  = (2.0 * vc_if * np.conj(lo)).astype(self.ctype)
+        ext = np.concatenate((np.roll(self.buf_demod, -self.idx_demod), vd))
+        vc  = np.convolve(ext[1:], np.ones(self.ndemod, dtype = self.rtype), mode = 'valid') / self.ndemod
+        self.buf_demod[:] = ext[-self.ndemod:]
+        self.idx_demod    = 0
+        self.sum_demod    = np.sum(self.buf_demod)
+
+        # corr loop phase
+        vc = vc * self.ctype(self.lp_rot)
+
+        # controllers and the actuation
+        v, self.v_prev, self.v_hold = self._control_block(vc, vc_sp, fb_enable, ff_enable, self.cnt,
+                                                          self.act_fb, self.act_ff, 
+                                                          self.v_prev, self.v_hold)
+
+        # get the IF signal of the actuation signal
+        vf_if = np.real(v * lo).astype(self.rtype)
+
+        # update the counter
+        self.cnt += n
+
+        return vc, vf_if
+
+    def _control_block(self, vc, vc_sp, fb_enable, ff_enable, cnt, act_fb, act_ff, 
+                             v_prev, v_hold, probe = None):
+        # controllers of a block of demodulated voltages starting at sample 
+        # cnt. Returns the actuation of the samples and the last two updates,
+        # the internal signals are written to probe (if not None)
+        n   = len(vc)
+        idx = cnt + np.arange(n)
+        upd = np.flatnonzero(idx % self.nctl == 0)     # samples updating the controllers
+        vc_err = (vc_sp - vc)[upd]
+
+        # feedback
+        vfb = np.zeros(len(upd), dtype = 'complex')
+        vos = []
+        for ctl in act_fb:
+            vos.append(ctl.sim_block(vc_err))
+            vfb += vos[-1]
+
+        if not fb_enable:
+            vfb[:] = 0.0
 
+        # feedforward
+        vff = np.zeros(len(upd), dtype = 'complex')
+        for ctl in act_ff:
+            vff += ctl.sim_block(len(upd))
+
+        if not ff_enable:
+            vff[:] = 0.0
+
+        # actuation held or interpolated between the updates (continued from
+        # the updates before the block)
+        vals = np.concatenate(([v_prev, v_hold], vfb + vff))
+        j    = None
+        if self.nctl == 1:
+            v = vals[2:]
+        else:
+            j = np.searchsorted(upd, np.arange(n), side = 'right')
+            v = vals[j+1]
+            if self.interp == 'linear':
+                v = vals[j] + (v - vals[j]) * ((idx % self.nctl + 1) / self.nctl)
+
+        # internal signals (held between the updates)
+        if probe is not None:
+            sig = {'ctl_err':   vc_err,
+                   'ctl_pi':    vos[0] if len(vos) > 0 else np.zeros(len(upd), dtype = 'complex'),
+                   'ctl_notch': np.array(vos[1:], dtype = 'complex').reshape(-1, len(upd)),
+                   'ctl_fb':    vfb,
+                   'ctl_ff':    vff}
+            for key, x in sig.items():
+                if j is not None:
+                    last = self.probe_last.get(key)
+                    if (last is None) or (np.shape(last) != x.shape[:-1]):
+                        last = np.zeros(x.shape[:-1], dtype = 'complex')
+                    if len(upd) > 0:
+                        self.probe_last[key] = x[..., -1]
+                    x = np.concatenate((last[..., None], x), axis = -1)[..., j]
+                probe[key] = x
+
+        return v, vals[-2], vals[-1]
+
+    def _demod(self, vin_if, lo):  
+        # circular buffer with a running sum (the mean does not depend on the
+        # order), lo is the carrier phasor of the sample. The sum is refreshed
+        # when the buffer wraps (no accumulation of rounding errors)
+        if self.vsum_cal is not None:
+            vin_if = np.dot(vin_if, self.vsum_cal)
+        buf, k = self.buf_demod, self.idx_demod
+        old    = buf[k]
+        buf[k] = 2.0 * vin_if * lo.conjugate()
+        self.sum_demod += buf[k] - old
+
+        self.idx_demod = (k + 1) % self.ndemod
+        if self.idx_demod == 0:
+            self.sum_demod = np.sum(buf)
+        return self.sum_demod / self.ndemod
+
+    def _resize_demod(self, ndemod, state_policy):
+        # resize the demodulation buffer in place, keep the latest samples
+        if self.buf_demod is None:
+            self.buf_demod = np.zeros(ndemod, dtype = self.ctype)
+            self.idx_demod = 0
+            return
+
+        if self.buf_demod.dtype != self.ctype:
+            self.buf_demod = self.buf_demod.astype(self.ctype)
+
+        if (len(self.buf_demod) == ndemod) and (state_policy == 'keep'):
+            return
+
+        hist = np.roll(self.buf_demod, -self.idx_demod)[-ndemod:]
+        self.buf_demod.resize(ndemod, refcheck = False)
+        self.buf_demod[:] = 0.0
+        if state_policy == 'keep':
+            self.buf_demod[ndemod - len(hist):] = hist
+        self.idx_demod = 0
+
+    def _apply(self, ctrls, pars, i, par, state_policy):
+        # apply the parameters to a controller only if changed
+        if pars[i] == par:
+            return
 
+        ctrls[i].set_param(**par)
+        if (pars[i] is None) or (state_policy == 'clear'):
+            ctrls[i].reset()
+        pars[i] = par
 
+    def _assign(self, ctrls, pars, i0, key, par_list, state_policy):
+        # assign the parameter sets to the controllers starting from i0, a
+        # controller keeps its state if its frequency (key) is still in use
+        free = list(range(i0, len(ctrls)))
+        slot = [None] * len(par_list)
+        for k, par in enumerate(par_list):
+            for i in free:
+                if (pars[i] is not None) and (pars[i][key] == par[key]):
+                    slot[k] = i
+                    free.remove(i)
+                    break
 
+        # clear the controllers no longer used, they take the new entries
+        for i in free:
+            if pars[i] is not None:
+                ctrls[i].reset()
+                pars[i] = None
 
+        for k, par in enumerate(par_list):
+            if slot[k] is None:
+                slot[k] = free.pop(0)
+            self._apply(ctrls, pars, slot[k], par, state_policy)
 
+        return [ctrls[i] for i in slot]
@@ -9,6 +9,14 @@ import numpy as np
 
 from NCO import *
 
+# =================================================
+# coefficients compiled by set_param
+# =================================================
+class FF_Coef():
+    __slots__ = ('cal',)
+    def __init__(self, cal):
+        self.cal = cal          # calibration phasor A*exp(jP)
+
 # =================================================
 # define the class
 # =================================================
@@ -41,6 +49,7 @@ class Controller_FF():
 
         # init the NCO
         self.nco.set_param(fs = fs, fnco = fnco)
+        self.coef = FF_Coef(self.A * np.exp(1j * self.P))
 
         # declare initialized
         self.initialized = True
@@ -60,7 +69,19 @@ class Controller_FF():
             return 0.0
 
         # calculate the output
-        return self.nco.sim_step() * self.A * np.exp(1j * self.P)
+        return self.nco.sim_step() * self.coef.cal
+
+    # -------------------------------------------
+    # simulate a block of steps
+    # Input: n - number of steps
+    # -------------------------------------------
+    def sim_block(self, n):
+        # check if initialized
+        if not self.initialized:
+            return np.zeros(n)
+
+        # calculate the output
+        return self.nco.sim_block(n) * self.coef.cal
 
 
 
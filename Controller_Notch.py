@@ -6,6 +6,16 @@
 # Notch feedback controller
 #################################################################
 import numpy as np
+from scipy import signal
+
+# =================================================
+# coefficients compiled by set_param
+# =================================================
+class Notch_Coef():
+    __slots__ = ('a', 'b')
+    def __init__(self, a, b):
+        self.a = a              # state transition
+        self.b = b              # input gain
 
 # =================================================
 # define the class
@@ -25,11 +35,17 @@ class Controller_Notch():
     #        fh   - half-bandwidth of notch filter, Hz
     #        fn   - notch frequency offset from carrier, Hz
     #        gain - notch control gain
+    #        matched - True for the matched pole a = exp(-Ts*(wh - j*wn)) 
+    #               instead of the forward Euler pole (whose magnitude 
+    #               sqrt((1 - Ts*wh)^2 + (Ts*wn)^2) exceeds 1 when Ts*wn^2 > 
+    #               2*wh, e.g. for a controller at a decimated clock), the 
+    #               input gain keeps the gain at the notch frequency
     # -------------------------------------------        
     def set_param(self, fs   = 10.0e6,
                         fh   = 10.0,
                         fn   = 0.0,
-                        gain = 1.0):
+                        gain = 1.0,
+                        matched = False):
         # check the input (to be done ...)
         
         # store the results
@@ -40,6 +56,12 @@ class Controller_Notch():
                    
         # derived parameters
         self.Ts   = 1.0 / fs
+        if matched:
+            self.coef = Notch_Coef(np.exp(-self.Ts * (self.wh - 1j*self.wn)),
+                                   self.gain * (1.0 - np.exp(-self.Ts * self.wh)))
+        else:
+            self.coef = Notch_Coef(1.0 - self.Ts * (self.wh - 1j*self.wn), 
+                                   self.gain * self.wh * self.Ts)
         
         # declare initialized
         self.initialized = True
@@ -60,8 +82,8 @@ class Controller_Notch():
             return 0.0
 
         # simulate a step        
-        vo = (1.0 - self.Ts * (self.wh - 1j*self.wn)) * self.vo_last + \
-             self.gain * self.wh * self.Ts * vi        
+        c  = self.coef
+        vo = c.a * self.vo_last + c.b * vi
         
         # update the variable for next step
         self.vo_last = vo        
@@ -69,4 +91,24 @@ class Controller_Notch():
         # return the result
         return vo
 
+    # -------------------------------------------
+    # simulate a block of steps
+    # Input: vi - input array
+    # -------------------------------------------
+    def sim_block(self, vi):
+        # check if initialized
+        if not self.initialized:
+            return np.zeros(len(vi), dtype = 'complex')
+
+        # the same difference equation as sim_step, as a 1st-order IIR filter
+        a, b  = self.coef.a, self.coef.b
+        vo, _ = signal.lfilter([b], [1.0, -a], vi, zi = [a * self.vo_last])
+
+        # update the variable for next block
+        if len(vo) > 0:
+            self.vo_last = vo[-1]
+
+        # return the result
+        return vo
+
     
@@ -5,11 +5,41 @@
 #################################################################
 # Notch feedback controller in state-space format
 #################################################################
+import functools
 import numpy as np
 from scipy import signal
 
 from llrflibs.rf_control import *
 
+# =================================================
+# coefficients compiled by set_param (discrete state-space matrices
+# as arrays, state x: vo = C x + D vi, x' = A x + B vi)
+# =================================================
+class Notch_SS_Coef():
+    __slots__ = ('A', 'B', 'C', 'D')
+    def __init__(self, A, B, C, D):
+        self.A = A
+        self.B = B
+        self.C = C
+        self.D = D
+
+# =================================================
+# discretize a notch (memo cache, the notches of the same parameters
+# share the coefficients, which are not modified)
+# Input:  fs, fh, fn, gain - see Controller_Notch_SS.set_param
+# Output: object of Notch_SS_Coef
+# =================================================
+@functools.lru_cache(maxsize = 256)
+def discretize_notch(fs, fh, fn, gain):
+    wh = 2.0 * np.pi * fh
+    wn = 2.0 * np.pi * fn
+    Ac, Bc, Cc, Dc = signal.tf2ss([gain * wh], [1.0, wh - 1j * wn])
+    _, A, B, C, D, _ = ss_discrete(Ac, Bc, Cc, Dc, 1.0 / fs,
+                                   method = 'bilinear',
+                                   plot = False,
+                                   plot_pno = 100000)
+    return Notch_SS_Coef(np.asarray(A), np.asarray(B)[:, 0], np.asarray(C)[0], np.asarray(D)[0, 0])
+
 # =================================================
 # define the class
 # =================================================
@@ -27,11 +57,15 @@ class Controller_Notch_SS():
     #        fh   - half-bandwidth of notch filter, Hz
     #        fn   - notch frequency offset from carrier, Hz
     #        gain - notch control gain
+    #        matched - accepted for the interface of Controller_Notch, not 
+    #               used (the bilinear discretization is stable at any 
+    #               sampling frequency)
     # -------------------------------------------        
     def set_param(self, fs   = 10.0e6,
                         fh   = 10.0,
                         fn   = 0.0,
-                        gain = 1.0):
+                        gain = 1.0,
+                        matched = False):
         # check the input (to be done ...)
         
         # store the results
@@ -43,15 +77,8 @@ class Controller_Notch_SS():
         # derived parameters
         self.Ts   = 1.0 / fs
         
-        # construct the state-space controller
-        Ac, Bc, Cc, Dc = signal.tf2ss([self.gain * self.wh], 
-                                      [1.0, self.wh - 1j * self.wn])
-        _, self.A, self.B, self.C, self.D, _ = ss_discrete(Ac, Bc, Cc, Dc, 
-                                                           self.Ts, 
-                                                           method = 'bilinear',
-                                                           plot = False,
-                                                           plot_pno = 100000)
-        
+        # construct the state-space controller (cached discretization)
+        self.coef    = discretize_notch(fs, fh, fn, gain)
         self.state_k = None         # state of the controller  
         
         # declare initialized
@@ -77,17 +104,15 @@ class Controller_Notch_SS():
         if not self.initialized:
             return 0.0
 
-        # feedback for a step
-        # - init the state of the controller
-        if ((self.state_k is None) and (self.B is not None)):
-            self.state_k = np.matrix(np.zeros(self.B.shape), dtype = complex)
+        # init the state of the controller
+        c = self.coef
+        if self.state_k is None:
+            self.state_k = np.zeros(len(c.B), dtype = complex)
             
-        # - execute one step feedback
-        vo = 0.0
-        if self.state_k is not None:        
-            _, vo, _, self.state_k = control_step(self.A, self.B, self.C, self.D,
-                                                  vi, self.state_k)
-            vo = vo[0, 0]
+        # execute one step feedback
+        x  = self.state_k
+        vo = np.dot(c.C, x) + c.D * vi
+        self.state_k = np.dot(c.A, x) + c.B * vi
                     
         # return the result
         return vo
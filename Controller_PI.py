@@ -7,6 +7,15 @@
 #################################################################
 import numpy as np
 
+# =================================================
+# coefficients compiled by set_param
+# =================================================
+class PI_Coef():
+    __slots__ = ('kp', 'ki')
+    def __init__(self, kp, ki):
+        self.kp = kp            # proportional gain
+        self.ki = ki            # integral gain per sample (Ki*Ts)
+
 # =================================================
 # define the class
 # =================================================
@@ -33,7 +42,8 @@ class Controller_PI():
         self.Ki = Ki
 
         # derived parameters
-        self.Ts = 1.0 / fs
+        self.Ts   = 1.0 / fs
+        self.coef = PI_Coef(Kp, Ki * self.Ts)
 
         # declare initialized
         self.initialized = True
@@ -53,11 +63,28 @@ class Controller_PI():
         if not self.initialized:
             return 0.0
 
-        # update the integrator
-        self.integrator += self.Ki * self.Ts * vi
-        
+        # update the integrator and generate output
+        c = self.coef
+        self.integrator += c.ki * vi
+        return c.kp * vi + self.integrator
+
+    # -------------------------------------------
+    # simulate a block of steps
+    # Input: vi - input array
+    # -------------------------------------------
+    def sim_block(self, vi):
+        # check if initialized
+        if not self.initialized:
+            return np.zeros(len(vi), dtype = 'complex')
+
+        # update the integrator (running sum over the block)
+        c     = self.coef
+        integ = self.integrator + np.cumsum(c.ki * vi)
+        if len(integ) > 0:
+            self.integrator = integ[-1]
+
         # generate output
-        return self.Kp * vi + self.integrator
+        return c.kp * vi + integ
 
 
 
@@ -0,0 +1,90 @@
+#####################################################################
+#  Copyright (c) 2024 by Zheqiao Geng
+#  All rights reserved.
+#####################################################################
+#################################################################
+# Registry of the optional DAQ channels: signals of the cavity and
+# of the controller internals, enabled by a bit mask and published
+# with the DAQ waveforms of the cavity voltage
+#
+# Note: the channels are derived block by block after the per-sample
+#       loop (the controller is replayed from a snapshot taken before
+#       the block, see Controller.probe_block), so the disabled ones
+#       cost nothing and the enabled ones add no work per sample
+#################################################################
+import numpy as np
+
+MAX_NOTCH = 20          # notch channels (Controller.MAX_NCH * 2 notches)
+
+# =================================================
+# channels: name -> (bit of the mask, type, unit, description)
+#   real channels are published as <name>, complex ones as <name>_a
+#   (amplitude) and <name>_p (phase, deg). The notches are numbered in
+#   the order of the controller (1 ... MAX_NOTCH), those not in use are 0
+# =================================================
+CHANNELS = {'vf_if':   (0, 'real',    'V', 'forward IF'),
+            'vr_if':   (1, 'real',    'V', 'reflected IF'),
+            'ctl_err': (2, 'complex', 'V', 'controller error'),
+            'ctl_pi':  (3, 'complex', 'V', 'PI output'),
+            'ctl_fb':  (4, 'complex', 'V', 'feedback sum'),
+            'ctl_ff':  (5, 'complex', 'V', 'feedforward sum')}
+CHANNELS.update({'ctl_notch' + str(k+1): (8 + k, 'complex', 'V', 'notch ' + str(k+1) + ' output') \
+                 for k in range(MAX_NOTCH)})
+
+# =================================================
+# bit mask of a list of channels
+# Input:  names - list of the channel names
+# Output: mask  - bit mask
+# =================================================
+def channel_mask(names):
+    mask = 0
+    for name in names:
+        if name not in CHANNELS:
+            raise ValueError('Unknown DAQ channel: ' + str(name))
+        mask |= 1 << CHANNELS[name][0]
+    return mask
+
+# =================================================
+# channels enabled by a bit mask
+# Input:  mask  - bit mask (unknown bits are ignored)
+# Output: names - list of the channel names (registry order)
+# =================================================
+def channel_names(mask):
+    return [name for name, (bit, _, _, _) in CHANNELS.items() if (int(mask) >> bit) & 1]
+
+# =================================================
+# waveforms published for the channels
+# Input:  names - list of the channel names (None for all)
+# Output: list of (key, unit, description) of the waveforms
+# =================================================
+def channel_keys(names = None):
+    keys = []
+    for name in (CHANNELS if names is None else names):
+        _, kind, unit, desc = CHANNELS[name]
+        if kind == 'complex':
+            keys += [(name + '_a', unit,  desc + ' amplitude'),
+                     (name + '_p', 'deg', desc + ' phase')]
+        else:
+            keys += [(name, unit, desc)]
+    return keys
+
+# =================================================
+# PV name (without prefix) of a channel waveform
+# Input:  key  - key of the waveform (see channel_keys)
+# Output: name - PV name, e.g. MON-CTL-PI-A for ctl_pi_a
+# =================================================
+def channel_pv(key):
+    return 'MON-' + key.upper().replace('_', '-')
+
+# =================================================
+# waveforms of a channel
+# Input:  name - channel name
+#         x    - samples of the channel
+# Output: dict of the waveforms (see channel_keys)
+# =================================================
+def channel_waveforms(name, x):
+    if CHANNELS[name][1] == 'complex':
+        return {name + '_a': np.abs(x),
+                name + '_p': np.angle(x, deg = True)}
+    return {name: x}
+
@@ -0,0 +1,101 @@
+#####################################################################
+#  Copyright (c) 2024 by Zheqiao Geng
+#  All rights reserved.
+#####################################################################
+#################################################################
+# Multi-resolution DAQ: cascaded boxcar averaging and decimation
+# of the cavity voltage phasor, processed block by block
+#################################################################
+import numpy as np
+
+# =================================================
+# define the class
+# =================================================
+class Decimator():
+    # -------------------------------------------
+    # construction
+    # -------------------------------------------
+    def __init__(self):
+        # init variables
+        self.nstage      = 0            # number of decimation stages
+        self.buf_vc      = []           # circular history of each stage
+        self.initialized = False        # indicate if initialized or not
+
+    # -------------------------------------------
+    # set parameters
+    # Input: factors - decimation factors of the stages (relative to the
+    #                  sampling frequency), each must divide the next one
+    #        nlen    - length of the history of each stage
+    #        fs      - sampling frequency, Hz
+    # Note: stage k averages the output of stage k-1 over
+    #       factors[k]/factors[k-1] points, which equals the boxcar average
+    #       over factors[k] input samples
+    # -------------------------------------------
+    def set_param(self, factors = (16, 256),
+                        nlen    = 2**12,
+                        fs      = 10.0e6):
+        # check the input
+        factors = [int(f) for f in factors]
+        for k in range(len(factors)):
+            if factors[k] % (factors[k-1] if k > 0 else 1) != 0:
+                raise ValueError('Decimation factors must divide each other')
+
+        # store the results
+        self.factors = factors
+        self.nlen    = nlen
+        self.fs      = fs
+        self.nstage  = len(factors)
+        self.ratios  = [f // g for f, g in zip(factors, [1] + factors[:-1])]
+
+        # buffers
+        self.buf_vc = [np.zeros(nlen, dtype = 'complex') for _ in factors]
+        self.reset()
+
+        # declare initialized
+        self.initialized = True
+
+    # -------------------------------------------
+    # reset
+    # -------------------------------------------
+    def reset(self):
+        self.ngrp = [0] * self.nstage       # number of output points since reset
+        self.part = [np.zeros(0, dtype = 'complex') for _ in range(self.nstage)]
+        for buf in self.buf_vc:
+            buf[:] = 0.0
+
+    # -------------------------------------------
+    # push a block of samples
+    # Input: vc - array of the cavity voltage phasor
+    # -------------------------------------------
+    def push(self, vc):
+        # check if initialized
+        if not self.initialized:
+            return
+
+        x = np.asarray(vc)
+        for k in range(self.nstage):
+            # average the complete groups (continued from the partial group)
+            r   = self.ratios[k]
+            acc = np.concatenate((self.part[k], x))
+            ng  = len(acc) // r
+            x   = acc[:ng * r].reshape(ng, r).mean(axis = 1)
+            self.part[k] = acc[ng * r:]
+
+            # write to the circular history
+            idx = (self.ngrp[k] + np.arange(ng)) % self.nlen
+            self.buf_vc[k][idx] = x
+            self.ngrp[k] += ng
+
+    # -------------------------------------------
+    # get the history of a stage (oldest first)
+    # Input:  k      - stage index
+    # Output: vc     - averaged cavity voltage phasor
+    #         time_x - time at the center of the averaging window, s
+    # -------------------------------------------
+    def get(self, k):
+        M   = self.factors[k]
+        j   = self.ngrp[k] - self.nlen + np.arange(self.nlen)
+        vc  = self.buf_vc[k][j % self.nlen]
+        vc[j < 0] = 0.0
+        return vc, (j * M + (M + 1) / 2.0) / self.fs
+
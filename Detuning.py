@@ -0,0 +1,136 @@
+#####################################################################
+#  Copyright (c) 2024 by Zheqiao Geng
+#  All rights reserved.
+#####################################################################
+#################################################################
+# Time-varying detuning: microphonics waveform and Lorentz force
+# detuning (mechanical modes)
+#################################################################
+import collections
+import numpy as np
+
+# =================================================
+# define the class
+# =================================================
+class Detuning():
+    # -------------------------------------------
+    # construction
+    # -------------------------------------------
+    def __init__(self):
+        # init variables
+        self.pos         = 0                    # read position of the waveform
+        self.last        = 0.0                  # last detuning sample, Hz
+        self.stream      = collections.deque()  # streamed waveform blocks
+        self.initialized = False                # indicate if initialized or not
+
+    # -------------------------------------------
+    # set parameters
+    # Input: fs    - sampling frequency, Hz
+    #        wave  - precomputed detuning waveform, Hz (None for streaming
+    #                the waveform with push)
+    #        repeat- True for repeating the precomputed waveform
+    #        fm    - frequencies of the mechanical modes, Hz (None for no LFD)
+    #        Qm    - quality factors of the mechanical modes
+    #        Km    - Lorentz force detuning constants of the modes, Hz/MV^2
+    #        nseg  - samples of a segment, the detuning is delivered segment
+    #                by segment and the mechanical modes are updated once per
+    #                segment with the mean |vc|^2 of the segment
+    # -------------------------------------------
+    def set_param(self, fs     = 10.0e6,
+                        wave   = None,
+                        repeat = True,
+                        fm     = None,
+                        Qm     = None,
+                        Km     = None,
+                        nseg   = 1024):
+        # check the input (to be done ...)
+
+        # store the results
+        self.fs     = fs
+        self.wave   = None if wave is None else np.asarray(wave, dtype = float)
+        self.repeat = repeat
+        self.nseg   = int(nseg)
+
+        # mechanical modes (vectorized over modes)
+        self.wm = np.zeros(0) if fm is None else 2.0 * np.pi * np.atleast_1d(np.asarray(fm, dtype = float))
+        self.Qm = np.ones(len(self.wm)) if Qm is None else np.atleast_1d(np.asarray(Qm, dtype = float))
+        self.Km = np.zeros(len(self.wm)) if Km is None else np.atleast_1d(np.asarray(Km, dtype = float))
+        self.Tm = self.nseg / fs                        # update period of the modes, s
+
+        # init the states
+        self.reset()
+
+        # declare initialized
+        self.initialized = True
+
+    # -------------------------------------------
+    # reset
+    # -------------------------------------------
+    def reset(self):
+        self.pos  = 0
+        self.last = 0.0
+        self.stream.clear()
+
+        if hasattr(self, 'wm'):
+            self.xm = np.zeros(len(self.wm))        # mode detuning, Hz
+            self.vm = np.zeros(len(self.wm))        # mode detuning rate, Hz/s
+
+    # -------------------------------------------
+    # stream more detuning samples (used if no precomputed waveform)
+    # Input: wave - detuning samples, Hz
+    # -------------------------------------------
+    def push(self, wave):
+        wave = np.asarray(wave, dtype = float)
+        if len(wave) > 0:
+            self.stream.append(wave)
+
+    # -------------------------------------------
+    # get the detuning of the next samples
+    # Input:  n   - number of samples
+    # Output: det - detuning (waveform + LFD), Hz
+    # -------------------------------------------
+    def get_block(self, n):
+        det = np.zeros(n)
+
+        # precomputed waveform
+        if self.wave is not None and len(self.wave) > 0:
+            if self.repeat:
+                det[:] = self.wave[(self.pos + np.arange(n)) % len(self.wave)]
+            else:
+                m = max(0, min(n, len(self.wave) - self.pos))
+                det[:m] = self.wave[self.pos:self.pos + m]
+                det[m:] = self.wave[-1]
+            self.pos += n
+
+        # streamed waveform (hold the last value if not enough data)
+        else:
+            i = 0
+            while i < n and len(self.stream) > 0:
+                blk = self.stream[0]
+                m   = min(n - i, len(blk))
+                det[i:i+m] = blk[:m]
+                self.last  = blk[m-1]
+                if m == len(blk):
+                    self.stream.popleft()
+                else:
+                    self.stream[0] = blk[m:]
+                i += m
+            det[i:] = self.last
+
+        # add the Lorentz force detuning
+        return det + np.sum(self.xm)
+
+    # -------------------------------------------
+    # update the mechanical modes for a segment
+    # Input: vc2 - mean |vc|^2 in the segment, V^2
+    # -------------------------------------------
+    def update_lfd(self, vc2):
+        if len(self.wm) == 0:
+            return
+
+        # driven damped oscillators, semi-implicit Euler with the segment time
+        acc      = -self.wm**2 * (self.xm - self.Km * vc2 * 1.0e-12) - \
+                    self.wm / self.Qm * self.vm
+        self.vm += acc * self.Tm
+        self.xm += self.vm * self.Tm
+
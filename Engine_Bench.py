@@ -0,0 +1,225 @@
+#####################################################################
+#  Copyright (c) 2024 by Zheqiao Geng
+#  All rights reserved.
+#####################################################################
+#################################################################
+# Golden-reference harness of the simulation engines: runs a
+# library of canonical configurations through each engine and
+# compares it with the per-sample reference (Cavity.sim_step +
+# Controller.sim_step in double precision)
+#
+# Engines:
+#   'step'      - the reference
+#   'single'    - the reference loop in single precision
+#   'notch_ss'  - notches in state-space format (bilinear discretization)
+#   'array'     - Cavity_Array with one cavity and the vector-sum mode
+#   'multirate' - controller updated every MULTIRATE_NCTL samples (held)
+#   'block'     - vectorized open-loop paths replaying the reference:
+#                 Cavity.sim_block driven by the reference drive and
+#                 Controller.process_block fed by the reference probe
+#
+# Usage: python Engine_Bench.py [nsample]
+#################################################################
+import sys
+import time
+import numpy as np
+
+from Sim_Engine import *
+from Param_Set import *
+from Scenario import *
+from Cavity_Array import *
+from Harmonic_Monitor import *
+
+# =================================================
+# canonical configurations
+#   cfg       - changes of Sim_Engine.DEFAULT_CFG
+#   notch     - number of notches (beam harmonics 1 ... notch)
+#   nco       - number of NCOs (beam harmonics 1 ... nco)
+#   ff_enable - enable the feedforward
+# =================================================
+CONFIGS = {'pi_only':  {'cfg': {},                          'notch': 0,  'nco': 0, 'ff_enable': False},
+           'notch_10': {'cfg': {},                          'notch': 10, 'nco': 0, 'ff_enable': False},
+           'ff_on':    {'cfg': {},                          'notch': 0,  'nco': 3, 'ff_enable': True},
+           'ff_off':   {'cfg': {},                          'notch': 0,  'nco': 3, 'ff_enable': False},
+           'detuned':  {'cfg': {'dw': -2 * np.pi * 2.0e3},  'notch': 3,  'nco': 0, 'ff_enable': False},
+           'noise':    {'cfg': {'npsd': -100.0},            'notch': 3,  'nco': 0, 'ff_enable': False}}
+
+ENGINES = ['step', 'single', 'notch_ss', 'array', 'multirate', 'block']
+
+MULTIRATE_NCTL = 8      # controller update period of the 'multirate' engine
+
+# =================================================
+# run the configurations through the engines
+# Input:  configs - names of the configurations (None for all, see CONFIGS)
+#         engines - names of the engines (None for all, see ENGINES), the
+#                   reference is always run first
+#         nsample - samples simulated per run
+#         seed    - seed of the noise (the same for all runs)
+#         nper    - window of the sideband measurement (at the end of the
+#                   run) in periods of the bunch rep freq
+# Output: list of dicts (one per configuration and engine) of
+#           config, engine
+#           rate    - simulated samples per second
+#           speedup - rate relative to the reference
+#           vc_max  - max deviation of the cavity voltage, relative to the
+#                     max amplitude of the reference
+#           vc_rms  - RMS deviation of the cavity voltage (relative)
+#           vf_max  - max deviation of the drive IF signal (relative)
+#           sb_dbc  - max beam harmonic sideband of vc_if, dBc
+#           sb_dev  - max deviation of the sidebands from the reference, dB
+# =================================================
+def run_bench(configs = None, engines = None, nsample = 2**16, seed = 0, nper = 2):
+    rows = []
+    for name in (configs or list(CONFIGS)):
+        conf = CONFIGS[name]
+        cfg  = dict(Sim_Engine.DEFAULT_CFG, **conf['cfg'])
+        ps   = Param_Set(*_ctl_setup(cfg, conf['notch'], conf['nco']))
+
+        ref  = None
+        for eng in ['step'] + [e for e in (engines or ENGINES) if e != 'step']:
+            np.random.seed(seed)
+            res = _RUNNERS[eng](cfg, ps, conf['ff_enable'], nsample, ref)
+            if ref is None:
+                ref = res
+            rows.append(dict(config = name, engine = eng, **_compare(cfg, res, ref, nper)))
+    return rows
+
+# =================================================
+# format the results as a table
+# Input:  rows - results of run_bench
+# Output: text of the table
+# =================================================
+def format_table(rows):
+    head  = '%-10s %-9s %12s %8s %10s %10s %10s %8s %8s' % \
+            ('config', 'engine', 'samples/s', 'speedup', 'vc max', 'vc rms', 'vf max', 'sb dBc', 'sb dB')
+    lines = [head, '-' * len(head)]
+    for r in rows:
+        lines.append('%-10s %-9s %12.0f %8.2f %10.2e %10.2e %10.2e %8.1f %8.3f' % \
+                     (r['config'], r['engine'], r['rate'], r['speedup'], r['vc_max'],
+                      r['vc_rms'], r['vf_max'], r['sb_dbc'], r['sb_dev']))
+    return '\n'.join(lines)
+
+# =================================================
+# private functions
+# =================================================
+def _ctl_setup(cfg, nnotch, nnco):
+    # controller parameters and tables (the values of Script_00_set_param)
+    fb, fs, fif = derive_freqs(cfg)
+    ctl_param = {'fb': fb, 'fs': fs, 'fif': fif, 'ndemod': 240, 'lp_pha': 46.25, 'Kp': 80.0, 'Ki': 0.0}
+    tables    = {k: np.zeros(Controller.MAX_NCH) for k in Scenario.TABLE_KEYS}
+    tables['notch_ena'][:nnotch] = 1
+    tables['notch_gain'][:]      = 100.0
+    tables['notch_hbw'][:]       = 2000.0
+    tables['notch_lp'][:]        = 20.0 * np.arange(1, Controller.MAX_NCH + 1)
+    tables['nco_ena'][:nnco]     = 1
+    tables['nco_amp'][:]         = 20000.0
+    tables['nco_phap'][:]        = 90.0
+    tables['nco_phan'][:]        = 90.0
+    return ctl_param, tables
+
+def _engine(cfg, ps, precision = 'double'):
+    # engine with the cavity and controller of the configuration
+    eng = Sim_Engine(dict(cfg, precision = precision))
+    eng.set_param(ps)
+    return eng
+
+def _loop(cav, ctl, vc_sp, ff_enable, n):
+    # per-sample closed loop, the timing is of the loop only
+    vc    = np.zeros(n, dtype = 'complex')
+    vc_if = np.zeros(n)
+    vf_if = np.zeros(n)
+    vact  = 0.0
+    t0    = time.perf_counter()
+    for i in range(n):
+        vc_cav, vif, _, _ = cav.sim_step(vact)
+        _, vact = ctl.sim_step(vif, vc_sp, fb_enable = True, ff_enable = ff_enable)
+        vc[i]    = vc_cav if np.isscalar(vc_cav) else vc_cav[0]
+        vc_if[i] = vif if np.isscalar(vif) else vif[0]
+        vf_if[i] = vact
+    return {'vc': vc, 'vc_if': vc_if, 'vf_if': vf_if, 'time': time.perf_counter() - t0}
+
+def _vc_sp(eng):
+    return eng.vc_sp * np.exp(1j * eng.vc_sp_pha * np.pi / 180.0)
+
+def _run_step(cfg, ps, ff_enable, n, ref):
+    eng = _engine(cfg, ps)
+    return _loop(eng.cav, eng.ctl, _vc_sp(eng), ff_enable, n)
+
+def _run_single(cfg, ps, ff_enable, n, ref):
+    eng = _engine(cfg, ps, 'single')
+    return _loop(eng.cav, eng.ctl, _vc_sp(eng), ff_enable, n)
+
+def _run_notch_ss(cfg, ps, ff_enable, n, ref):
+    eng = Sim_Engine(cfg)
+    eng.ctl.control_fb[1:] = [Controller_Notch_SS() for _ in eng.ctl.control_fb[1:]]
+    eng.set_param(ps)
+    return _loop(eng.cav, eng.ctl, _vc_sp(eng), ff_enable, n)
+
+def _run_array(cfg, ps, ff_enable, n, ref):
+    eng = _engine(cfg, Param_Set(dict(ps.ctl_param, vsum_cal = [1.0]), ps.tables))
+    cav = Cavity_Array()
+    cav.set_param(frf       = cfg['frf'],
+                  RoQ       = cfg['RoQ'],
+                  QL        = cfg['QL'],
+                  detuning  = cfg['dw'] / 2 / np.pi,
+                  charge    = cfg['Qb'],
+                  fb        = eng.fb,
+                  phib      = cfg['phb'] * 180 / np.pi,
+                  fs        = eng.fs,
+                  fif       = eng.fif,
+                  npsd      = cfg['npsd'])
+    return _loop(cav, eng.ctl, _vc_sp(eng), ff_enable, n)
+
+def _run_multirate(cfg, ps, ff_enable, n, ref):
+    eng = _engine(cfg, Param_Set(dict(ps.ctl_param, nctl = MULTIRATE_NCTL), ps.tables))
+    return _loop(eng.cav, eng.ctl, _vc_sp(eng), ff_enable, n)
+
+def _run_block(cfg, ps, ff_enable, n, ref):
+    # the cavity is driven by the drive of the reference (its controller
+    # output delayed by one sample), the controller by the reference probe
+    eng   = _engine(cfg, ps)
+    drive = np.concatenate(([0.0], ref['vf_if'][:-1]))
+    t0    = time.perf_counter()
+    vc, vc_if, _, _ = eng.cav.sim_block(drive)
+    _, vf_if        = eng.ctl.process_block(ref['vc_if'], _vc_sp(eng), fb_enable = True, ff_enable = ff_enable)
+    return {'vc': vc, 'vc_if': vc_if, 'vf_if': vf_if, 'time': time.perf_counter() - t0}
+
+_RUNNERS = {'step':      _run_step,
+            'single':    _run_single,
+            'notch_ss':  _run_notch_ss,
+            'array':     _run_array,
+            'multirate': _run_multirate,
+            'block':     _run_block}
+
+def _sidebands(cfg, vc_if, nper):
+    # amplitudes of the carrier and the beam harmonic sidebands at the end
+    fb, fs, fif = derive_freqs(cfg)
+    harm = Harmonic_Monitor()
+    harm.set_param(fs = fs, fb = fb, fif = fif, nh = Controller.MAX_NCH, nper = nper)
+    harm.push(vc_if[-harm.N:])
+    _, amp, _ = harm.get()
+    return amp
+
+def _compare(cfg, res, ref, nper):
+    # deviations from the reference and the sidebands
+    vmax = np.max(np.abs(ref['vc']))
+    fmax = max(np.max(np.abs(ref['vf_if'])), 1e-30)
+    err  = np.abs(res['vc'] - ref['vc']) / vmax
+    sb   = _sidebands(cfg, res['vc_if'], nper)
+    sb0  = _sidebands(cfg, ref['vc_if'], nper)
+    nh   = Controller.MAX_NCH
+    k    = np.arange(len(sb)) != nh
+    return {'rate':    len(res['vc']) / res['time'],
+            'speedup': ref['time'] / res['time'],
+            'vc_max':  np.max(err),
+            'vc_rms':  np.sqrt(np.mean(err**2)),
+            'vf_max':  np.max(np.abs(res['vf_if'] - ref['vf_if'])) / fmax,
+            'sb_dbc':  20.0 * np.log10(np.max(sb[k]) / sb[nh]),
+            'sb_dev':  np.max(np.abs(20.0 * np.log10(sb[k] / sb0[k])))}
+
+# =================================================
+# main: print the table of all configurations and engines
+# =================================================
+if __name__ == '__main__':
+    nsample = int(sys.argv[1]) if len(sys.argv) > 1 else 2**16
+    print(format_table(run_bench(nsample = nsample)))
@@ -0,0 +1,214 @@
+#####################################################################
+#  Copyright (c) 2024 by Zheqiao Geng
+#  All rights reserved.
+#####################################################################
+#################################################################
+# Monte Carlo ensemble of noise realizations: runs independently
+# seeded simulations in parallel and reduces their statistics on
+# the fly (running mean/variance), no waveform is stored
+#################################################################
+import os
+import multiprocessing
+import numpy as np
+
+from Sim_Engine import *
+from Param_Set import *
+
+# =================================================
+# running mean/variance (Welford) of scalars or arrays
+# =================================================
+class Running_Stats():
+    def __init__(self):
+        self.n    = 0
+        self.mean = 0.0
+        self.m2   = 0.0
+
+    # add a sample
+    def push(self, x):
+        x          = np.asarray(x, dtype = float)
+        self.n    += 1
+        delta      = x - self.mean
+        self.mean  = self.mean + delta / self.n
+        self.m2    = self.m2 + delta * (x - self.mean)
+
+    # sample variance and standard deviation
+    def var(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else self.m2 * 0.0
+
+    def std(self):
+        return np.sqrt(self.var())
+
+# =================================================
+# define the class
+# =================================================
+class Ensemble():
+    # -------------------------------------------
+    # construction
+    # Input: cfg     - dict of the beam and cavity parameters (see
+    #                  Sim_Engine.DEFAULT_CFG), None for default
+    #        nworker - number of processes running the realizations (None
+    #                  for the number of CPUs, 1 for no child process)
+    #        cache   - object of Result_Cache for the realizations (None for
+    #                  no cache)
+    # -------------------------------------------
+    def __init__(self, cfg = None, nworker = None, cache = None):
+        # init variables
+        self.cfg     = dict(Sim_Engine.DEFAULT_CFG, **(cfg or {}))
+        self.nworker = os.cpu_count() if nworker is None else max(1, int(nworker))
+        self.cache   = cache
+
+    # -------------------------------------------
+    # set parameters
+    # Input: ctl_param - dict of scalar parameters of the controller (see
+    #                    Param_Set)
+    #        tables    - dict of per-harmonic notch/NCO arrays
+    #        nreal     - number of realizations
+    #        seed      - seed of the ensemble (the realizations get independent
+    #                    seeds derived from it)
+    #        nsettle   - samples simulated before the statistics
+    #        nfft      - samples per PSD segment
+    #        nseg      - number of PSD segments per realization
+    #        bands     - list of (f1, f2) frequency bands of the integrated
+    #                    jitter, Hz (None for 0-fb, fb-10fb, 10fb-fs/2)
+    #        scenario  - object of Scenario (None for no scenario)
+    # -------------------------------------------
+    def set_param(self, ctl_param, tables,
+                        nreal    = 16,
+                        seed     = 0,
+                        nsettle  = 2**14,
+                        nfft     = 2**14,
+                        nseg     = 4,
+                        bands    = None,
+                        scenario = None):
+        # store the results
+        self.ctl_param = dict(ctl_param)
+        self.tables    = {k: np.array(v, dtype = float) for k, v in tables.items()}
+        self.nreal     = nreal
+        self.seed      = seed
+        self.nsettle   = nsettle
+        self.nfft      = nfft
+        self.nseg      = nseg
+        self.scenario  = scenario
+
+        fb, fs = self.ctl_param['fb'], self.ctl_param['fs']
+        self.bands = bands if bands is not None else [(0.0, fb), (fb, 10.0 * fb), (10.0 * fb, fs / 2.0)]
+
+    # -------------------------------------------
+    # run the ensemble
+    # Output: dict of the statistics over the realizations, each entry of
+    #         the running values has the mean and the std (*_std):
+    #           freq            - frequencies of the PSDs, Hz
+    #           psd_amp/psd_pha - PSD of the relative amplitude error (1/Hz)
+    #                             and of the phase error (deg^2/Hz)
+    #           mean_amp/mean_pha - static amplitude (relative) and phase
+    #                             (deg) errors
+    #           rms_amp/rms_pha - RMS of the amplitude and phase errors about
+    #                             the static errors
+    #           jit_amp/jit_pha - integrated jitter in each band
+    #           bands, nreal
+    # -------------------------------------------
+    def run(self):
+        # independent seeds of the realizations
+        seeds = [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(self.seed).spawn(self.nreal)]
+        args  = [(self.cache, (self.cfg, self.ctl_param, self.tables, self.nsettle,
+                               self.nfft, self.nseg, self.bands, s, self.scenario)) for s in seeds]
+
+        # reduce the realizations as they finish
+        stats = {}
+        if self.nworker == 1:
+            for a in args:
+                self._reduce(stats, _run_realization(a))
+        else:
+            ctx = multiprocessing.get_context('spawn')
+            with ctx.Pool(min(self.nworker, self.nreal)) as pool:
+                for res in pool.imap_unordered(_run_realization, args):
+                    self._reduce(stats, res)
+
+        # collect the results
+        result = {'freq':  np.fft.rfftfreq(self.nfft, 1.0 / self.ctl_param['fs']),
+                  'bands': self.bands,
+                  'nreal': self.nreal}
+        for key, st in stats.items():
+            result[key]          = st.mean
+            result[key + '_std'] = st.std()
+        return result
+
+    # -------------------------------------------
+    # private functions
+    # -------------------------------------------
+    def _reduce(self, stats, res):
+        for key, val in res.items():
+            stats.setdefault(key, Running_Stats()).push(val)
+
+# =================================================
+# simulate one realization and get its statistics (module level to
+# run in a child process)
+# Input:  cfg       - dict of the beam and cavity parameters
+#         ctl_param - dict of scalar parameters of the controller
+#         tables    - dict of per-harmonic notch/NCO arrays
+#         nsettle   - samples simulated before the statistics
+#         nfft      - samples per PSD segment
+#         nseg      - number of PSD segments
+#         bands     - list of (f1, f2) bands of the integrated jitter, Hz
+#         seed      - seed of the noise
+#         scenario  - object of Scenario (None for no scenario)
+# Output: dict of psd_amp, psd_pha, mean_amp, mean_pha, rms_amp, rms_pha,
+#         jit_amp, jit_pha (see Ensemble.run)
+# =================================================
+def run_realization(cfg, ctl_param, tables, nsettle, nfft, nseg, bands, seed, scenario = None):
+    np.random.seed(seed)
+    eng = Sim_Engine(cfg)
+    eng.set_param(Param_Set(ctl_param, tables))
+    if scenario is not None:
+        eng.set_scenario(scenario)
+        scenario.reset()
+
+    # settle
+    while eng.sim_cnt < nsettle:
+        eng.run_block()
+
+    # errors of the demodulated cavity voltage, segment by segment
+    fs   = eng.fs
+    win  = np.hanning(nfft)
+    norm = 2.0 / (fs * np.sum(win**2))
+    seg  = np.zeros((2, nfft))
+    psd  = np.zeros((2, nfft // 2 + 1))
+    s1   = np.zeros(2)
+    s2   = np.zeros(2)
+    for _ in range(nseg):
+        i = 0
+        while i < nfft:
+            n  = min(eng.run_block(), nfft - i)
+            vc = eng.blk_vc[:n]
+            seg[0, i:i+n] = np.abs(vc) / eng.vc_sp - 1.0
+            seg[1, i:i+n] = (np.angle(vc, deg = True) - eng.vc_sp_pha + 180.0) % 360.0 - 180.0
+            i += n
+
+        s1  += np.sum(seg, axis = 1)
+        s2  += np.sum(seg**2, axis = 1)
+        psd += np.abs(np.fft.rfft(seg * win, axis = 1))**2 * norm
+
+    # static errors, RMS jitter (about the static errors) and band jitter
+    N     = nfft * nseg
+    mean  = s1 / N
+    rms   = np.sqrt(np.maximum(s2 / N - mean**2, 0.0))
+    psd  /= nseg
+    freq  = np.fft.rfftfreq(nfft, 1.0 / fs)
+    jit   = np.array([np.sqrt(np.sum(psd[:, (freq >= f1) & (freq < f2)], axis = 1) * fs / nfft) \
+                      for f1, f2 in bands])
+    return {'psd_amp':  psd[0],
+            'psd_pha':  psd[1],
+            'mean_amp': mean[0],
+            'mean_pha': mean[1],
+            'rms_amp':  rms[0],
+            'rms_pha':  rms[1],
+            'jit_amp':  jit[:, 0],
+            'jit_pha':  jit[:, 1]}
+
+def _run_realization(args):
+    # run a realization (with the cache if any)
+    cache, args = args
+    if cache is None:
+        return run_realization(*args)
+    return cache.call(run_realization, *args)
+
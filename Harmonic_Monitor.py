@@ -0,0 +1,110 @@
+#####################################################################
+#  Copyright (c) 2024 by Zheqiao Geng
+#  All rights reserved.
+#####################################################################
+#################################################################
+# Monitor of the carrier and the beam harmonic sidebands: sliding
+# DFT of the IF signal at fif + k*fb (k = -nh ... nh)
+#################################################################
+import numpy as np
+
+# =================================================
+# define the class
+# =================================================
+class Harmonic_Monitor():
+    # -------------------------------------------
+    # construction
+    # -------------------------------------------
+    def __init__(self):
+        # init variables
+        self.cnt = 0                    # counter of samples
+        self.initialized = False        # indicate if initialized or not
+
+    # -------------------------------------------
+    # set parameters
+    # Input: fs   - sampling frequency, Hz
+    #        fb   - bunch rep freq, Hz
+    #        fif  - IF frequency, Hz
+    #        nh   - number of beam harmonics on each side of the carrier
+    #        nper - window length in periods of fb
+    # Note: fs and fif must be multiples of fb, so that the twiddles are
+    #       periodic in P = fs/fb samples. The window (nper*P samples) is
+    #       folded into one period (the sum of the samples with the same
+    #       phase), which is updated by the entering/leaving samples, so
+    #       the bins are only evaluated (P multiplications each) when read
+    # -------------------------------------------
+    def set_param(self, fs   = 10.0e6,
+                        fb   = 1.0e6,
+                        fif  = 1.0e6,
+                        nh   = 10,
+                        nper = 8):
+        # check the input
+        P = int(round(fs / fb))
+        L = int(round(fif / fb))
+        if not (np.isclose(P * fb, fs) and np.isclose(L * fb, fif)):
+            raise ValueError('fs and fif must be multiples of fb')
+
+        # store the results
+        self.fs   = fs
+        self.fb   = fb
+        self.fif  = fif
+        self.nh   = nh
+        self.nper = nper
+
+        # derived variables
+        self.P    = P
+        self.N    = nper * P                            # window length
+        self.k    = np.arange(-nh, nh + 1)              # harmonic numbers
+        self.twd  = 2.0 * np.exp(-1j * 2.0 * np.pi * np.outer(L + self.k, np.arange(P)) / P)
+
+        # buffers
+        self.hist = np.zeros(self.N)                    # samples of the window
+        self.fold = np.zeros(P)                         # folded window
+
+        # declare initialized
+        self.initialized = True
+        self.reset()
+
+    # -------------------------------------------
+    # reset
+    # -------------------------------------------
+    def reset(self):
+        self.cnt = 0
+        if self.initialized:
+            self.hist[:] = 0.0
+            self.fold[:] = 0.0
+
+    # -------------------------------------------
+    # push a block of IF samples
+    # Input: vc_if - IF signal array of the cavity voltage, V
+    # -------------------------------------------
+    def push(self, vc_if):
+        # check if initialized
+        if not self.initialized:
+            return
+
+        x = np.asarray(vc_if, dtype = float)
+        i = 0
+        while i < len(x):
+            # slide to the end of the block or the end of the window
+            m   = min(len(x) - i, self.N - self.cnt % self.N)
+            idx = self.cnt % self.N + np.arange(m)
+            np.add.at(self.fold, idx % self.P, x[i:i+m] - self.hist[idx])
+            self.hist[idx] = x[i:i+m]
+            self.cnt += m
+            i        += m
+
+            # refold at the end of the window (no accumulation of rounding errors)
+            if self.cnt % self.N == 0:
+                self.fold[:] = self.hist.reshape(self.nper, self.P).sum(axis = 0)
+
+    # -------------------------------------------
+    # get the phasors of the harmonics
+    # Output: freq_offs - frequency offsets to the carrier (k*fb), Hz
+    #         amp       - amplitudes (in units of the input signal)
+    #         pha       - phases relative to the sample 0, deg
+    # -------------------------------------------
+    def get(self):
+        S = np.dot(self.twd, self.fold) / self.N
+        return self.k * self.fb, np.abs(S), np.angle(S, deg = True)
+
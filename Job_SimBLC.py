@@ -6,14 +6,20 @@
 # This is a job to simulate the beam loading compensation
 #################################################################
 import time
+import atexit
 import threading
+import collections
+import multiprocessing
 import numpy as np
+from multiprocessing import shared_memory
 
 from ooepics.Job import *
-from llrflibs.rf_noise import *
 
-from Cavity import *
-from Controller import *
+from Scenario import *
+from Param_Set import *
+from Sim_Engine import *
+from Auto_Tuner import *
+from DAQ_Channels import *
 
 # =================================
 # define the class
@@ -22,13 +28,17 @@ class Job_SimBLC(Job):
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     # class variables
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
-    DAQ_SIZE = 2**15            # buffer size for DAQ
+    DAQ_SIZE = Sim_Engine.DAQ_SIZE  # buffer size for DAQ
     MAX_BH   = 10               # max number of beam harmonics
+    N_SLOT   = 4                # number of DAQ slots in the shared memory ring
     
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     # create the object
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
-    def __init__(self, modName, jobName):
+    #   use_process - True to run the simulation engine in a child process
+    #   cfg         - dict of the beam and cavity parameters (see 
+    #                 Sim_Engine.DEFAULT_CFG), None for default
+    def __init__(self, modName, jobName, use_process = False, cfg = None):
         # init the parent class
         Job.__init__(self, modName, jobName)
 
@@ -46,6 +56,8 @@ class Job_SimBLC(Job):
         self.lpv_setLoopPha   = LocalPV(self.modName, self.jobName, "SET-LOOP-PHA", "",  "deg", 1, "ao",      "loop phase corr")
         self.lpv_setKp        = LocalPV(self.modName, self.jobName, "SET-KP",       "",  "",    1, "ao",      "P gain")
         self.lpv_setKi        = LocalPV(self.modName, self.jobName, "SET-KI",       "",  "",    1, "ao",      "I gain")
+        self.lpv_setNCtl      = LocalPV(self.modName, self.jobName, "SET-N-CTL",    "",  "",    1, "longout", "ctl update period")
+        self.lpv_setCtlIntp   = LocalPV(self.modName, self.jobName, "SET-CTL-INTP", "",  "",    1, "bo",      "ctl linear interp")
 
         self.lpv_enaNotchH    = [LocalPV(self.modName, self.jobName, "ENA-NOTCH-H"   + str(i+1), "", "",    1, "bo", "notch harmonic") \
                                  for i in range(Job_SimBLC.MAX_BH)]
@@ -65,60 +77,103 @@ class Job_SimBLC(Job):
         self.lpv_setNCOPn     = [LocalPV(self.modName, self.jobName, "SET-NCO-PHAN" + str(i+1), "", "deg", 1, "ao", "NCO phase -f") \
                                  for i in range(Job_SimBLC.MAX_BH)]
 
+        self.lpv_arrNotchEna  = LocalPV(self.modName, self.jobName, "ENA-NOTCH-ALL",    "", "",    Job_SimBLC.MAX_BH, "waveform", "notch harmonics")
+        self.lpv_arrNotchG    = LocalPV(self.modName, self.jobName, "SET-NOTCH-G-ALL",  "", "",    Job_SimBLC.MAX_BH, "waveform", "notch gains")
+        self.lpv_arrNotchHbw  = LocalPV(self.modName, self.jobName, "SET-NOTCH-HBW-ALL","", "Hz",  Job_SimBLC.MAX_BH, "waveform", "notch half bandwidths")
+        self.lpv_arrNotchLp   = LocalPV(self.modName, self.jobName, "SET-NOTCH-LP-ALL", "", "deg", Job_SimBLC.MAX_BH, "waveform", "notch loop phases")
+        self.lpv_arrNCOEna    = LocalPV(self.modName, self.jobName, "ENA-NCO-ALL",      "", "",    Job_SimBLC.MAX_BH, "waveform", "NCO harmonics")
+        self.lpv_arrNCOA      = LocalPV(self.modName, self.jobName, "SET-NCO-AMP-ALL",  "", "",    Job_SimBLC.MAX_BH, "waveform", "NCO amplitudes")
+        self.lpv_arrNCOPp     = LocalPV(self.modName, self.jobName, "SET-NCO-PHAP-ALL", "", "deg", Job_SimBLC.MAX_BH, "waveform", "NCO phases +f")
+        self.lpv_arrNCOPn     = LocalPV(self.modName, self.jobName, "SET-NCO-PHAN-ALL", "", "deg", Job_SimBLC.MAX_BH, "waveform", "NCO phases -f")
+
+        # table name -> (array PV, scalar PVs), the scalar PVs are the legacy alias
+        self.lpv_tables = {'notch_ena':  (self.lpv_arrNotchEna, self.lpv_enaNotchH),
+                           'notch_gain': (self.lpv_arrNotchG,   self.lpv_setNotchG),
+                           'notch_hbw':  (self.lpv_arrNotchHbw, self.lpv_setNotchHbw),
+                           'notch_lp':   (self.lpv_arrNotchLp,  self.lpv_setNotchLp),
+                           'nco_ena':    (self.lpv_arrNCOEna,   self.lpv_enaNCOH),
+                           'nco_amp':    (self.lpv_arrNCOA,     self.lpv_setNCOA),
+                           'nco_phap':   (self.lpv_arrNCOPp,    self.lpv_setNCOPp),
+                           'nco_phan':   (self.lpv_arrNCOPn,    self.lpv_setNCOPn)}
+
+        self.lpv_setScenario  = LocalPV(self.modName, self.jobName, "SET-SCENARIO", "", "", 1, "stringout", "scenario file")
+
+        self.lpv_setTrigSrc   = LocalPV(self.modName, self.jobName, "SET-TRIG-SRC",  "", "",    1, "longout", "trigger sources (0: continuous)")
+        self.lpv_setTrigAmp   = LocalPV(self.modName, self.jobName, "SET-TRIG-AMP",  "", "",    1, "ao",      "trigger rel amplitude error")
+        self.lpv_setTrigPha   = LocalPV(self.modName, self.jobName, "SET-TRIG-PHA",  "", "deg", 1, "ao",      "trigger phase error")
+        self.lpv_setTrigPre   = LocalPV(self.modName, self.jobName, "SET-TRIG-PRE",  "", "",    1, "longout", "pre-trigger samples")
+        self.lpv_setTrigPost  = LocalPV(self.modName, self.jobName, "SET-TRIG-POST", "", "",    1, "longout", "post-trigger samples")
+
+        self.lpv_setTuneMode  = LocalPV(self.modName, self.jobName, "SET-TUNE-MODE", "", "",  1, "longout", "tune 0: notch LP, 1: NCO")
+        self.lpv_setTuneNFev  = LocalPV(self.modName, self.jobName, "SET-TUNE-NFEV", "", "",  1, "longout", "tune max evaluations")
+        self.lpv_setTuneSeed  = LocalPV(self.modName, self.jobName, "SET-TUNE-SEED", "", "",  1, "longout", "tune noise seed")
+        self.lpv_monTuneCost  = LocalPV(self.modName, self.jobName, "MON-TUNE-COST", "", "V", 1, "ai",      "tuned sideband amplitudes")
+
+        self.lpv_setRecFile   = LocalPV(self.modName, self.jobName, "SET-REC-FILE", "", "", 1, "stringout", "recorder file prefix")
+        self.lpv_setRecChan   = LocalPV(self.modName, self.jobName, "SET-REC-CHAN", "", "", 1, "stringout", "recorder channels")
+        self.lpv_setRecSize   = LocalPV(self.modName, self.jobName, "SET-REC-SIZE", "", "", 1, "longout",   "recorder samples per file")
+
         self.lpv_monVcIF      = LocalPV(self.modName, self.jobName, "MON-VC-IF",  "",   "V", Job_SimBLC.DAQ_SIZE, "waveform", "VC IF")
         self.lpv_monVcA       = LocalPV(self.modName, self.jobName, "MON-VC-A",   "",   "V", Job_SimBLC.DAQ_SIZE, "waveform", "VC amplitude")
         self.lpv_monVcP       = LocalPV(self.modName, self.jobName, "MON-VC-P",   "", "deg", Job_SimBLC.DAQ_SIZE, "waveform", "VC phase")
         self.lpv_monTimeX     = LocalPV(self.modName, self.jobName, "MON-TIME-X", "",  "us", Job_SimBLC.DAQ_SIZE, "waveform", "time x axis")                
         self.lpv_monVcIFSpecF = LocalPV(self.modName, self.jobName, "MON-SPEC-F", "",  "Hz", Job_SimBLC.DAQ_SIZE, "waveform", "VC IF spec freq")
         self.lpv_monVcIFSpecA = LocalPV(self.modName, self.jobName, "MON-SPEC-A", "",  "dB", Job_SimBLC.DAQ_SIZE, "waveform", "VC IF spec amplitude")
+        self.lpv_monDaqSeq    = LocalPV(self.modName, self.jobName, "MON-DAQ-SEQ", "", "",   1, "longin",   "DAQ block sequence number")
+
+        # optional DAQ channels (see DAQ_Channels), published if enabled by the mask
+        self.lpv_setDaqChan   = LocalPV(self.modName, self.jobName, "SET-DAQ-CHAN", "", "", 1, "longout", "DAQ channel mask")
+        self.lpv_monChan      = {key: LocalPV(self.modName, self.jobName, channel_pv(key), "", unit, 
+                                              Job_SimBLC.DAQ_SIZE, "waveform", desc) \
+                                 for key, unit, desc in channel_keys()}
+
+        # harmonic monitor (carrier and beam harmonic sidebands -MAX_BH ... MAX_BH)
+        self.lpv_monHarmF     = LocalPV(self.modName, self.jobName, "MON-HARM-F", "",  "Hz", 2*Job_SimBLC.MAX_BH+1, "waveform", "harmonic freq offsets")
+        self.lpv_monHarmA     = LocalPV(self.modName, self.jobName, "MON-HARM-A", "",   "V", 2*Job_SimBLC.MAX_BH+1, "waveform", "harmonic amplitudes")
+        self.lpv_monHarmP     = LocalPV(self.modName, self.jobName, "MON-HARM-P", "", "deg", 2*Job_SimBLC.MAX_BH+1, "waveform", "harmonic phases")
+
+        # waveforms of the decimation stages (multi-resolution DAQ)
+        dec = dict(Sim_Engine.DEFAULT_CFG, **(cfg or {}))['dec']
+        self.lpv_monVcADec    = [LocalPV(self.modName, self.jobName, "MON-VC-A-D"   + str(k+1), "",   "V", Sim_Engine.DEC_SIZE, "waveform", "VC amplitude x" + str(f)) \
+                                 for k, f in enumerate(dec)]
+        self.lpv_monVcPDec    = [LocalPV(self.modName, self.jobName, "MON-VC-P-D"   + str(k+1), "", "deg", Sim_Engine.DEC_SIZE, "waveform", "VC phase x" + str(f)) \
+                                 for k, f in enumerate(dec)]
+        self.lpv_monTimeXDec  = [LocalPV(self.modName, self.jobName, "MON-TIME-X-D" + str(k+1), "",  "us", Sim_Engine.DEC_SIZE, "waveform", "time x axis x" + str(f)) \
+                                 for k, f in enumerate(dec)]
                 
         # parameters of the beam and cavity
-        frf     = 650e6                     # RF operation frequency, Hz
-        dw      = 0                         # cavity detuning, rad/s
-        RoQ     = 106.5                     # R/Q (circular machine convence), Ohm
-        QL      = 1.5e5                     # loaded quality factor
-        Qb      = 1.6e-19 * 14e10           # bunch charge, C
-        h       = 216820 / 10               # harmonic number
-        phb     = -50 * np.pi / 180         # beam accelerating phase, rad
-
-        self.vc_sp = 1e6                    # desired cavit voltage        
-        self.fb    = frf / h                # bunch repititon rate, Hz              
-        self.fs    = 4000 * self.fb         # sampling frequency, Hz
-        self.fif   = 500 * self.fb          # IF frequency, Hz
-
-        # define the cavity and controller object
-        self.cav = Cavity()
-        self.ctl = Controller()
-        self.cav.set_param(frf       = frf, 
-                           RoQ       = RoQ, 
-                           QL        = QL, 
-                           detuning  = dw / 2 / np.pi,
-                           charge    = Qb,
-                           fb        = self.fb,
-                           phib      = phb * 180 / np.pi,
-                           fs        = self.fs,
-                           fif       = self.fif,
-                           npsd      = -130.0)
-
-        # mutex
-        self.mutex = threading.Lock()
-        
-        # variables and buffers
-        self.init_done = False
-        self.daq_id    = 0
-        self.sim_time  = 0.0
-        self.vact      = 0.0
-
-        self.sig_vcif = np.zeros(Job_SimBLC.DAQ_SIZE)
-        self.sig_vca  = np.zeros(Job_SimBLC.DAQ_SIZE)
-        self.sig_vcp  = np.zeros(Job_SimBLC.DAQ_SIZE)
-        self.time_x   = np.zeros(Job_SimBLC.DAQ_SIZE)
-
-        # define the local thread
-        self.simThread = threading.Thread(target = self.sim_step,
-                                          args   = (),
-                                          daemon = True,
-                                          name   = "TRD-JOB")       
+        self.cfg         = cfg
+        self.use_process = use_process
+        self.pool        = None             # worker pool running the job (None for own thread)
+        self.tuneThread  = None             # thread of the auto-tuning
+        self.fb, self.fs, self.fif = derive_freqs(dict(Sim_Engine.DEFAULT_CFG, **(cfg or {})))
+
+        # published by the command thread, picked up by the simulation thread
+        # at its next block boundary (reference swaps, no lock)
+        self.param_new    = None            # latest parameter set
+        self.scenario_new = None            # latest scenario
+        self.reset_req    = 0               # counter of reset requests
+        self.reset_ack    = 0               # counter of handled reset requests
+        self.cmd_fifo     = collections.deque() # trigger/channel/recorder commands (append/popleft are atomic)
+        self.daq_seq      = 0               # sequence number of the published DAQ blocks
+
+        # simulation engine in this process (driven by the local thread) or in 
+        # a child process (the local thread publishes the DAQ from the ring)
+        if not use_process:
+            self.engine    = Sim_Engine(cfg, self._publish_daq, self._publish_harm, self._publish_dec)
+            self.simThread = threading.Thread(target = self.sim_step,
+                                              args   = (),
+                                              daemon = True,
+                                              name   = "TRD-JOB")       
+        else:
+            self.ctx       = multiprocessing.get_context('spawn')
+            self.cmd_q     = self.ctx.Queue()
+            self.daq_q     = self.ctx.Queue()
+            self.free_sem  = self.ctx.Semaphore(Job_SimBLC.N_SLOT)
+            self.simThread = threading.Thread(target = self.daq_step,
+                                              args   = (),
+                                              daemon = True,
+                                              name   = "TRD-JOB")
 
         print("INFO: Job_SimBLC object created.")
 
@@ -126,88 +181,84 @@ class Job_SimBLC(Job):
     # start the thread
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     def letGoing(self):
-        print('INFO: Thread TRD-JOB started.')
-        self.simThread.start()
+        # the jobs on a worker pool are started by the pool
+        if self.pool is None:
+            if self.use_process:
+                self.open_ring()
+                self.simProc = self.ctx.Process(target = engine_process,
+                                                args   = ([self.engine_args()],),
+                                                daemon = True,
+                                                name   = "PRC-JOB")
+                self.simProc.start()
+                print('INFO: Process PRC-JOB started.')
+
+            print('INFO: Thread TRD-JOB started.')
+            self.simThread.start()
+
+        elif self.use_process:
+            print('INFO: Thread TRD-JOB started.')
+            self.simThread.start()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # create the DAQ ring for the engine in a child process
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def open_ring(self):
+        self.shm  = shared_memory.SharedMemory(create = True, 
+                        size = Job_SimBLC.N_SLOT * len(Sim_Engine.DAQ_KEYS) * \
+                               Job_SimBLC.DAQ_SIZE * 8)
+        self.ring = np.ndarray((Job_SimBLC.N_SLOT, len(Sim_Engine.DAQ_KEYS), Job_SimBLC.DAQ_SIZE),
+                               dtype = float, buffer = self.shm.buf)
+        self.chan_shm  = None               # ring of the enabled channels (created by the engine)
+        self.chan_ring = None
+        self.chan_keys = []
+        atexit.register(self.stop)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # arguments of the engine in a child process (see Remote_Engine)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def engine_args(self):
+        return (self.cfg, self.cmd_q, self.daq_q, self.shm.name, Job_SimBLC.N_SLOT, self.free_sem)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # simulate a block in the calling thread (engine in this process)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def run_once(self):
+        # pick up the published parameters and commands
+        self._sync()
+
+        # do a block of simulation
+        return self.engine.run_block()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # stop the child process and release the shared memory
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def stop(self):
+        if (not self.use_process) or (not hasattr(self, 'shm')):
+            return
+
+        self.cmd_q.put(('stop', None))
+        if hasattr(self, 'simProc'):
+            self.simProc.join(timeout = 5.0)
+        self.simThread.join(timeout = 5.0)      # releases the channel ring
+        del self.ring
+        self.shm.close()
+        self.shm.unlink()
+        del self.shm
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     # execute the job  
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     def execute(self, cmdId, dataBus):
-        # response to command: SET-PARAM
+        # response to command: SET-PARAM (legacy scalar PVs)
         if cmdId == 0:
-            # get the parameters from the PVs
-            ndemod, _, _, _ = self.lpv_setNDemod.read()
-            lp_pha, _, _, _ = self.lpv_setLoopPha.read()
-            Kp,     _, _, _ = self.lpv_setKp.read()
-            Ki,     _, _, _ = self.lpv_setKi.read()
-
-            notch_fn  = []
-            notch_g   = []
-            notch_hbw = []
-            notch_lp  = []
-            nco_fn    = []
-            nco_amp   = []
-            nco_phap  = []
-            nco_phan  = []
-
-            for i in range(Job_SimBLC.MAX_BH):
-                ft,   _, _, _ = self.lpv_enaNotchH[i].read()
-                g,    _, _, _ = self.lpv_setNotchG[i].read()
-                hbw,  _, _, _ = self.lpv_setNotchHbw[i].read()
-                lp,   _, _, _ = self.lpv_setNotchLp[i].read()
-                fo,   _, _, _ = self.lpv_enaNCOH[i].read()
-                amp,  _, _, _ = self.lpv_setNCOA[i].read()
-                phap, _, _, _ = self.lpv_setNCOPp[i].read()
-                phan, _, _, _ = self.lpv_setNCOPn[i].read()
-
-                notch_fn.append (ft)
-                notch_g.append  (g)
-                notch_hbw.append(hbw)
-                notch_lp.append (lp)
-                nco_fn.append   (fo)
-                nco_amp.append  (amp)
-                nco_phap.append (phap)
-                nco_phan.append (phan)
-
-            notch_fn    = np.array(notch_fn)
-            notch_g     = np.array(notch_g)
-            notch_hbw   = np.array(notch_hbw)
-            notch_lp    = np.array(notch_lp)
-            nco_fn      = np.array(nco_fn)
-            nco_amp     = np.array(nco_amp)
-            nco_phap    = np.array(nco_phap)
-            nco_phan    = np.array(nco_phan)
-
-            # set the parameters for controller
-            notch_sel   = np.where(notch_fn == 1)[0]
-            notch_gain  = notch_g[notch_sel] * np.exp(1j * notch_lp[notch_sel] * np.pi / 180.0)
-            notch_wh    = notch_hbw[notch_sel]
-            nco_sel     = np.where(nco_fn == 1)[0]
-            nco_a       = nco_amp[nco_sel]
-            nco_pp      = nco_phap[nco_sel]
-            nco_pn      = nco_phan[nco_sel]
-
-            notches = {'freq_offs': np.hstack((notch_sel+1, -notch_sel-1)) * self.fb,
-                       'gain':      np.hstack((notch_gain, np.conj(notch_gain))),
-                       'half_bw':   np.hstack((notch_wh, notch_wh))}
-            ffncos  = {'freq_offs': np.hstack((nco_sel+1, -nco_sel-1)) * self.fb,
-                       'amp_cal':   np.hstack((nco_a, nco_a)),
-                       'pha_cal':   np.hstack((nco_pp, nco_pn))}
-
-            self.mutex.acquire()
-            self.ctl.set_param(fb      = self.fb,
-                               fs      = self.fs,
-                               fif     = self.fif,
-                               ndemod  = int(ndemod),       # 240 = delay of 1 us
-                               lp_pha  = lp_pha,
-                               Kp      = Kp,
-                               Ki      = Ki,
-                               notches = notches,
-                               ffncos  = ffncos)
-            self.mutex.release()     
-           
-            # indicate the init is done
-            self.init_done = True  
+            # get the tables from the scalar PVs and mirror them to the array PVs
+            tables = {}
+            for key, (lpv_arr, lpv_list) in self.lpv_tables.items():
+                tables[key] = np.array([lpv.read()[0] for lpv in lpv_list], dtype = float)
+                lpv_arr.write(tables[key])
+
+            # publish the parameters
+            self._publish_param(tables)
 
             # message and return          
             print("INFO: Set parameters.")   
@@ -215,13 +266,8 @@ class Job_SimBLC(Job):
 
         # response to command: RESET
         elif cmdId == 1:
-            # reset the model
-            self.mutex.acquire()
-            self.cav.reset()
-            self.ctl.reset()
-                        
-            self.daq_id   = 0
-            self.sim_time = 0.0
+            # request to reset the model (done by the simulation thread)
+            self._send('reset', None)
 
             self.lpv_monVcIF.write      (np.zeros(Job_SimBLC.DAQ_SIZE))
             self.lpv_monVcA.write       (np.zeros(Job_SimBLC.DAQ_SIZE))
@@ -229,68 +275,317 @@ class Job_SimBLC(Job):
             self.lpv_monTimeX.write     (np.arange(Job_SimBLC.DAQ_SIZE) / self.fs * 1e6)
             self.lpv_monVcIFSpecF.write (np.zeros(Job_SimBLC.DAQ_SIZE))
             self.lpv_monVcIFSpecA.write (np.zeros(Job_SimBLC.DAQ_SIZE))
-            self.mutex.release()
+            for k in range(len(self.lpv_monVcADec)):
+                self.lpv_monVcADec[k].write  (np.zeros(Sim_Engine.DEC_SIZE))
+                self.lpv_monVcPDec[k].write  (np.zeros(Sim_Engine.DEC_SIZE))
+                self.lpv_monTimeXDec[k].write(np.zeros(Sim_Engine.DEC_SIZE))
+            self.lpv_monHarmA.write     (np.zeros(2*Job_SimBLC.MAX_BH+1))
+            self.lpv_monHarmP.write     (np.zeros(2*Job_SimBLC.MAX_BH+1))
+            for lpv in self.lpv_monChan.values():
+                lpv.write(np.zeros(Job_SimBLC.DAQ_SIZE))
                         
             print("INFO: Reset simulation.")
             return dataBus, True
 
+        # response to command: LOAD-SCENARIO
+        elif cmdId == 2:
+            # load the scenario file (empty file name to remove the scenario)
+            fname, _, _, _ = self.lpv_setScenario.read()
+            scenario = None
+            if fname:
+                try:
+                    scenario = Scenario()
+                    scenario.load(fname, fs = self.fs)
+                except (IOError, ValueError, KeyError) as e:
+                    print("ERROR: Failed to load scenario " + fname + ": " + str(e))
+                    return dataBus, False
+
+            self._send('scenario', scenario)
+
+            print("INFO: Load scenario " + fname + ".")
+            return dataBus, True
+
+        # response to command: SET-PARAM-ARRAY (bulk, array PVs)
+        elif cmdId == 3:
+            # get the tables from the array PVs (mirrored to the scalar PVs)
+            tables = self._read_tables()
+
+            # publish the parameters
+            self._publish_param(tables)
+
+            print("INFO: Set parameters (array).")
+            return dataBus, True
+
+        # response to command: REC-START
+        elif cmdId == 4:
+            # get the file prefix, channels (comma separated) and file size
+            prefix,   _, _, _ = self.lpv_setRecFile.read()
+            channels, _, _, _ = self.lpv_setRecChan.read()
+            nmax,     _, _, _ = self.lpv_setRecSize.read()
+            channels = [ch.strip() for ch in channels.split(',') if ch.strip()]
+            if (not prefix) or (not channels) or (int(nmax) <= 0):
+                print("ERROR: Recorder file, channels or size not set!")
+                return dataBus, False
+
+            self._send('record', ('start', (prefix, channels, int(nmax))))
+
+            print("INFO: Start recording to " + prefix + ".")
+            return dataBus, True
+
+        # response to command: REC-STOP
+        elif cmdId == 5:
+            self._send('record', ('stop', None))
+
+            print("INFO: Stop recording.")
+            return dataBus, True
+
+        # response to command: REC-ROTATE
+        elif cmdId == 6:
+            self._send('record', ('rotate', None))
+
+            print("INFO: Rotate recording file.")
+            return dataBus, True
+
+        # response to command: SET-TRIGGER
+        elif cmdId == 7:
+            # sources: 1 amplitude error, 2 phase error, 4 beam event, 8 scenario event
+            src,     _, _, _ = self.lpv_setTrigSrc.read()
+            amp_thr, _, _, _ = self.lpv_setTrigAmp.read()
+            pha_thr, _, _, _ = self.lpv_setTrigPha.read()
+            npre,    _, _, _ = self.lpv_setTrigPre.read()
+            npost,   _, _, _ = self.lpv_setTrigPost.read()
+
+            self._send('trigger', {'src':     int(src),
+                                   'amp_thr': amp_thr,
+                                   'pha_thr': pha_thr,
+                                   'npre':    int(npre),
+                                   'npost':   int(npost)})
+
+            print("INFO: Set trigger.")
+            return dataBus, True
+
+        # response to command: AUTO-TUNE
+        elif cmdId == 8:
+            # tune in a separate thread (takes seconds to minutes)
+            if (self.tuneThread is not None) and self.tuneThread.is_alive():
+                print("ERROR: Auto-tuning is running!")
+                return dataBus, False
+
+            mode,   _, _, _ = self.lpv_setTuneMode.read()
+            maxfev, _, _, _ = self.lpv_setTuneNFev.read()
+            seed,   _, _, _ = self.lpv_setTuneSeed.read()
+            self.tuneThread = threading.Thread(target = self._auto_tune,
+                                               args   = ('nco' if int(mode) == 1 else 'notch', 
+                                                         max(int(maxfev), 1),
+                                                         int(seed)),
+                                               daemon = True,
+                                               name   = "TRD-TUNE")
+            self.tuneThread.start()
+
+            print("INFO: Start auto-tuning.")
+            return dataBus, True
+
+        # response to command: SET-DAQ-CHAN
+        elif cmdId == 9:
+            # bit mask of the optional DAQ channels (see DAQ_Channels)
+            mask, _, _, _ = self.lpv_setDaqChan.read()
+            self._send('channels', int(mask))
+
+            print("INFO: Set DAQ channels " + ', '.join(channel_names(int(mask))) + ".")
+            return dataBus, True
+
         # unkown commands
         else:
             print("ERROR: Command not known!")
             return dataBus, False
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
-    # simulation for a step
+    # simulation thread (engine in this process)
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     def sim_step(self):
         while True:
-            # check the init
-            if not self.init_done:
+            # do a block of simulation
+            if self.run_once() == 0:
                 time.sleep(0.1)
                 continue
-        
-            # lock access to the model
-            self.mutex.acquire()
-        
-            # do a step of simulation
-            _, vc_if, vf_if, vr_if = self.cav.sim_step(self.vact)
-            vc, self.vact = self.ctl.sim_step(vc_if, 
-                                             self.vc_sp * np.exp(1j * np.pi / 6), 
-                                             fb_enable = True,
-                                             ff_enable = True)
-
-            # update the simulation time
-            self.sim_time = self.sim_time + 1.0 / self.fs
-
-            # collect the results
-            if self.daq_id < Job_SimBLC.DAQ_SIZE:
-                self.sig_vcif[self.daq_id] = vc_if
-                self.sig_vca[self.daq_id]  = np.abs(vc)
-                self.sig_vcp[self.daq_id]  = np.angle(vc, deg = True)
-                self.time_x[self.daq_id]   = self.sim_time
-
-            # write the DAQ waveform and restart
-            self.daq_id = self.daq_id + 1
-            if self.daq_id == Job_SimBLC.DAQ_SIZE:
-                self.lpv_monVcIF.write  (self.sig_vcif)
-                self.lpv_monVcA.write   (self.sig_vca)
-                self.lpv_monVcP.write   (self.sig_vcp)
-                self.lpv_monTimeX.write (self.time_x)
-
-                #result = calc_psd_coherent(self.sig_vcif, fs = self.fs, n_noniq = 8)
-                result = calc_psd(self.sig_vcif, fs = self.fs)
-                self.lpv_monVcIFSpecF.write(result['freq'])
-                self.lpv_monVcIFSpecA.write(result['amp_resp'])
-
-            if self.daq_id >= Job_SimBLC.DAQ_SIZE:
-                self.daq_id = 0
-
-            # end of usage of the model
-            self.mutex.release()
 
             # wait
             time.sleep(0.00001)
 
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # DAQ thread (engine in a child process)
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def daq_step(self):
+        while True:
+            # wait for a DAQ block in the ring and publish it from there
+            kind, arg = self.daq_q.get()
+            if kind == 'harm':
+                self._publish_harm(arg)
+                continue
+            if kind == 'dec':
+                self._publish_dec(arg)
+                continue
+            if kind == 'chan_ring':
+                self._attach_chan(*arg)
+                continue
+            if kind in ('error', 'stop'):
+                if kind == 'error':
+                    print("ERROR: Simulation process failed:\n" + arg)
+                self._attach_chan(None, [])
+                return
+
+            slot, seq, lens = arg
+            daq = {key: self.ring[slot, i, :lens[i]] for i, key in enumerate(Sim_Engine.DAQ_KEYS)}
+            daq.update({key: self.chan_ring[slot, i, :lens[0]] for i, key in enumerate(self.chan_keys)})
+            self._publish_daq(daq)
+            self.free_sem.release()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # private functions
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    def _read_ctl_param(self):
+        # get the scalar parameters from the PVs
+        ndemod, _, _, _ = self.lpv_setNDemod.read()
+        lp_pha, _, _, _ = self.lpv_setLoopPha.read()
+        Kp,     _, _, _ = self.lpv_setKp.read()
+        Ki,     _, _, _ = self.lpv_setKi.read()
+        nctl,   _, _, _ = self.lpv_setNCtl.read()
+        intp,   _, _, _ = self.lpv_setCtlIntp.read()
+
+        return {'fb':      self.fb,
+                'fs':      self.fs,
+                'fif':     self.fif,
+                'ndemod':  int(ndemod),       # 240 = delay of 1 us
+                'lp_pha':  lp_pha,
+                'Kp':      Kp,
+                'Ki':      Ki,
+                'nctl':    max(1, int(nctl)),   # 1 = controller at fs
+                'interp':  'linear' if intp else 'hold'}
+
+    def _read_tables(self):
+        # get the tables from the array PVs and mirror them to the scalar PVs
+        tables = {}
+        for key, (lpv_arr, lpv_list) in self.lpv_tables.items():
+            val, _, _, _ = lpv_arr.read()
+            tables[key]  = np.zeros(Job_SimBLC.MAX_BH)
+            val          = np.atleast_1d(np.asarray(val, dtype = float))[:Job_SimBLC.MAX_BH]
+            tables[key][:len(val)] = val
+            for i, lpv in enumerate(lpv_list):
+                lpv.write(tables[key][i])
+        return tables
+
+    def _publish_param(self, tables):
+        # publish the parameters for controller (applied by the simulation 
+        # thread at its next block boundary)
+        self._send('param', Param_Set(self._read_ctl_param(), tables))
+
+    def _auto_tune(self, mode, maxfev, seed):
+        # tune the notch/NCO tables on a copy of the model (tuning thread)
+        tuner = Auto_Tuner(self.cfg)
+        try:
+            tuner.set_param(self._read_ctl_param(), self._read_tables(), 
+                            mode = mode, maxfev = maxfev, seed = seed)
+            tables, cost = tuner.run()
+        except (ValueError, RuntimeError) as e:
+            print("ERROR: Auto-tuning failed: " + str(e))
+            return
+
+        # write the tuned tables back to the PVs and apply them
+        for key, (lpv_arr, lpv_list) in self.lpv_tables.items():
+            lpv_arr.write(tables[key])
+            for i, lpv in enumerate(lpv_list):
+                lpv.write(tables[key][i])
+        self.lpv_monTuneCost.write(cost)
+        self._publish_param(tables)
+
+        print("INFO: Auto-tuning (" + mode + ") done with " + str(tuner.nfev) + \
+              " evaluations, cost = " + str(cost) + " V.")
+
+    def _send(self, cmd, arg):
+        # send a command to the engine: queue to the child process, or publish
+        # by reference swap to the local simulation thread
+        if self.use_process:
+            self.cmd_q.put((cmd, arg))
+        elif cmd == 'param':
+            self.param_new = arg
+        elif cmd == 'scenario':
+            self.scenario_new = arg
+        elif cmd == 'reset':
+            self.reset_req += 1
+        elif cmd in ('trigger', 'record', 'channels'):
+            self.cmd_fifo.append((cmd, arg))
+
+    def _sync(self):
+        # apply the latest parameter set if a new one is published
+        ps = self.param_new
+        if (ps is not None) and (ps is not self.engine.param_cur):
+            self.engine.set_param(ps)
+
+        # switch to the latest scenario
+        sc = self.scenario_new
+        if sc is not self.engine.scenario:
+            self.engine.set_scenario(sc)
+
+        # reset the model if requested
+        req = self.reset_req
+        if req != self.reset_ack:
+            self.reset_ack = req
+            self.engine.reset()
+
+        # set the trigger/channels and control the recorder in the order of 
+        # the commands
+        while self.cmd_fifo:
+            cmd, arg = self.cmd_fifo.popleft()
+            if cmd == 'trigger':
+                self.engine.set_trigger(arg)
+            elif cmd == 'channels':
+                self.engine.set_channels(arg)
+            else:
+                self.engine.record(*arg)
+
+    def _attach_chan(self, name, keys):
+        # switch to a new ring of the channels (None for no channel), the DAQ
+        # blocks in the old one are published
+        if self.chan_shm is not None:
+            self.chan_ring = None
+            self.chan_shm.close()
+            self.chan_shm.unlink()
+            self.chan_shm  = None
+
+        self.chan_keys = keys
+        if name is not None:
+            self.chan_shm  = shared_memory.SharedMemory(name = name)
+            self.chan_ring = np.ndarray((Job_SimBLC.N_SLOT, len(keys), Job_SimBLC.DAQ_SIZE),
+                                        dtype = float, buffer = self.chan_shm.buf)
+
+    def _publish_daq(self, daq):
+        # write the DAQ waveforms, then the sequence number (clients monitoring
+        # it get a complete block when it changes)
+        self.lpv_monVcIF.write      (daq['vc_if'])
+        self.lpv_monVcA.write       (daq['vc_a'])
+        self.lpv_monVcP.write       (daq['vc_p'])
+        self.lpv_monTimeX.write     (daq['time_x'])
+        self.lpv_monVcIFSpecF.write (daq['spec_f'])
+        self.lpv_monVcIFSpecA.write (daq['spec_a'])
+        for key, lpv in self.lpv_monChan.items():
+            if key in daq:
+                lpv.write(daq[key])
+        self.daq_seq += 1
+        self.lpv_monDaqSeq.write    (self.daq_seq)
+
+    def _publish_harm(self, harm):
+        # write the harmonic monitor
+        self.lpv_monHarmF.write     (harm['harm_f'])
+        self.lpv_monHarmA.write     (harm['harm_a'])
+        self.lpv_monHarmP.write     (harm['harm_p'])
+
+    def _publish_dec(self, dec):
+        # write the histories of the decimation stages
+        for k in range(len(self.lpv_monVcADec)):
+            self.lpv_monVcADec[k].write  (dec['vc_a_d'   + str(k+1)])
+            self.lpv_monVcPDec[k].write  (dec['vc_p_d'   + str(k+1)])
+            self.lpv_monTimeXDec[k].write(dec['time_x_d' + str(k+1)])
+
 
 
 
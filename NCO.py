@@ -58,6 +58,24 @@ class NCO():
         # generate output 
         return vo
 
+    # -------------------------------------------
+    # simulate a block of steps
+    # Input: n - number of steps
+    # -------------------------------------------
+    def sim_block(self, n):
+        # check if initialized
+        if not self.initialized:
+            return np.zeros(n)
+
+        # update the output
+        vo = np.exp(1j * (self.cnt + np.arange(n)) * self.dpha)
+
+        # update the counter
+        self.cnt += n
+
+        # generate output
+        return vo
+
 
 
     
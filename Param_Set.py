@@ -0,0 +1,85 @@
+#####################################################################
+#  Copyright (c) 2024 by Zheqiao Geng
+#  All rights reserved.
+#####################################################################
+#################################################################
+# Immutable, versioned parameter set of the controller. It is
+# built by the command thread and published to the simulation
+# thread by an atomic reference swap
+#################################################################
+import itertools
+import types
+import numpy as np
+
+# =================================================
+# define the class
+# =================================================
+class Param_Set():
+    # -------------------------------------------
+    # class variables
+    # -------------------------------------------
+    __slots__ = ('version', 'ctl_param', 'tables', 'notches', 'ffncos')
+    _versions = itertools.count(1)      # version counter (thread-safe increment)
+
+    # -------------------------------------------
+    # construction
+    # Input: ctl_param - dict of scalar parameters of Controller.set_param
+    #                    (fb, fs, fif, ndemod, lp_pha, Kp, Ki, nctl, interp)
+    #        tables    - dict of per-harmonic notch/NCO arrays (enable, gain,
+    #                    HBW, loop phase, amplitude, +/- phases)
+    # -------------------------------------------
+    def __init__(self, ctl_param, tables):
+        # freeze the inputs (copies that nobody else can modify)
+        tables = {k: np.array(v, dtype = float) for k, v in tables.items()}
+        for v in tables.values():
+            v.setflags(write = False)
+
+        notches, ffncos = build_ctl_tables(tables, ctl_param['fb'])
+        for v in list(notches.values()) + list(ffncos.values()):
+            v.setflags(write = False)
+
+        object.__setattr__(self, 'version',   next(Param_Set._versions))
+        object.__setattr__(self, 'ctl_param', types.MappingProxyType(dict(ctl_param)))
+        object.__setattr__(self, 'tables',    types.MappingProxyType(tables))
+        object.__setattr__(self, 'notches',   types.MappingProxyType(notches))
+        object.__setattr__(self, 'ffncos',    types.MappingProxyType(ffncos))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Param_Set is immutable')
+
+    def __reduce__(self):
+        # pickle support (e.g. to send to a child process), keep the version
+        return (_restore_param_set, (self.version, dict(self.ctl_param), dict(self.tables)))
+
+# =================================================
+# restore a pickled parameter set
+# =================================================
+def _restore_param_set(version, ctl_param, tables):
+    ps = Param_Set(ctl_param, tables)
+    object.__setattr__(ps, 'version', version)
+    return ps
+
+# =================================================
+# build the notch/NCO data structures of the controller
+# Input:  tables  - dict of per-harmonic arrays (see Scenario.TABLE_KEYS)
+#         fb      - bunch rep freq, Hz
+# Output: notches - data structure for notch controller
+#         ffncos  - data structure for NCO based feedforward
+# =================================================
+def build_ctl_tables(tables, fb):
+    notch_sel   = np.where(tables['notch_ena'] == 1)[0]
+    notch_gain  = tables['notch_gain'][notch_sel] * np.exp(1j * tables['notch_lp'][notch_sel] * np.pi / 180.0)
+    notch_wh    = tables['notch_hbw'][notch_sel]
+    nco_sel     = np.where(tables['nco_ena'] == 1)[0]
+    nco_a       = tables['nco_amp'][nco_sel]
+    nco_pp      = tables['nco_phap'][nco_sel]
+    nco_pn      = tables['nco_phan'][nco_sel]
+
+    notches = {'freq_offs': np.hstack((notch_sel+1, -notch_sel-1)) * fb,
+               'gain':      np.hstack((notch_gain, np.conj(notch_gain))),
+               'half_bw':   np.hstack((notch_wh, notch_wh))}
+    ffncos  = {'freq_offs': np.hstack((nco_sel+1, -nco_sel-1)) * fb,
+               'amp_cal':   np.hstack((nco_a, nco_a)),
+               'pha_cal':   np.hstack((nco_pp, nco_pn))}
+    return notches, ffncos
+
@@ -0,0 +1,187 @@
+#####################################################################
+#  Copyright (c) 2024 by Zheqiao Geng
+#  All rights reserved.
+#####################################################################
+#################################################################
+# Streaming recorder: appends the selected signals block by block
+# to preallocated, memory-mapped files with a small index header
+#################################################################
+import json
+import numpy as np
+
+from Precision import *
+
+# =================================================
+# define the class
+# =================================================
+class Recorder():
+    # -------------------------------------------
+    # class variables
+    # -------------------------------------------
+    HDR_SIZE   = 4096               # size of the index header, bytes
+    MAGIC      = b'SIMBLC-REC'      # magic string at the file start
+    FLUSH_SIZE = 2**20              # samples written between flushes (bounds the dirty pages)
+    CHANNELS   = {'vc':      'complex128',  # cavity voltage phasor (model), V
+                  'vc_meas': 'complex128',  # demodulated cavity voltage phasor (controller), V
+                  'vc_if':   'float64',     # IF signal of the cavity voltage, V
+                  'vf_if':   'float64',     # IF signal of the cavity drive (controller output), V
+                  'vr_if':   'float64'}     # IF signal of the reflection, V
+
+    # -------------------------------------------
+    # construction
+    # -------------------------------------------
+    def __init__(self):
+        # init variables
+        self.active = False         # True if recording
+        self.data   = None          # memory-mapped records of the current file
+        self.seq    = 0             # sequence number of the file
+
+    # -------------------------------------------
+    # start recording
+    # Input: prefix   - file name prefix, the files are <prefix>_<seq>.rec
+    #        channels - list of the channels to record (see CHANNELS)
+    #        nmax     - max number of samples per file (the file is rotated
+    #                   automatically when full)
+    #        fs       - sampling frequency, Hz (stored in the header)
+    #        cnt      - sample index of the next sample (since reset)
+    #        precision - 'double' or 'single' precision of the records (see
+    #                   Precision)
+    # -------------------------------------------
+    def start(self, prefix, channels, nmax = 2**24, fs = 10.0e6, cnt = 0, precision = 'double'):
+        # check the input
+        for ch in channels:
+            if ch not in Recorder.CHANNELS:
+                raise ValueError('Unknown recorder channel: ' + ch)
+
+        rtype, ctype = get_types(precision)
+
+        # stop the previous recording
+        self.stop()
+
+        # store the results
+        self.prefix   = prefix
+        self.channels = list(channels)
+        self.nmax     = int(nmax)
+        self.fs       = fs
+        self.cnt      = cnt
+        self.seq      = 0
+        self.chtypes  = {ch: np.dtype(ctype if Recorder.CHANNELS[ch].startswith('complex') else rtype).name \
+                         for ch in self.channels}
+        self.dtype    = np.dtype([(ch, self.chtypes[ch]) for ch in self.channels])
+
+        # open the first file
+        self._open()
+        self.active = True
+
+    # -------------------------------------------
+    # stop recording (the file is truncated to the recorded samples)
+    # -------------------------------------------
+    def stop(self):
+        if not self.active:
+            return
+        self._close()
+        self.active = False
+
+    # -------------------------------------------
+    # continue recording in a new file
+    # -------------------------------------------
+    def rotate(self):
+        if not self.active:
+            return
+        self._close()
+        self.seq += 1
+        self._open()
+
+    # -------------------------------------------
+    # append a block of samples
+    # Input: block - dict of the channel arrays (all of the same length, the
+    #                channels not recorded are ignored)
+    # -------------------------------------------
+    def append(self, block):
+        # check if active
+        if not self.active:
+            return
+
+        n = len(block[self.channels[0]])
+        i = 0
+        while i < n:
+            # rotate if the file is full
+            if self.count >= self.nmax:
+                self.rotate()
+
+            # copy the block to the memory-mapped file
+            m   = min(n - i, self.nmax - self.count)
+            rec = self.data[self.count:self.count + m]
+            for ch in self.channels:
+                rec[ch] = block[ch][i:i+m]
+
+            # flush regularly
+            self.count += m
+            self.cnt   += m
+            i          += m
+            if self.count - self.flushed >= Recorder.FLUSH_SIZE:
+                self._flush()
+
+    # -------------------------------------------
+    # private functions
+    # -------------------------------------------
+    def _open(self):
+        # preallocate the file and map the records
+        self.fname   = self.prefix + '_' + str(self.seq) + '.rec'
+        self.cnt0    = self.cnt
+        self.count   = 0
+        self.flushed = 0
+        with open(self.fname, 'wb') as f:
+            f.truncate(Recorder.HDR_SIZE + self.nmax * self.dtype.itemsize)
+        self.data = np.memmap(self.fname, dtype = self.dtype, mode = 'r+',
+                              offset = Recorder.HDR_SIZE, shape = (self.nmax,))
+        self._write_header()
+
+    def _close(self):
+        # flush and truncate the file to the recorded samples
+        self._flush()
+        del self.data
+        self.data = None
+        with open(self.fname, 'r+b') as f:
+            f.truncate(Recorder.HDR_SIZE + self.count * self.dtype.itemsize)
+        print('INFO: Recorded ' + str(self.count) + ' samples to ' + self.fname + '.')
+
+    def _flush(self):
+        # flush the records and update the number of samples in the header
+        self.data.flush()
+        self.flushed = self.count
+        self._write_header()
+
+    def _write_header(self):
+        hdr = json.dumps({'fs':       self.fs,
+                          'cnt0':     self.cnt0,
+                          'count':    self.count,
+                          'nmax':     self.nmax,
+                          'channels': [[ch, self.chtypes[ch]] for ch in self.channels]})
+        hdr = (Recorder.MAGIC + b'\n' + hdr.encode()).ljust(Recorder.HDR_SIZE - 1) + b'\n'
+        with open(self.fname, 'r+b') as f:
+            f.write(hdr)
+
+# =================================================
+# read a recorded file
+# Input:  fname - file name
+# Output: hdr   - dict of the index header (fs, cnt0 = sample index of the
+#                 first sample, count, nmax, channels)
+#         data  - memory-mapped structured array of the records, e.g.
+#                 data['vc'] for the cavity voltage phasor
+# =================================================
+def read_record(fname):
+    with open(fname, 'rb') as f:
+        hdr = f.read(Recorder.HDR_SIZE)
+    if not hdr.startswith(Recorder.MAGIC):
+        raise ValueError('Not a recorder file: ' + fname)
+
+    hdr   = json.loads(hdr[len(Recorder.MAGIC):].decode())
+    dtype = np.dtype([(ch, dt) for ch, dt in hdr['channels']])
+    if hdr['count'] == 0:
+        return hdr, np.zeros(0, dtype = dtype)
+
+    data  = np.memmap(fname, dtype = dtype, mode = 'r',
+                      offset = Recorder.HDR_SIZE, shape = (hdr['count'],))
+    return hdr, data
+
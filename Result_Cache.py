@@ -0,0 +1,186 @@
+#####################################################################
+#  Copyright (c) 2024 by Zheqiao Geng
+#  All rights reserved.
+#####################################################################
+#################################################################
+# Content-addressed on-disk cache of simulation results, keyed on
+# a canonical hash of the inputs and the code version, with
+# size-bounded LRU eviction
+#################################################################
+import os
+import json
+import inspect
+import hashlib
+import tempfile
+import importlib
+import importlib.metadata
+import numpy as np
+
+# =================================================
+# define the class
+# =================================================
+class Result_Cache():
+    # -------------------------------------------
+    # class variables
+    # -------------------------------------------
+    _code_version = None        # version of the code (see code_version)
+
+    # -------------------------------------------
+    # construction
+    # Input: path      - directory of the cache
+    #        max_bytes - max total size of the cached files, the least
+    #                    recently used ones are removed beyond it
+    # -------------------------------------------
+    def __init__(self, path = 'cache', max_bytes = 2**30):
+        self.path      = path
+        self.max_bytes = max_bytes
+        self.hits      = 0
+        self.misses    = 0
+        os.makedirs(path, exist_ok = True)
+
+    # -------------------------------------------
+    # canonical key of the inputs
+    # Input:  parts - any JSON-like structure of the inputs (dicts, lists,
+    #                 numbers, strings, numpy arrays/scalars, None)
+    # Output: hex string of the SHA-256 hash of the inputs and the code version
+    # -------------------------------------------
+    def key(self, *parts):
+        text = json.dumps([code_version(), _canonical(parts)], sort_keys = True,
+                          separators = (',', ':'))
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    # -------------------------------------------
+    # get a cached result
+    # Input:  key    - key of the result
+    # Output: result - dict of arrays/scalars (None if not cached)
+    # -------------------------------------------
+    def get(self, key):
+        fname = self._fname(key)
+        try:
+            with np.load(fname) as f:
+                result = {k: (f[k][()] if f[k].ndim == 0 else f[k]) for k in f.files}
+            os.utime(fname)                     # mark as recently used
+        except (IOError, ValueError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return result
+
+    # -------------------------------------------
+    # store a result
+    # Input: key    - key of the result
+    #        result - dict of arrays/scalars
+    # -------------------------------------------
+    def put(self, key, result):
+        # write to a temporary file and rename (atomic for concurrent writers)
+        fd, tmp = tempfile.mkstemp(dir = self.path, suffix = '.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez_compressed(f, **{k: np.asarray(v) for k, v in result.items()})
+        os.replace(tmp, self._fname(key))
+
+        self._evict()
+
+    # -------------------------------------------
+    # call a function with the cache
+    # Input:  func   - function returning a dict of arrays/scalars, its
+    #                  result must be fully determined by the arguments
+    #         args   - arguments of the function
+    # Output: result - cached or computed result
+    # Note: the function must take the seed of its noise as an argument 
+    #       (named seed), so that the seed is part of the key
+    # -------------------------------------------
+    def call(self, func, *args):
+        # check the input
+        if 'seed' not in inspect.signature(func).parameters:
+            raise ValueError('Cannot cache the unseeded function ' + func.__name__)
+
+        key    = self.key(func.__module__ + '.' + func.__name__, args)
+        result = self.get(key)
+        if result is None:
+            result = func(*args)
+            self.put(key, result)
+        return result
+
+    # -------------------------------------------
+    # private functions
+    # -------------------------------------------
+    def _fname(self, key):
+        return os.path.join(self.path, key + '.npz')
+
+    def _evict(self):
+        # remove the least recently used files beyond the size limit
+        files = []
+        for name in os.listdir(self.path):
+            if name.endswith('.npz'):
+                try:
+                    st = os.stat(os.path.join(self.path, name))
+                    files.append((st.st_mtime, st.st_size, name))
+                except OSError:
+                    pass
+
+        total = sum(f[1] for f in files)
+        for _, size, name in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
+            total -= size
+
+# =================================================
+# version of the simulation code: hash of the sources of all modules
+# of this directory (sorted by name) and of the version of llrflibs
+# =================================================
+def code_version():
+    if Result_Cache._code_version is None:
+        path = os.path.dirname(os.path.abspath(__file__))
+        h    = hashlib.sha256(llrflibs_version().encode())
+        for name in sorted(os.listdir(path)):
+            if name.endswith('.py'):
+                with open(os.path.join(path, name), 'rb') as f:
+                    h.update(name.encode() + f.read())
+        Result_Cache._code_version = h.hexdigest()
+    return Result_Cache._code_version
+
+# =================================================
+# version of llrflibs ('unknown' if not found)
+# =================================================
+def llrflibs_version():
+    try:
+        return importlib.metadata.version('llrflibs')
+    except importlib.metadata.PackageNotFoundError:
+        pass
+    try:
+        return str(getattr(importlib.import_module('llrflibs'), '__version__', 'unknown'))
+    except ImportError:
+        return 'unknown'
+
+# =================================================
+# convert the inputs to a canonical JSON structure
+# =================================================
+def _canonical(x):
+    if isinstance(x, dict):
+        return {str(k): _canonical(v) for k, v in x.items()}
+    if isinstance(x, (list, tuple)):
+        return [_canonical(v) for v in x]
+    if hasattr(x, 'items'):                     # mapping proxies
+        return _canonical(dict(x))
+    if isinstance(x, np.ndarray):
+        return {'shape': list(x.shape), 'data': _canonical(x.ravel().tolist())}
+    if isinstance(x, (complex, np.complexfloating)):
+        return ['complex', float(x.real), float(x.imag)]
+    if isinstance(x, (bool, np.bool_)):
+        return bool(x)
+    if isinstance(x, (int, np.integer)):
+        return int(x)
+    if isinstance(x, (float, np.floating)):
+        return repr(float(x))
+    if (x is None) or isinstance(x, str):
+        return x
+    if hasattr(x, '__dict__'):                  # objects like Scenario (w/o the run-time state)
+        skip = getattr(x, 'RUN_STATE', ())
+        return [type(x).__name__, _canonical({k: v for k, v in vars(x).items() if k not in skip})]
+    raise TypeError('Cannot hash ' + type(x).__name__)
+
@@ -0,0 +1,143 @@
+#####################################################################
+#  Copyright (c) 2024 by Zheqiao Geng
+#  All rights reserved.
+#####################################################################
+#################################################################
+# Scenario timeline: scripted parameter changes (steps and ramps)
+# compiled into sorted event arrays
+#################################################################
+import json
+import numpy as np
+
+# =================================================
+# define the class
+# =================================================
+class Scenario():
+    # -------------------------------------------
+    # class variables
+    # -------------------------------------------
+    SCALAR_KEYS = ['vc_sp',         # setpoint amplitude, V
+                   'vc_sp_pha',     # setpoint phase, deg
+                   'charge',        # bunch charge, C
+                   'Kp',            # proportional feedback gain
+                   'Ki',            # integral feedback gain
+                   'fb_enable',     # enable feedback (0/1)
+                   'ff_enable']     # enable feedforward (0/1)
+    TABLE_KEYS  = ['notch_ena',     # notch enable per beam harmonic
+                   'notch_gain',    # notch gain per beam harmonic
+                   'notch_hbw',     # notch half bandwidth per beam harmonic, Hz
+                   'notch_lp',      # notch loop phase per beam harmonic, deg
+                   'nco_ena',       # NCO enable per beam harmonic
+                   'nco_amp',       # NCO amplitude per beam harmonic
+                   'nco_phap',      # NCO phase +f per beam harmonic, deg
+                   'nco_phan']      # NCO phase -f per beam harmonic, deg
+    RUN_STATE   = ('idx',)          # run-time state (not part of the result cache key)
+
+    # -------------------------------------------
+    # construction
+    # -------------------------------------------
+    def __init__(self):
+        # init variables
+        self.idx         = 0        # index of the next event
+        self.initialized = False    # indicate if initialized or not
+
+    # -------------------------------------------
+    # load the scenario from a JSON file
+    # Input: fname - file name
+    #        fs    - sampling frequency, Hz
+    # Note: the file contains a list of events (or {"events": [...]}), each
+    #       event has a "time" (s, relative to the simulation reset) and
+    #       any of the SCALAR_KEYS/TABLE_KEYS with the new value, e.g.
+    #           {"time": 0.0,  "vc_sp": 1.0e6, "fb_enable": 1}
+    #           {"time": 1e-3, "notch_ena": [1, 1, 0, 0, 0, 0, 0, 0, 0, 0]}
+    #       or a linear ramp of a scalar parameter applied in steps, e.g.
+    #           {"time": 2e-3, "ramp": {"key": "charge", "from": 0.0,
+    #                                   "to": 2.2e-8, "duration": 1e-3,
+    #                                   "steps": 100}}
+    # -------------------------------------------
+    def load(self, fname, fs = 10.0e6):
+        with open(fname, 'r') as f:
+            events = json.load(f)
+
+        if isinstance(events, dict):
+            events = events['events']
+
+        self.set_param(fs = fs, events = events)
+
+    # -------------------------------------------
+    # set parameters (compile the events)
+    # Input: fs     - sampling frequency, Hz
+    #        events - list of event dicts (see load)
+    # -------------------------------------------
+    def set_param(self, fs = 10.0e6, events = None):
+        # check the input
+        if events is None:
+            events = []
+
+        # store the results
+        self.fs = fs
+
+        # expand the events and ramps into (time, key, value)
+        pos  = []
+        keys = []
+        vals = []
+        for ev in events:
+            t = float(ev['time'])
+            for key, val in ev.items():
+                if key == 'time':
+                    continue
+                elif key == 'ramp':
+                    if val['key'] not in Scenario.SCALAR_KEYS:
+                        raise ValueError('Unknown scenario ramp key: ' + str(val['key']))
+                    rt = np.linspace(t, t + float(val['duration']), int(val['steps']) + 1)
+                    rv = np.linspace(float(val['from']), float(val['to']), int(val['steps']) + 1)
+                    pos.extend(np.round(rt * fs).astype(np.int64))
+                    keys.extend([val['key']] * len(rt))
+                    vals.extend(rv)
+                elif key in Scenario.SCALAR_KEYS:
+                    pos.append(int(round(t * fs)))
+                    keys.append(key)
+                    vals.append(float(val))
+                elif key in Scenario.TABLE_KEYS:
+                    pos.append(int(round(t * fs)))
+                    keys.append(key)
+                    vals.append(np.asarray(val, dtype = float))
+                else:
+                    raise ValueError('Unknown scenario key: ' + key)
+
+        # sort by the sample position (keep the file order for the same position)
+        order     = np.argsort(np.array(pos, dtype = np.int64), kind = 'stable')
+        self.pos  = np.array(pos, dtype = np.int64)[order]
+        self.keys = [keys[i] for i in order]
+        self.vals = [vals[i] for i in order]
+        self.idx  = 0
+
+        # declare initialized
+        self.initialized = True
+
+    # -------------------------------------------
+    # reset (rewind to the beginning)
+    # -------------------------------------------
+    def reset(self):
+        self.idx = 0
+
+    # -------------------------------------------
+    # sample index of the next pending event (-1 if no more events)
+    # -------------------------------------------
+    def next_pos(self):
+        if (not self.initialized) or (self.idx >= len(self.pos)):
+            return -1
+        return int(self.pos[self.idx])
+
+    # -------------------------------------------
+    # get the events due at a sample index
+    # Input:  cnt    - sample index (since reset)
+    # Output: events - list of (key, value) in order
+    # -------------------------------------------
+    def pop(self, cnt):
+        events = []
+        while (self.next_pos() >= 0) and (self.pos[self.idx] <= cnt):
+            events.append((self.keys[self.idx], self.vals[self.idx]))
+            self.idx += 1
+        return events
+
@@ -3,36 +3,43 @@
 #  All rights reserved.
 #####################################################################
 # Python script to display the waveforms
-import time
-import numpy as np
 import matplotlib.pyplot as plt
-from epics import caget, caput
+
+from Client_SimBLC import *
 
 # get parameters
 prefix = 'SGE-BLC-JOBSIM:'
+client = Client_SimBLC(prefix)
 
-vc_if  = caget(prefix + 'MON-VC-IF')
-vc_a   = caget(prefix + 'MON-VC-A')
-vc_p   = caget(prefix + 'MON-VC-P')
-t_us   = caget(prefix + 'MON-TIME-X')
-spec_f = caget(prefix + 'MON-SPEC-F')
-spec_a = caget(prefix + 'MON-SPEC-A')
+# live plot of the DAQ blocks (redrawn at most fps times per second)
+live = False
+fps  = 5.0
+if live:
+    Live_Plot(client, fps = fps).show()
 
-plt.figure()
-plt.subplot(221)
-plt.plot(t_us, vc_a)
-plt.grid()
-plt.xlabel('Time ($\mu$s)')
-plt.ylabel('Amplitude (V)')
-plt.subplot(222)
-plt.plot(t_us, vc_p)
-plt.grid()
-plt.xlabel('Time ($\mu$s)')
-plt.ylabel('Phase (deg)')
-plt.subplot(223)
-plt.plot(spec_f, spec_a)
-plt.grid()
-plt.xlabel('Freq (Hz)')
-plt.ylabel('Mag (dB)')
-plt.show()
+# otherwise wait for the next complete DAQ block (all waveforms of the same block)
+else:
+    client.subscribe()
+    seq, daq = client.get_daq(timeout = 10.0)
+    client.unsubscribe()
+    if seq is None:
+        raise RuntimeError('No DAQ block received')
 
+    plt.figure()
+    plt.subplot(221)
+    plt.plot(daq['time_x'], daq['vc_a'])
+    plt.grid()
+    plt.xlabel('Time ($\mu$s)')
+    plt.ylabel('Amplitude (V)')
+    plt.subplot(222)
+    plt.plot(daq['time_x'], daq['vc_p'])
+    plt.grid()
+    plt.xlabel('Time ($\mu$s)')
+    plt.ylabel('Phase (deg)')
+    plt.subplot(223)
+    plt.plot(daq['spec_f'], daq['spec_a'])
+    plt.grid()
+    plt.xlabel('Freq (Hz)')
+    plt.ylabel('Mag (dB)')
+    plt.suptitle('DAQ block ' + str(seq))
+    plt.show()
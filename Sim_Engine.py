@@ -0,0 +1,593 @@
+#####################################################################
+#  Copyright (c) 2024 by Zheqiao Geng
+#  All rights reserved.
+#####################################################################
+#################################################################
+# Simulation engine of the beam loading compensation (model only,
+# no PVs). It runs in the simulation thread of Job_SimBLC or in a
+# child process, which returns the DAQ blocks via shared memory
+#################################################################
+import os
+import queue
+import traceback
+import numpy as np
+from multiprocessing import shared_memory
+
+from llrflibs.rf_noise import *
+
+from Cavity import *
+from Controller import *
+from Scenario import *
+from Param_Set import *
+from Recorder import *
+from Trigger import *
+from Decimator import *
+from Harmonic_Monitor import *
+from DAQ_Channels import *
+
+# =================================================
+# define the class
+# =================================================
+class Sim_Engine():
+    # -------------------------------------------
+    # class variables
+    # -------------------------------------------
+    DAQ_SIZE = 2**15            # buffer size for DAQ
+    SIM_BLK  = 2**8             # max number of samples simulated per block
+    DEC_SIZE = 2**12            # length of the decimated DAQ waveforms
+    HARM_UPD = 2**12            # samples between the updates of the harmonic monitor
+    DEC_UPD  = 2**14            # samples between the updates of the decimated DAQ
+    DAQ_KEYS = ['vc_if',        # VC IF, V
+                'vc_a',         # VC amplitude, V
+                'vc_p',         # VC phase, deg
+                'time_x',       # time x axis, us
+                'spec_f',       # VC IF spec freq, Hz
+                'spec_a']       # VC IF spec amplitude, dB
+
+    # parameters of the beam and cavity
+    DEFAULT_CFG = {'frf':       650e6,              # RF operation frequency, Hz
+                   'dw':        0,                  # cavity detuning, rad/s
+                   'RoQ':       106.5,              # R/Q (circular machine convence), Ohm
+                   'QL':        1.5e5,              # loaded quality factor
+                   'Qb':        1.6e-19 * 14e10,    # bunch charge, C
+                   'h':         216820 / 10,        # harmonic number
+                   'phb':       -50 * np.pi / 180,  # beam accelerating phase, rad
+                   'npsd':      -130.0,             # noise PSD, dB/Hz
+                   'fill':      None,               # relative bunch charges of the buckets, None for uniform
+                   'dec':       [16, 256],          # decimation factors of the multi-resolution DAQ
+                   'precision': 'double',           # 'double' or 'single' precision of the signals (see Precision)
+                   'vc_sp':     1e6,                # desired cavit voltage
+                   'vc_sp_pha': 30.0}               # desired cavity phase, deg
+
+    # -------------------------------------------
+    # construction
+    # Input: cfg     - dict of the beam and cavity parameters (see DEFAULT_CFG,
+    #                  missing ones take the default values)
+    #        publish - function called with a dict of DAQ waveforms (see
+    #                  DAQ_KEYS, and the enabled channels, see channel_keys)
+    #                  when a DAQ block is complete
+    #        publish_harm - function called with a dict of the harmonic
+    #                  monitor (harm_f, harm_a, harm_p) every HARM_UPD samples
+    #        publish_dec - function called with a dict of the decimated DAQ
+    #                  waveforms (see dec_keys) every DEC_UPD samples
+    # -------------------------------------------
+    def __init__(self, cfg = None, publish = None, publish_harm = None, publish_dec = None):
+        # parameters
+        self.cfg = dict(Sim_Engine.DEFAULT_CFG)
+        if cfg is not None:
+            self.cfg.update(cfg)
+        self.publish = publish
+        self.publish_harm = publish_harm
+        self.publish_dec  = publish_dec
+
+        self.vc_sp     = self.cfg['vc_sp']  # desired cavit voltage
+        self.vc_sp_pha = self.cfg['vc_sp_pha']  # desired cavity phase, deg
+        self.fb, self.fs, self.fif = derive_freqs(self.cfg)
+        self.rtype, self.ctype = get_types(self.cfg['precision'])
+        self.fb_enable = True               # enable feedback
+        self.ff_enable = True               # enable feedforward
+
+        # define the fill pattern, cavity and controller object
+        pattern = None
+        if self.cfg['fill'] is not None:
+            pattern = Beam_Pattern()
+            pattern.set_param(fs = self.fs, fb = self.fb, fill = self.cfg['fill'])
+
+        self.cav = Cavity()
+        self.ctl = Controller()
+        self.cav.set_param(frf       = self.cfg['frf'],
+                           RoQ       = self.cfg['RoQ'],
+                           QL        = self.cfg['QL'],
+                           detuning  = self.cfg['dw'] / 2 / np.pi,
+                           charge    = self.cfg['Qb'],
+                           fb        = self.fb,
+                           phib      = self.cfg['phb'] * 180 / np.pi,
+                           fs        = self.fs,
+                           fif       = self.fif,
+                           npsd      = self.cfg['npsd'],
+                           pattern   = pattern,
+                           precision = self.cfg['precision'])
+
+        # variables and buffers
+        self.param_cur = None               # parameter set in use
+        self.daq_id    = 0
+        self.sim_cnt   = 0                  # samples simulated since reset
+        self.sim_time  = 0.0
+        self.vact      = 0.0
+        self.scenario  = None               # scenario timeline (None for no scenario)
+        self.tables    = None               # notch/NCO tables of the controller
+        self.ctl_param = None               # parameters of the controller
+
+        self.trig     = Trigger()           # DAQ trigger (continuous DAQ by default)
+        self.trig_event = 0                 # events for the trigger at the next sample
+        self.rec      = Recorder()          # streaming recorder
+        self.rec_blk  = {ch: np.zeros(Sim_Engine.SIM_BLK, dtype = self.ctype if dt.startswith('complex') else self.rtype) \
+                         for ch, dt in Recorder.CHANNELS.items()}
+
+        self.dec      = Decimator()         # multi-resolution DAQ
+        self.dec.set_param(factors = self.cfg['dec'], nlen = Sim_Engine.DEC_SIZE, fs = self.fs)
+        self.blk_vc   = np.zeros(Sim_Engine.SIM_BLK, dtype = self.ctype)
+        self.harm     = Harmonic_Monitor()  # carrier and beam harmonic sidebands
+        self.harm.set_param(fs = self.fs, fb = self.fb, fif = self.fif, nh = Controller.MAX_NCH)
+        self.blk_vcif = np.zeros(Sim_Engine.SIM_BLK, dtype = self.rtype)
+
+        self.sig_vc   = np.zeros(Sim_Engine.DAQ_SIZE, dtype = self.ctype)   # raw history
+        self.sig_vcif = np.zeros(Sim_Engine.DAQ_SIZE, dtype = self.rtype)
+
+        self.chan     = []                  # optional DAQ channels enabled (see DAQ_Channels)
+        self.blk_chan = {}                  # samples of the block per channel
+        self.sig_chan = {}                  # raw history per channel
+
+    # -------------------------------------------
+    # apply a parameter set
+    # Input: ps - object of Param_Set
+    # -------------------------------------------
+    def set_param(self, ps):
+        self.param_cur = ps
+        self.ctl_param = dict(ps.ctl_param)
+        self.tables    = {k: v.copy() for k, v in ps.tables.items()}
+        self.ctl.set_param(notches   = ps.notches,
+                           ffncos    = ps.ffncos,
+                           precision = self.cfg['precision'],
+                           **self.ctl_param)
+
+    # -------------------------------------------
+    # switch the scenario
+    # Input: sc - object of Scenario (None for no scenario)
+    # -------------------------------------------
+    def set_scenario(self, sc):
+        self.scenario = sc
+
+    # -------------------------------------------
+    # reset
+    # -------------------------------------------
+    def reset(self):
+        self.cav.reset()
+        self.ctl.reset()
+
+        self.daq_id   = 0
+        self.sim_cnt  = 0
+        self.sim_time = 0.0
+        self.trig.reset()
+        self.dec.reset()
+        self.harm.reset()
+
+        if self.scenario is not None:
+            self.scenario.reset()
+
+        # continue the recording in a new file starting from sample 0
+        self.rec.cnt = 0
+        self.rec.rotate()
+
+    # -------------------------------------------
+    # set the DAQ trigger
+    # Input: par - dict of the parameters of Trigger.set_param (src = 0 for
+    #              continuous DAQ)
+    # Note: with a trigger, only the triggered windows (npre + npost samples)
+    #       are published and their spectrum calculated
+    # -------------------------------------------
+    def set_trigger(self, par):
+        self.trig.set_param(nmax = Sim_Engine.DAQ_SIZE, **par)
+        self.trig_event = 0
+
+    # -------------------------------------------
+    # enable the optional DAQ channels
+    # Input: mask - bit mask of the channels (see DAQ_Channels, 0 for none)
+    # Note: the histories of the channels are allocated here (they start
+    #       with zeros), nothing is done per block if no channel is enabled
+    # -------------------------------------------
+    def set_channels(self, mask):
+        self.chan     = channel_names(mask)
+        self.blk_chan = {ch: np.zeros(Sim_Engine.SIM_BLK,  dtype = self._chan_type(ch)) for ch in self.chan}
+        self.sig_chan = {ch: np.zeros(Sim_Engine.DAQ_SIZE, dtype = self._chan_type(ch)) for ch in self.chan}
+
+    # -------------------------------------------
+    # control the streaming recorder
+    # Input: op  - 'start', 'stop' or 'rotate'
+    #        arg - (prefix, channels, nmax) for 'start' (see Recorder.start)
+    # -------------------------------------------
+    def record(self, op, arg = None):
+        try:
+            if op == 'start':
+                prefix, channels, nmax = arg
+                self.rec.start(prefix, channels, nmax = nmax, fs = self.fs, cnt = self.sim_cnt,
+                               precision = self.cfg['precision'])
+            elif op == 'stop':
+                self.rec.stop()
+            elif op == 'rotate':
+                self.rec.rotate()
+        except (IOError, ValueError) as e:
+            print('ERROR: Recorder ' + op + ' failed: ' + str(e))
+
+    # -------------------------------------------
+    # simulate a block
+    # Output: n - number of samples simulated (0 if not initialized)
+    # -------------------------------------------
+    def run_block(self):
+        # check the init
+        if self.param_cur is None:
+            return 0
+
+        # apply the due scenario events and split the block at the next one
+        n = Sim_Engine.SIM_BLK
+        if self.scenario is not None:
+            for key, val in self.scenario.pop(self.sim_cnt):
+                self._apply_event(key, val)
+
+            pos = self.scenario.next_pos()
+            if pos >= 0:
+                n = min(n, pos - self.sim_cnt)
+
+        # do a block of simulation
+        self._sim_block(n)
+        return n
+
+    # -------------------------------------------
+    # private functions
+    # -------------------------------------------
+    def _sim_block(self, n):
+        # simulate n samples (no schedule checks inside)
+        vc_sp = self.vc_sp * np.exp(1j * self.vc_sp_pha * np.pi / 180.0)
+
+        rec = self.rec_blk if self.rec.active else None
+
+        # snapshot of the controller to derive the channels after the block
+        snap = self.ctl.snapshot() if self.chan else None
+        vact = self.vact
+
+        for i in range(n):
+            # do a step of simulation
+            vc_cav, vc_if, vf_if, vr_if = self.cav.sim_step(self.vact)
+            vc, self.vact = self.ctl.sim_step(vc_if,
+                                             vc_sp,
+                                             fb_enable = self.fb_enable,
+                                             ff_enable = self.ff_enable)
+
+            # collect the signals of the block
+            self.blk_vc[i]   = vc
+            self.blk_vcif[i] = vc_if
+            if rec is not None:
+                rec['vc'][i]      = vc_cav
+                rec['vc_meas'][i] = vc
+                rec['vc_if'][i]   = vc_if
+                rec['vf_if'][i]   = vf_if
+                rec['vr_if'][i]   = vr_if
+
+        # derive the channels, acquire the block, then update the simulation
+        # time (exact from the sample counter)
+        if snap is not None:
+            self._probe(n, snap, vact, vc_sp)
+        self._acquire(n)
+        self.sim_cnt  = self.sim_cnt + n
+        self.sim_time = self.sim_cnt / self.fs
+
+        # decimate the block and publish the histories regularly (also 
+        # between the triggered DAQ windows)
+        self.dec.push(self.blk_vc[:n])
+        if (self.publish_dec is not None) and \
+           (self.sim_cnt // Sim_Engine.DEC_UPD != (self.sim_cnt - n) // Sim_Engine.DEC_UPD):
+            self._publish_dec()
+
+        # update the harmonic monitor and publish it regularly
+        self.harm.push(self.blk_vcif[:n])
+        if (self.publish_harm is not None) and \
+           (self.sim_cnt // Sim_Engine.HARM_UPD != (self.sim_cnt - n) // Sim_Engine.HARM_UPD):
+            f, a, p = self.harm.get()
+            self.publish_harm({'harm_f': f, 'harm_a': a, 'harm_p': p})
+
+        # append the block to the recording
+        if rec is not None:
+            self.rec.append({ch: v[:n] for ch, v in rec.items()})
+
+    def _acquire(self, n):
+        # copy the raw samples of the block to the circular history and 
+        # publish the windows ending in the block: a triggered window is 
+        # complete, or the buffer is full (continuous)
+        if self.trig.src != 0:
+            vc   = self.blk_vc[:n]
+            ends = self.trig.step_block(np.abs(vc), np.angle(vc, deg = True), 
+                                        self.vc_sp, self.vc_sp_pha, self.trig_event)
+            nwin = self.trig.npre + self.trig.npost
+            self.trig_event = 0
+        else:
+            ends = list(range(Sim_Engine.DAQ_SIZE - 1 - self.daq_id, n, Sim_Engine.DAQ_SIZE))
+            nwin = Sim_Engine.DAQ_SIZE
+
+        # copy up to the end of each window and publish it, then the rest
+        i = 0
+        for j in ends:
+            self._copy(i, j + 1)
+            self._publish_daq(nwin, self.sim_cnt + j + 1)
+            i = j + 1
+        self._copy(i, n)
+
+    def _copy(self, i, e):
+        # copy the samples i ... e-1 of the block to the circular history 
+        # (in two parts at the wrap)
+        while i < e:
+            k = self.daq_id
+            m = min(e - i, Sim_Engine.DAQ_SIZE - k)
+            self.sig_vc  [k:k+m] = self.blk_vc  [i:i+m]
+            self.sig_vcif[k:k+m] = self.blk_vcif[i:i+m]
+            for ch in self.chan:
+                self.sig_chan[ch][k:k+m] = self.blk_chan[ch][i:i+m]
+            self.daq_id = (k + m) % Sim_Engine.DAQ_SIZE
+            i += m
+
+    def _publish_daq(self, n, cnt):
+        # publish the last n samples of the history, cnt is the number of 
+        # samples simulated up to its end (the full buffer as it is)
+        if self.publish is None:
+            return
+
+        if n == Sim_Engine.DAQ_SIZE and self.daq_id == 0:
+            idx = slice(None)
+        else:
+            idx = (self.daq_id - n + np.arange(n)) % Sim_Engine.DAQ_SIZE
+        vc, vc_if = self.sig_vc[idx], self.sig_vcif[idx]
+
+        # derive the amplitude/phase and the time axis (time of the samples 
+        # as the simulation time after them) of the window
+        time_x = (cnt - n + 1 + np.arange(n)) / self.fs
+
+        #result = calc_psd_coherent(vc_if, fs = self.fs, n_noniq = 8)
+        result = calc_psd(vc_if, fs = self.fs)
+        daq = {'vc_if':  vc_if,
+               'vc_a':   np.abs(vc),
+               'vc_p':   np.angle(vc, deg = True),
+               'time_x': time_x,
+               'spec_f': result['freq'],
+               'spec_a': result['amp_resp']}
+
+        # add the enabled channels
+        for ch in self.chan:
+            daq.update(channel_waveforms(ch, self.sig_chan[ch][idx]))
+        self.publish(daq)
+
+    def _publish_dec(self):
+        # publish the latest histories of the decimation stages
+        dec = {}
+        for k in range(self.dec.nstage):
+            vc, tx = self.dec.get(k)
+            dec['vc_a_d'   + str(k+1)] = np.abs(vc)
+            dec['vc_p_d'   + str(k+1)] = np.angle(vc, deg = True)
+            dec['time_x_d' + str(k+1)] = tx
+        self.publish_dec(dec)
+
+    def _probe(self, n, snap, vact, vc_sp):
+        # derive the channels of the block: the controller is replayed from
+        # its snapshot, the cavity drive is the actuation of the sample before
+        sig   = self.ctl.probe_block(snap, self.blk_vc[:n], vc_sp,
+                                     fb_enable = self.fb_enable,
+                                     ff_enable = self.ff_enable)
+        drive = np.concatenate(([vact], sig['vf_if'][:-1]))
+        sig['vf_if'] = drive
+        sig['vr_if'] = self.blk_vcif[:n] - drive
+        for k, x in enumerate(sig.pop('ctl_notch')):
+            sig['ctl_notch' + str(k+1)] = x
+
+        for ch in self.chan:
+            self.blk_chan[ch][:n] = sig.get(ch, 0.0)
+
+    def _chan_type(self, ch):
+        # type of the samples of a channel
+        return self.ctype if CHANNELS[ch][1] == 'complex' else self.rtype
+
+    def _set_ctl(self):
+        # set the controller with the parameters and the notch/NCO tables
+        notches, ffncos = build_ctl_tables(self.tables, self.fb)
+        self.ctl.set_param(notches   = notches,
+                           ffncos    = ffncos,
+                           precision = self.cfg['precision'],
+                           **self.ctl_param)
+
+    def _apply_event(self, key, val):
+        # apply a scenario event (and mark it for the trigger)
+        self.trig_event |= Trigger.SRC_SCENARIO
+        if key == 'vc_sp':
+            self.vc_sp = val
+        elif key == 'vc_sp_pha':
+            self.vc_sp_pha = val
+        elif key == 'charge':
+            self.cav.set_charge(val)
+            self.trig_event |= Trigger.SRC_BEAM
+        elif key == 'fb_enable':
+            self.fb_enable = bool(val)
+        elif key == 'ff_enable':
+            self.ff_enable = bool(val)
+        elif key in ('Kp', 'Ki'):
+            self.ctl_param[key] = val
+            self._set_ctl()
+        elif key in Scenario.TABLE_KEYS:
+            self.tables[key] = np.array(val)
+            self._set_ctl()
+        else:
+            raise ValueError('Unknown scenario key: ' + str(key))
+
+# =================================================
+# names of the decimated DAQ waveforms (vc_a_d<k>, vc_p_d<k>, time_x_d<k>
+# for stage k = 1, 2, ...)
+# Input:  cfg  - dict of the beam and cavity parameters
+# Output: keys - list of the names
+# =================================================
+def dec_keys(cfg):
+    keys = []
+    for k in range(len(cfg.get('dec', Sim_Engine.DEFAULT_CFG['dec']))):
+        keys += ['vc_a_d' + str(k+1), 'vc_p_d' + str(k+1), 'time_x_d' + str(k+1)]
+    return keys
+
+# =================================================
+# derive the frequencies of the station
+# Input:  cfg - dict of the beam and cavity parameters
+# Output: fb  - bunch repitition rate, Hz
+#         fs  - sampling frequency, Hz
+#         fif - IF frequency, Hz
+# =================================================
+def derive_freqs(cfg):
+    fb = cfg['frf'] / cfg['h']
+    return fb, 4000 * fb, 500 * fb
+
+# =================================================
+# engine in a child process, connected to its job by queues and 
+# shared-memory DAQ rings
+# Input: cfg      - dict of the beam and cavity parameters
+#        cmd_q    - queue of commands ('param', Param_Set), ('scenario',
+#                   Scenario), ('reset', None), ('trigger', dict),
+#                   ('record', (op, arg)), ('channels', mask) and 
+#                   ('stop', None)
+#        daq_q    - queue to notify ('daq', (slot, seq, lengths of the
+#                   DAQ_KEYS waveforms)) of a DAQ block in the rings, to 
+#                   pass a new channel ring ('chan_ring', (shm name, keys 
+#                   of the channel waveforms), None for no channel), the
+#                   harmonic monitor ('harm', dict) or the decimated DAQ
+#                   ('dec', dict), to report the failure of the process 
+#                   ('error', traceback) or the end of the engine ('stop',
+#                   None)
+#        shm_name - name of the shared memory of the DAQ ring (DAQ_KEYS)
+#        nslot    - number of slots in the rings
+#        free_sem - semaphore counting the free slots (released by the IOC
+#                   side after publishing a slot)
+# Note: if no slot is free, the DAQ block is dropped instead of stalling
+#       the simulation. The enabled channels are in a ring of their own
+#       (same slots, as long as the window of vc_if), created here for the
+#       channels at each ('channels', mask) and released by the IOC side 
+#       after the DAQ blocks before it are published
+# =================================================
+class Remote_Engine():
+    def __init__(self, cfg, cmd_q, daq_q, shm_name, nslot, free_sem):
+        self.cmd_q    = cmd_q
+        self.daq_q    = daq_q
+        self.free_sem = free_sem
+        self.nslot    = nslot
+        self.eng      = Sim_Engine(cfg, self._publish, self._publish_harm, self._publish_dec)
+        self.shm      = shared_memory.SharedMemory(name = shm_name)
+        self.ring     = np.ndarray((nslot, len(Sim_Engine.DAQ_KEYS), Sim_Engine.DAQ_SIZE),
+                                   dtype = float, buffer = self.shm.buf)
+        self.chan_shm  = None               # shared memory of the channel ring (None for no channel)
+        self.chan_ring = None
+        self.chan_keys = []                 # keys of the channel waveforms in the ring
+        self.slot     = 0
+        self.seq      = 0
+        self.stopped  = False
+
+    # handle the pending commands
+    def poll(self, wait = 0.0):
+        while not self.stopped:
+            try:
+                cmd, arg = self.cmd_q.get(block = (wait > 0.0), timeout = wait or None)
+            except queue.Empty:
+                break
+            wait = 0.0
+
+            if cmd == 'param':
+                self.eng.set_param(arg)
+            elif cmd == 'scenario':
+                self.eng.set_scenario(arg)
+            elif cmd == 'reset':
+                self.eng.reset()
+            elif cmd == 'trigger':
+                self.eng.set_trigger(arg)
+            elif cmd == 'record':
+                self.eng.record(*arg)
+            elif cmd == 'channels':
+                self._set_channels(arg)
+            elif cmd == 'stop':
+                self.close()
+
+    # release the shared memory (and close the recording)
+    def close(self):
+        self.stopped = True
+        self.eng.record('stop')
+        del self.ring
+        self.shm.close()
+        self._close_chan()
+        self.daq_q.put(('stop', None))
+
+    # enable the channels and move them to a new ring sized for them
+    def _set_channels(self, mask):
+        self.eng.set_channels(mask)
+        self._close_chan()
+        self.chan_keys = [key for key, _, _ in channel_keys(self.eng.chan)]
+        if self.chan_keys:
+            self.chan_shm  = shared_memory.SharedMemory(create = True, 
+                                 size = self.nslot * len(self.chan_keys) * Sim_Engine.DAQ_SIZE * 8)
+            self.chan_ring = np.ndarray((self.nslot, len(self.chan_keys), Sim_Engine.DAQ_SIZE),
+                                        dtype = float, buffer = self.chan_shm.buf)
+        self.daq_q.put(('chan_ring', (self.chan_shm.name if self.chan_shm else None, self.chan_keys)))
+
+    # detach from the channel ring (unlinked by the IOC side)
+    def _close_chan(self):
+        if self.chan_shm is not None:
+            self.chan_ring = None
+            self.chan_shm.close()
+            self.chan_shm  = None
+
+    # copy a DAQ block into the next slot of the rings
+    def _publish(self, daq):
+        if not self.free_sem.acquire(block = False):
+            return
+        lens = [len(daq[key]) for key in Sim_Engine.DAQ_KEYS]
+        for i, key in enumerate(Sim_Engine.DAQ_KEYS):
+            self.ring[self.slot, i, :lens[i]] = daq[key]
+        for i, key in enumerate(self.chan_keys):
+            self.chan_ring[self.slot, i, :lens[0]] = daq[key]
+        self.daq_q.put(('daq', (self.slot, self.seq, lens)))
+        self.slot = (self.slot + 1) % self.nslot
+        self.seq += 1
+
+    # pass the harmonic monitor (small arrays) by the queue
+    def _publish_harm(self, harm):
+        self.daq_q.put(('harm', harm))
+
+    # pass the decimated DAQ (DEC_SIZE arrays, every DEC_UPD samples) by the queue
+    def _publish_dec(self, dec):
+        self.daq_q.put(('dec', dec))
+
+# =================================================
+# main loop of a child process running one or more engines round-robin
+# Input: engines - list of the arguments of Remote_Engine, one per job
+#        cpus    - list of CPU ids to pin the process to (None for no pinning)
+# Note: an exception ends the process after passing its traceback to
+#       every job ('error', str)
+# =================================================
+def engine_process(engines, cpus = None):
+    try:
+        if cpus is not None and hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, cpus)
+
+        engs = [Remote_Engine(*args) for args in engines]
+        while len(engs) > 0:
+            # handle the commands (wait for them if nothing to simulate)
+            idle = all(e.eng.param_cur is None for e in engs)
+            for e in engs:
+                e.poll(wait = 0.1 / len(engs) if idle else 0.0)
+
+            # do a block of simulation per engine
+            engs = [e for e in engs if not e.stopped]
+            for e in engs:
+                e.eng.run_block()
+    except Exception:
+        msg = traceback.format_exc()
+        for args in engines:
+            args[2].put(('error', msg))
+        raise
@@ -8,6 +8,7 @@
 from ooepics.Application import *
 
 from Job_SimBLC import *
+from Worker_Pool import *
 
 # =================================
 # assemble the soft IOC
@@ -15,10 +16,22 @@ from Job_SimBLC import *
 class Softioc_Top:
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     # create the object
+    #   njob    - number of simulation jobs ("JOBSIM" for one job, otherwise
+    #             "JOBSIM1" ... "JOBSIMN", each with its own PV name space)
+    #   cfgs    - list of the beam and cavity parameters of the jobs (see
+    #             Sim_Engine.DEFAULT_CFG), None for default
+    #   nworker - number of workers running the jobs (None for one per job)
+    #   mode    - 'process' or 'thread' workers
+    #   cpus    - list of CPU ids to pin the workers to (None for no pinning)
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
-    def __init__(self, moduleName):
+    def __init__(self, moduleName, njob = 1, cfgs = None, nworker = None, mode = 'process', cpus = None):
         # remember input
         self.moduleName = moduleName            # "moduleName" is the first part of the local PV names
+        self.njob       = njob
+        self.cfgs       = cfgs
+        self.nworker    = njob if nworker is None else nworker
+        self.mode       = mode
+        self.cpus       = cpus
 
         # --------
         # define an application - the run coordinator
@@ -36,7 +49,19 @@ class Softioc_Top:
         #       2ed: job name, used to define local PV names
         #       3rd: object of service for run-time message log
         #       4,5th: objects of RF station services for two stations
-        self.jobSimBLC = Job_SimBLC(self.moduleName, "JOBSIM")
+        #       use_process: run the simulation engine in a child process
+        #       cfg: beam and cavity parameters
+        self.pool = Worker_Pool(nworker = self.nworker, mode = mode, cpus = cpus)
+        self.jobs = []
+        for i in range(njob):
+            jobName = "JOBSIM" if njob == 1 else "JOBSIM" + str(i + 1)
+            job     = Job_SimBLC(self.moduleName, jobName,
+                                 use_process = (mode == 'process'),
+                                 cfg         = None if cfgs is None else cfgs[i])
+            self.pool.add(job)
+            self.jobs.append(job)
+
+        self.jobSimBLC = self.jobs[0]
 
         # --------
         # register jobs to the application
@@ -44,14 +69,19 @@ class Softioc_Top:
         #   parameters:
         #       1st: the object of a job
         #       2ed: commands that the job needs to handle, the string will appear in the command PV name
-        self.appTest.registJob(self.jobSimBLC, ["SET-PARAM", "RESET"])
+        for job in self.jobs:
+            self.appTest.registJob(job, ["SET-PARAM", "RESET", "LOAD-SCENARIO", "SET-PARAM-ARRAY",
+                                          "REC-START", "REC-STOP", "REC-ROTATE", "SET-TRIGGER",
+                                          "AUTO-TUNE", "SET-DAQ-CHAN"])
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     # run the soft IOC thread
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     def run(self):
         self.appTest.letGoing()           # each application is driven by a thread
-        self.jobSimBLC.letGoing()         # start the simulation thread
+        for job in self.jobs:
+            job.letGoing()                # start the DAQ threads of the jobs
+        self.pool.letGoing()              # start the workers running the simulation
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~
     # generate the run script
@@ -74,15 +104,30 @@ class Softioc_Top:
         ssFile.write("# -------------------------------------------\n")
         ssFile.write("from Softioc_Top import *\n\n")
 
-        ssFile.write("# configure the environment\n")
-        ssFile.write('sIOC = Softioc_Top("' + self.moduleName + '")\n\n')
-
-        ssFile.write("# connect to all PVs\n")
-        ssFile.write("RemotePV.connect()\n\n")
-        ssFile.write("# run the soft ioc\n")
-        ssFile.write("sIOC.run()\n\n")
-
-
-
+        ssFile.write("# the guard is needed as the simulation runs in a child process\n")
+        ssFile.write('if __name__ == "__main__":\n')
+        ssFile.write("    # configure the environment\n")
+        ssFile.write('    sIOC = Softioc_Top("' + self.moduleName + '", ' + \
+                     'njob = '    + str(self.njob)    + ', ' + \
+                     'cfgs = '    + repr(_literal(self.cfgs)) + ', ' + \
+                     'nworker = ' + str(self.nworker) + ', ' + \
+                     'mode = "'   + self.mode         + '", ' + \
+                     'cpus = '    + str(self.cpus)    + ')\n\n')
 
+        ssFile.write("    # connect to all PVs\n")
+        ssFile.write("    RemotePV.connect()\n\n")
+        ssFile.write("    # run the soft ioc\n")
+        ssFile.write("    sIOC.run()\n\n")
 
+# =================================
+# convert the numpy arrays/scalars of a structure to lists/numbers (the
+# repr of the result is a Python literal)
+# =================================
+def _literal(x):
+    if isinstance(x, dict):
+        return {k: _literal(v) for k, v in x.items()}
+    if isinstance(x, (list, tuple)):
+        return [_literal(v) for v in x]
+    if hasattr(x, 'tolist'):
+        return x.tolist()
+    return x
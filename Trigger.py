@@ -0,0 +1,159 @@
+#####################################################################
+#  Copyright (c) 2024 by Zheqiao Geng
+#  All rights reserved.
+#####################################################################
+#################################################################
+# Trigger of the DAQ: selects the windows (pre/post-trigger
+# samples) to publish based on the amplitude/phase errors, beam
+# events or scenario events
+#################################################################
+import numpy as np
+
+# =================================================
+# define the class
+# =================================================
+class Trigger():
+    # -------------------------------------------
+    # class variables (trigger sources, bit mask)
+    # -------------------------------------------
+    SRC_AMP      = 1        # relative amplitude error above threshold
+    SRC_PHA      = 2        # phase error above threshold
+    SRC_BEAM     = 4        # beam event (bunch charge changed)
+    SRC_SCENARIO = 8        # any scenario event
+
+    # -------------------------------------------
+    # construction
+    # -------------------------------------------
+    def __init__(self):
+        # init variables
+        self.src   = 0          # trigger sources, 0 for continuous DAQ
+        self.npre  = 0          # number of pre-trigger samples
+        self.npost = 1          # number of post-trigger samples (incl. the trigger sample)
+        self.ntrig = 0          # number of triggers
+        self.reset()
+
+    # -------------------------------------------
+    # set parameters
+    # Input: src     - bit mask of the trigger sources (0 for continuous DAQ)
+    #        amp_thr - threshold of the relative amplitude error
+    #        pha_thr - threshold of the phase error, deg
+    #        npre    - number of pre-trigger samples
+    #        npost   - number of post-trigger samples (incl. the trigger sample)
+    #        nmax    - max window length (size of the history buffer)
+    # Note: the window is limited to nmax samples by shortening the
+    #       pre-trigger part
+    # -------------------------------------------
+    def set_param(self, src     = 0,
+                        amp_thr = 0.01,
+                        pha_thr = 1.0,
+                        npre    = 2**13,
+                        npost   = 2**14,
+                        nmax    = 2**15):
+        # store the results
+        self.src     = int(src)
+        self.amp_thr = amp_thr
+        self.pha_thr = pha_thr
+        self.npost   = int(min(max(npost, 1), nmax))
+        self.npre    = int(min(max(npre,  0), nmax - self.npost))
+
+        # rearm
+        self.reset()
+
+    # -------------------------------------------
+    # reset (rearm and wait for the pre-trigger history)
+    # -------------------------------------------
+    def reset(self):
+        self.nhist = 0          # samples collected since armed
+        self.post  = 0          # post-trigger samples to collect (0 if armed)
+
+    # -------------------------------------------
+    # check a sample
+    # Input:  vc_a      - amplitude of the cavity voltage, V
+    #         vc_p      - phase of the cavity voltage, deg
+    #         vc_sp     - setpoint amplitude, V
+    #         vc_sp_pha - setpoint phase, deg
+    #         event     - bit mask of the events at this sample (SRC_BEAM,
+    #                     SRC_SCENARIO)
+    # Output: True if a window is complete (it ends with this sample)
+    # -------------------------------------------
+    def step(self, vc_a, vc_p, vc_sp, vc_sp_pha, event = 0):
+        self.nhist += 1
+
+        # check the trigger (when armed and the pre-trigger history is there)
+        if (self.post == 0) and (self.nhist > self.npre):
+            if self._fire(vc_a, vc_p, vc_sp, vc_sp_pha, event):
+                self.ntrig += 1
+                self.post   = self.npost
+
+        # collect the post-trigger samples, rearm when the window is complete
+        if self.post > 0:
+            self.post -= 1
+            if self.post == 0:
+                self.nhist = 0
+                return True
+        return False
+
+    # -------------------------------------------
+    # check a block of samples (the same as step for each sample)
+    # Input:  vc_a      - amplitude array of the cavity voltage, V
+    #         vc_p      - phase array of the cavity voltage, deg
+    #         vc_sp     - setpoint amplitude, V
+    #         vc_sp_pha - setpoint phase, deg
+    #         event     - bit mask of the events at the first sample
+    # Output: ends      - offsets of the samples ending a complete window
+    # Note: the threshold checks are vectorized, the loop only runs over 
+    #       the state changes (triggers and complete windows)
+    # -------------------------------------------
+    def step_block(self, vc_a, vc_p, vc_sp, vc_sp_pha, event = 0):
+        n    = len(vc_a)
+        fire = self._fire_block(vc_a, vc_p, vc_sp, vc_sp_pha)
+        if (n > 0) and (event & self.src):
+            fire[0] = True
+
+        ends = []
+        i    = 0
+        while i < n:
+            # armed: look for a trigger after the pre-trigger history
+            if self.post == 0:
+                j0   = i + max(self.npre - self.nhist, 0)
+                cand = np.flatnonzero(fire[j0:]) if j0 < n else []
+                if len(cand) == 0:
+                    self.nhist += n - i
+                    break
+                j           = j0 + cand[0]
+                self.nhist += j - i
+                self.ntrig += 1
+                self.post   = self.npost
+                i           = j
+
+            # collect the post-trigger samples, rearm when the window is complete
+            m           = min(self.post, n - i)
+            self.nhist += m
+            self.post  -= m
+            i          += m
+            if self.post == 0:
+                self.nhist = 0
+                ends.append(i - 1)
+        return ends
+
+    # -------------------------------------------
+    # private functions
+    # -------------------------------------------
+    def _fire_block(self, vc_a, vc_p, vc_sp, vc_sp_pha):
+        fire = np.zeros(len(vc_a), dtype = bool)
+        if self.src & Trigger.SRC_AMP:
+            fire |= np.abs(vc_a - vc_sp) > self.amp_thr * vc_sp
+        if self.src & Trigger.SRC_PHA:
+            fire |= np.abs((vc_p - vc_sp_pha + 180.0) % 360.0 - 180.0) > self.pha_thr
+        return fire
+
+    def _fire(self, vc_a, vc_p, vc_sp, vc_sp_pha, event):
+        if event & self.src:
+            return True
+        if (self.src & Trigger.SRC_AMP) and (abs(vc_a - vc_sp) > self.amp_thr * vc_sp):
+            return True
+        if (self.src & Trigger.SRC_PHA) and \
+           (abs((vc_p - vc_sp_pha + 180.0) % 360.0 - 180.0) > self.pha_thr):
+            return True
+        return False
+
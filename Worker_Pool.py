@@ -0,0 +1,105 @@
+#####################################################################
+#  Copyright (c) 2024 by Zheqiao Geng
+#  All rights reserved.
+#####################################################################
+#################################################################
+# Worker pool running several simulation jobs with a bounded
+# number of threads or processes
+#################################################################
+import os
+import time
+import queue
+import threading
+import multiprocessing
+
+from Sim_Engine import *
+
+# =================================================
+# define the class
+# =================================================
+class Worker_Pool():
+    # -------------------------------------------
+    # construction
+    # Input: nworker - number of worker threads/processes
+    #        mode    - 'thread': the engines run in this process, the worker
+    #                  threads take the jobs round-robin block by block
+    #                  'process': the engines are distributed over nworker
+    #                  child processes, each runs its engines round-robin
+    #        cpus    - list of CPU ids for the workers (worker i is pinned to
+    #                  cpus[i % len(cpus)]), None for no pinning
+    # -------------------------------------------
+    def __init__(self, nworker = 1, mode = 'process', cpus = None):
+        # init variables
+        self.nworker = max(1, int(nworker))
+        self.mode    = mode
+        self.cpus    = cpus
+        self.jobs    = []                   # jobs on the pool
+        self.workers = []                   # worker threads/processes
+        self.job_q   = queue.Queue()        # jobs ready to run a block (thread mode)
+
+    # -------------------------------------------
+    # add a job (to be done before starting)
+    # Input: job - object of Job_SimBLC, use_process must match the mode
+    # -------------------------------------------
+    def add(self, job):
+        if job.use_process != (self.mode == 'process'):
+            raise ValueError('Job mode does not match the pool mode ' + self.mode)
+
+        job.pool = self
+        self.jobs.append(job)
+
+    # -------------------------------------------
+    # start the workers
+    # -------------------------------------------
+    def letGoing(self):
+        if self.mode == 'process':
+            # distribute the engines over the child processes
+            ctx = multiprocessing.get_context('spawn')
+            for job in self.jobs:
+                job.open_ring()
+
+            for i in range(min(self.nworker, len(self.jobs))):
+                args = [job.engine_args() for job in self.jobs[i::self.nworker]]
+                proc = ctx.Process(target = engine_process,
+                                   args   = (args, self._cpus(i)),
+                                   daemon = True,
+                                   name   = "PRC-POOL" + str(i + 1))
+                proc.start()
+                self.workers.append(proc)
+        else:
+            for job in self.jobs:
+                self.job_q.put(job)
+
+            for i in range(self.nworker):
+                trd = threading.Thread(target = self._run_thread,
+                                       args   = (self._cpus(i),),
+                                       daemon = True,
+                                       name   = "TRD-POOL" + str(i + 1))
+                trd.start()
+                self.workers.append(trd)
+
+        print('INFO: Worker pool started with ' + str(len(self.workers)) + ' ' + self.mode + ' workers.')
+
+    # -------------------------------------------
+    # private functions
+    # -------------------------------------------
+    def _cpus(self, i):
+        # CPU set of worker i
+        if self.cpus is None or len(self.cpus) == 0:
+            return None
+        return [self.cpus[i % len(self.cpus)]]
+
+    def _run_thread(self, cpus):
+        # pin the thread (Linux: pid 0 is the calling thread)
+        if cpus is not None and hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, cpus)
+
+        # take a job, simulate a block and put it back
+        while True:
+            job = self.job_q.get()
+            n   = job.run_once()
+            self.job_q.put(job)
+
+            # wait
+            time.sleep(0.00001 if n > 0 else 0.1 / len(self.jobs))
+